@@ -1,13 +1,14 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
+import logging
 import math
+import time
 from typing import List, Optional
 
 import torch
 from torch import nn
 from torch.nn import functional as F
 from torchmetrics.classification import MulticlassAccuracy
-from tqdm import tqdm
 
 from GPT_SoVITS.AR.models.utils import (
     dpo_loss,
@@ -21,6 +22,8 @@ from GPT_SoVITS.AR.models.utils import (
 from GPT_SoVITS.AR.modules.embedding import SinePositionalEmbedding, TokenEmbedding
 from GPT_SoVITS.AR.modules.transformer import LayerNorm, TransformerEncoder, TransformerEncoderLayer
 
+logger = logging.getLogger(__name__)
+
 default_config = {
     "embedding_dim": 512,
     "hidden_dim": 512,
@@ -34,6 +37,18 @@ default_config = {
 }
 
 
+def record_step_time(timings: Optional[dict], idx: int, start: float):
+    # fills the t2s part of a TTS request's timings dict, see TTS_infer_pack/metrics.py
+    if timings is None:
+        return
+    elapsed = time.perf_counter() - start
+    if idx == 0:
+        timings["t2s_prefill"] = timings.get("t2s_prefill", 0.0) + elapsed
+    else:
+        timings["t2s_decode"] = timings.get("t2s_decode", 0.0) + elapsed
+        timings["t2s_tokens"] = timings.get("t2s_tokens", 0) + 1
+
+
 # @torch.jit.script ## 使用的话首次推理会非常慢，而且推理速度不稳定
 # Efficient implementation equivalent to the following:
 def scaled_dot_product_attention(
@@ -220,6 +235,56 @@ class T2SBlock:
         )
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: torch.Tensor,
+        v_cache: torch.Tensor,
+        pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        # k_cache/v_cache: preallocated (batch, heads, max_len, head_dim), filled up to `pos`
+        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+
+        batch_size = q.shape[0]
+        q_len = q.shape[1]
+        kv_len = pos + q_len
+
+        q = q.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k_cache[:, :, pos:kv_len] = k.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        v_cache[:, :, pos:kv_len] = v.view(batch_size, q_len, self.num_heads, -1).transpose(1, 2)
+        k = k_cache[:, :, :kv_len]
+        v = v_cache[:, :, :kv_len]
+        if attn_mask is not None:
+            attn_mask = attn_mask[:, :, :, :kv_len]
+
+        if torch_sdpa:
+            attn = F.scaled_dot_product_attention(q, k, v, (~attn_mask) if attn_mask is not None else None)
+        else:
+            attn = scaled_dot_product_attention(q, k, v, attn_mask)
+
+        attn = attn.transpose(1, 2).reshape(batch_size, q_len, -1)
+        attn = F.linear(attn, self.out_w, self.out_b)
+
+        x = x + attn
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w1,
+            self.norm_b1,
+            self.norm_eps1,
+        )
+        x = x + self.mlp.forward(x)
+        x = F.layer_norm(
+            x,
+            [self.hidden_dim],
+            self.norm_w2,
+            self.norm_b2,
+            self.norm_eps2,
+        )
+        return x
+
 
 @torch.jit.script
 class T2STransformer:
@@ -256,6 +321,39 @@ class T2STransformer:
             )
         return x, k_cache, v_cache
 
+    def init_static_kv_cache(self, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor], max_len: int):
+        # copy the (batch, seq, hidden) caches of process_prompt into (batch, heads, max_len, head_dim) buffers
+        static_k_cache: List[torch.Tensor] = []
+        static_v_cache: List[torch.Tensor] = []
+        for i in range(self.num_blocks):
+            batch_size = k_cache[i].shape[0]
+            seq_len = k_cache[i].shape[1]
+            num_heads = self.blocks[i].num_heads
+            k = k_cache[i].view(batch_size, seq_len, num_heads, -1).transpose(1, 2)
+            v = v_cache[i].view(batch_size, seq_len, num_heads, -1).transpose(1, 2)
+            k_buffer = torch.zeros(
+                (batch_size, k.shape[1], max_len, k.shape[-1]), dtype=k.dtype, device=k.device
+            )
+            v_buffer = torch.zeros_like(k_buffer)
+            k_buffer[:, :, :seq_len] = k
+            v_buffer[:, :, :seq_len] = v
+            static_k_cache.append(k_buffer)
+            static_v_cache.append(v_buffer)
+        return static_k_cache, static_v_cache
+
+    def decode_next_token_static(
+        self,
+        x: torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        pos: int,
+        attn_mask: Optional[torch.Tensor] = None,
+        torch_sdpa: bool = True,
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], pos, attn_mask, torch_sdpa)
+        return x
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -530,7 +628,7 @@ class Text2SemanticDecoder(nn.Module):
         x_len = x.shape[1]
         x_attn_mask = torch.zeros((x_len, x_len), dtype=torch.bool)
         stop = False
-        for _ in tqdm(range(1500)):
+        for _ in range(1500):
             y_emb = self.ar_audio_embedding(y)
             y_pos = self.ar_audio_position(y_emb)
             # x 和逐渐增长的 y 一起输入给模型
@@ -556,7 +654,7 @@ class Text2SemanticDecoder(nn.Module):
             samples = topk_sampling(logits, top_k=top_k, top_p=1.0, temperature=temperature)
 
             if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
-                print("use early stop num:", early_stop_num)
+                logger.debug("use early stop num: %s", early_stop_num)
                 stop = True
 
             if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
@@ -565,8 +663,8 @@ class Text2SemanticDecoder(nn.Module):
             if stop:
                 if prompts.shape[1] == y.shape[1]:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                    print("bad zero prediction")
-                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                    logger.warning("bad zero prediction")
+                logger.debug("T2S Decoding EOS [%s -> %s]", prefix_len, y.shape[1])
                 break
             # 本次生成的 semantic_ids 和之前的 y 构成新的 y
             # print(samples.shape)#[1,1]#第一个1是bs
@@ -580,6 +678,87 @@ class Text2SemanticDecoder(nn.Module):
         # 错位
         return targets[:, :-1], targets
 
+    def build_prompt_kv_cache(
+        self,
+        prompt_phones: torch.LongTensor,
+        prompt_bert_feature: torch.Tensor,
+        prompts: torch.LongTensor,
+    ):
+        """
+        Experimental: prefill the reference prompt on its own, so requests using the same voice only
+        prefill their target text.
+
+        The cache holds the per-layer K/V of [prompt phones ; prompt semantic tokens except the last one].
+        This is not the attention layout the model was trained on: in training every phone, those of
+        the prompt included, attends to all of the phones, target text included, so no part of the
+        input can be prefilled without the target text. Here the prompt positions do not see it, and
+        the output differs from `process_prompt` over the full input. The last prompt token is fed again
+        with the target text (see `process_prompt_with_kv_cache`), so generation still sees all of it.
+        Only used when a request opts in (TTS inputs["experimental_prompt_kv_cache"]), see
+        examples/benchmark_prompt_kv_cache.py for its speed and its agreement with the exact prefill.
+
+        Args:
+            prompt_phones (torch.LongTensor): (1, prompt_x_len) prompt phoneme IDs.
+            prompt_bert_feature (torch.Tensor): (1, 1024, prompt_x_len) prompt BERT features.
+            prompts (torch.LongTensor): (1, prompt_y_len) prompt semantic tokens.
+        Returns:
+            dict: k_cache/v_cache lists and the prompt lengths x_len/y_len.
+        """
+        x = self.ar_text_embedding(prompt_phones)
+        x = x + self.bert_proj(prompt_bert_feature.transpose(1, 2))
+        x = self.ar_text_position(x)
+        y_emb = self.ar_audio_embedding(prompts[:, :-1])
+        y_pos = self.ar_audio_position(y_emb)
+        xy_pos = torch.concat([x, y_pos], dim=1)
+
+        x_len = x.shape[1]
+        y_len = y_pos.shape[1]
+        src_len = x_len + y_len
+        x_attn_mask = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool, device=x.device), (0, y_len), value=True
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = torch.concat([x_attn_mask, y_attn_mask], dim=0)
+        xy_attn_mask = xy_attn_mask.unsqueeze(0).expand(self.num_head, -1, -1).view(1, self.num_head, src_len, src_len)
+
+        _, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        return {"k_cache": k_cache, "v_cache": v_cache, "x_len": x_len, "y_len": prompts.shape[1]}
+
+    def process_prompt_with_kv_cache(self, xy_pos: torch.Tensor, x_len: int, prompt_kv_cache: dict):
+        """
+        Replacement for `t2s_transformer.process_prompt` when the reference prompt is already cached.
+
+        `xy_pos` is the usual [prompt phones ; target phones ; prompt semantic] input of a single sequence.
+        Only the target phones and the last prompt token are run; the target phones attend to the
+        phones, the last prompt token to everything. The returned caches have the same length as the
+        ones of `process_prompt`, so the decode loop is unchanged.
+        """
+        prompt_x_len = prompt_kv_cache["x_len"]
+        cache_len = prompt_kv_cache["k_cache"][0].shape[1]
+        xy_pos = torch.concat([xy_pos[:, prompt_x_len:x_len], xy_pos[:, -1:]], dim=1)
+        q_len = xy_pos.shape[1]
+
+        # columns: | prompt phones | prompt semantic[:-1] | target phones | last prompt token |
+        attn_mask = torch.zeros((q_len, cache_len + q_len), dtype=torch.bool, device=xy_pos.device)
+        attn_mask[:-1, prompt_x_len:cache_len] = True
+        attn_mask[:-1, -1] = True
+        attn_mask = attn_mask.unsqueeze(0).expand(self.num_head, -1, -1).view(1, self.num_head, q_len, -1)
+
+        # decode_next_token replaces the list items, the cached tensors themselves are not modified
+        return self.t2s_transformer.decode_next_token(
+            xy_pos, list(prompt_kv_cache["k_cache"]), list(prompt_kv_cache["v_cache"]), attn_mask
+        )
+
+    @staticmethod
+    def static_kv_cache_len(src_len: int, early_stop_num: int = -1) -> int:
+        # prompt + every token the decode loop (at most 1500 steps) can feed back before it stops
+        max_new_tokens = 1500 if early_stop_num == -1 else min(early_stop_num + 1, 1500)
+        return src_len + max_new_tokens
+
     def infer_panel_batch_infer(
         self,
         x: List[torch.LongTensor],  #####全部文本token
@@ -593,8 +772,10 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs,
     ):
+        if kwargs.get("prompt_kv_cache", None) is not None:
+            logger.warning("prompt_kv_cache is not supported by batch_infer, the prompt is prefilled in full")
         if prompts is None:
-            print("Warning: Prompt free is not supported batch_infer! switch to naive_infer")
+            logger.warning("Prompt free is not supported batch_infer! switch to naive_infer")
             return self.infer_panel_naive_batched(
                 x,
                 x_lens,
@@ -695,20 +876,36 @@ class Text2SemanticDecoder(nn.Module):
         # [PAD, PAD, PAD, 1, 2, 3,   4,   5,   6]]
 
         ###### decode #####
+        static_kv_cache = kwargs.get("static_kv_cache", True)
+        # called once per token, decoding ends as if early stopped when it returns True
+        should_stop = kwargs.get("should_stop", None)
+        cache_len = self.static_kv_cache_len(src_len, early_stop_num)
+        kv_len = src_len
         y_list = [None] * y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None] * y.shape[0]
-        for idx in tqdm(range(1500)):
+        timings = kwargs.get("timings", None)
+        # progress_callback(stage, step, max_steps), replaces the tqdm bar
+        progress_callback = kwargs.get("progress_callback", None)
+        for idx in range(1500):
+            step_start = time.perf_counter()
             if idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, attn_mask, None)
+                if static_kv_cache:
+                    k_cache, v_cache = self.t2s_transformer.init_static_kv_cache(k_cache, v_cache, cache_len)
+            elif static_kv_cache:
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, kv_len, attn_mask)
+                kv_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, attn_mask)
             logits = self.ar_predict_layer(xy_dec[:, -1])
 
             if idx == 0:
-                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, 1), value=False)
+                # 静态kv cache时mask也一次性分配到cache_len，decode时按kv_len截取
+                mask_pad = cache_len - src_len if static_kv_cache else 1
+                attn_mask = F.pad(attn_mask[:, :, -1].unsqueeze(-2), (0, mask_pad), value=False)
                 logits = logits[:, :-1]
-            else:
+            elif not static_kv_cache:
                 attn_mask = F.pad(attn_mask, (0, 1), value=False)
 
             samples = sample(
@@ -716,6 +913,9 @@ class Text2SemanticDecoder(nn.Module):
             )[0]
 
             y = torch.concat([y, samples], dim=1)
+            record_step_time(timings, idx, step_start)
+            if progress_callback is not None:
+                progress_callback("t2s", idx + 1, 1500)
 
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
@@ -744,8 +944,12 @@ class Text2SemanticDecoder(nn.Module):
                         k_cache[i] = torch.index_select(k_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
                         v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
 
-            if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx == 1499:
-                print("use early stop num:", early_stop_num)
+            if (
+                (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num)
+                or idx == 1499
+                or (should_stop is not None and should_stop())
+            ):
+                logger.debug("use early stop num: %s", early_stop_num)
                 stop = True
                 for i, batch_index in enumerate(batch_idx_map):
                     batch_index = batch_idx_map[i]
@@ -758,8 +962,8 @@ class Text2SemanticDecoder(nn.Module):
             if stop:
                 if y.shape[1] == 0:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                    print("bad zero prediction")
-                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                    logger.warning("bad zero prediction")
+                logger.debug("T2S Decoding EOS [%s -> %s]", prefix_len, y.shape[1])
                 break
 
             ####################### update next step ###################################
@@ -875,9 +1079,27 @@ class Text2SemanticDecoder(nn.Module):
             .to(device=x.device, dtype=torch.bool)
         )
 
-        for idx in tqdm(range(1500)):
+        static_kv_cache = kwargs.get("static_kv_cache", True)
+        prompt_kv_cache = kwargs.get("prompt_kv_cache", None) if not ref_free else None
+        should_stop = kwargs.get("should_stop", None)
+        kv_len = src_len
+        timings = kwargs.get("timings", None)
+        # progress_callback(stage, step, max_steps), replaces the tqdm bar
+        progress_callback = kwargs.get("progress_callback", None)
+        for idx in range(1500):
+            step_start = time.perf_counter()
             if xy_attn_mask is not None:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                if prompt_kv_cache is not None:
+                    xy_dec, k_cache, v_cache = self.process_prompt_with_kv_cache(xy_pos, x_len, prompt_kv_cache)
+                else:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                if static_kv_cache:
+                    k_cache, v_cache = self.t2s_transformer.init_static_kv_cache(
+                        k_cache, v_cache, self.static_kv_cache_len(src_len, early_stop_num)
+                    )
+            elif static_kv_cache:
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, kv_len)
+                kv_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
 
@@ -893,9 +1115,15 @@ class Text2SemanticDecoder(nn.Module):
             )[0]
 
             y = torch.concat([y, samples], dim=1)
+            record_step_time(timings, idx, step_start)
+            if progress_callback is not None:
+                progress_callback("t2s", idx + 1, 1500)
 
             if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
-                print("use early stop num:", early_stop_num)
+                logger.debug("use early stop num: %s", early_stop_num)
+                stop = True
+
+            if should_stop is not None and should_stop():
                 stop = True
 
             if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
@@ -903,8 +1131,8 @@ class Text2SemanticDecoder(nn.Module):
             if stop:
                 if y.shape[1] == 0:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                    print("bad zero prediction")
-                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                    logger.warning("bad zero prediction")
+                logger.debug("T2S Decoding EOS [%s -> %s]", prefix_len, y.shape[1])
                 break
 
             ####################### update next step ###################################
@@ -1000,9 +1228,27 @@ class Text2SemanticDecoder(nn.Module):
         xy_attn_mask = xy_attn_mask.unsqueeze(0).expand(bsz * self.num_head, -1, -1)
         xy_attn_mask = xy_attn_mask.view(bsz, self.num_head, src_len, src_len).to(device=x.device, dtype=torch.bool)
 
-        for idx in tqdm(range(1500)):
+        static_kv_cache = kwargs.get("static_kv_cache", True)
+        prompt_kv_cache = kwargs.get("prompt_kv_cache", None) if not ref_free else None
+        should_stop = kwargs.get("should_stop", None)
+        kv_len = src_len
+        timings = kwargs.get("timings", None)
+        # progress_callback(stage, step, max_steps), replaces the tqdm bar
+        progress_callback = kwargs.get("progress_callback", None)
+        for idx in range(1500):
+            step_start = time.perf_counter()
             if xy_attn_mask is not None:
-                xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                if prompt_kv_cache is not None:
+                    xy_dec, k_cache, v_cache = self.process_prompt_with_kv_cache(xy_pos, x_len, prompt_kv_cache)
+                else:
+                    xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                if static_kv_cache:
+                    k_cache, v_cache = self.t2s_transformer.init_static_kv_cache(
+                        k_cache, v_cache, self.static_kv_cache_len(src_len, early_stop_num)
+                    )
+            elif static_kv_cache:
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, kv_len)
+                kv_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
 
@@ -1023,6 +1269,9 @@ class Text2SemanticDecoder(nn.Module):
             )[0]
 
             y = torch.concat([y, samples], dim=1)
+            record_step_time(timings, idx, step_start)
+            if progress_callback is not None:
+                progress_callback("t2s", idx + 1, 1500)
             curr_chunk_size += 1
 
             if curr_chunk_size >= curr_max_chunk_size:
@@ -1031,7 +1280,10 @@ class Text2SemanticDecoder(nn.Module):
                 curr_chunk_size = 0
 
             if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
-                print("Using early stop num:", early_stop_num)
+                logger.debug("Using early stop num: %s", early_stop_num)
+                stop = True
+
+            if should_stop is not None and should_stop():
                 stop = True
 
             if torch.argmax(logits, dim=-1)[0] == self.EOS or samples[0, 0] == self.EOS:
@@ -1040,14 +1292,14 @@ class Text2SemanticDecoder(nn.Module):
             if stop:
                 if y.shape[1] == 0:
                     y = torch.concat([y, torch.zeros_like(samples)], dim=1)
-                    print("Bad zero prediction")
+                    logger.warning("Bad zero prediction")
                     
                 # Adds the final EOS token
                 if not (y == self.EOS).any():
-                    print("No EOS on last chunk. Manually placing.")
+                    logger.warning("No EOS on last chunk. Manually placing.")
                     y = torch.concat((y, torch.tensor([[self.EOS]], device="cuda" if torch.cuda.is_available() else "cpu")), dim=1)
                 
-                print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
+                logger.debug("T2S Decoding EOS [%s -> %s]", prefix_len, y.shape[1])
                 break
 
             # Update for next step
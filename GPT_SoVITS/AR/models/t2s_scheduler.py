@@ -0,0 +1,448 @@
+# Continuous batching for the streaming T2S decode loop.
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+import torch
+from torch.nn import functional as F
+
+from GPT_SoVITS.AR.models.t2s_model import record_step_time
+from GPT_SoVITS.AR.models.utils import sample
+
+logger = logging.getLogger(__name__)
+
+
+class T2SStreamRequest:
+    """
+    One streaming sequence served by `T2SBatchScheduler`.
+
+    Chunks of semantic tokens (LongTensor of shape (1, n), the last one ending with EOS) are put on
+    `queue`, followed by None. If decoding fails the exception is put on the queue instead.
+    """
+
+    def __init__(
+        self,
+        x: torch.LongTensor,
+        prompts: Optional[torch.LongTensor],
+        bert_feature: torch.Tensor,
+        initial_chunk_size: int,
+        chunk_increase_rate: int,
+        max_chunk_size: int,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        prompt_kv_cache: Optional[dict] = None,
+        timings: Optional[dict] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+    ):
+        self.x = x
+        self.prompts = prompts
+        self.bert_feature = bert_feature
+        self.chunk_increase_rate = chunk_increase_rate
+        self.max_chunk_size = max_chunk_size
+        self.top_k = top_k
+        self.top_p = top_p
+        self.early_stop_num = early_stop_num
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        # see Text2SemanticDecoder.build_prompt_kv_cache, ignored without a prompt
+        self.prompt_kv_cache = prompt_kv_cache
+        self.timings = timings
+        self.progress_callback = progress_callback
+
+        # asyncio consumers get an asyncio.Queue fed from the decode thread
+        self.loop = loop
+        self.queue = asyncio.Queue() if loop is not None else queue.Queue()
+        self.cancelled: bool = False
+        self.should_stop = should_stop
+        self.finished: bool = False
+
+        self.y: torch.LongTensor = None  # prompt + generated tokens
+        self.prefix_len: int = 0
+        self.pe_pos: int = 0  # position of the next token fed back to the decoder
+        self.step: int = 0
+        self.emitted_len: int = 0
+        self.curr_max_chunk_size: int = initial_chunk_size
+
+    def cancel(self):
+        self.cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled or (self.should_stop is not None and self.should_stop())
+
+    def _put(self, item):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        else:
+            self.queue.put(item)
+
+
+class T2SBatchScheduler:
+    """
+    Continuous-batching engine for `Text2SemanticDecoder` streaming inference.
+
+    Requests are prefilled on their own with `process_prompt` (or on top of their cached prompt K/V),
+    then join the running batch at the next token boundary. Rows have different lengths, so the batch KV cache is left padded and a
+    per-row padding mask is passed to `decode_next_token`. Every step decodes one token for all rows,
+    routes it to the owner's queue in chunks (same schedule as `infer_panel_stream`), and rows that
+    reach EOS, early stop or are cancelled leave the batch through `index_select`.
+
+    All decoding happens on one background thread, started on the first request. `TTS.run_async` runs
+    the streaming requests of a replica concurrently once their voice and models are set up, so their
+    segments are decoded here side by side.
+    """
+
+    def __init__(self, model, max_batch_size: int = 8):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self._pending: queue.Queue = queue.Queue()
+        self._active: List[T2SStreamRequest] = []
+        self._k_cache: List[torch.Tensor] = None
+        self._v_cache: List[torch.Tensor] = None
+        self._padding_mask: torch.Tensor = None  # (bsz, kv_len), True means padding
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @property
+    def num_active(self) -> int:
+        return len(self._active)
+
+    def submit(self, request: T2SStreamRequest) -> T2SStreamRequest:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name="T2SBatchScheduler", daemon=True)
+                self._thread.start()
+        self._pending.put(request)
+        return request
+
+    def shutdown(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    _SAMPLING_KWARGS = {"top_k", "top_p", "early_stop_num", "temperature", "repetition_penalty"}
+    # arguments of infer_panel_stream that do not apply to the shared batch, which has its own KV cache
+    _IGNORED_KWARGS = {"max_len", "static_kv_cache"}
+
+    def _make_request(
+        self,
+        x: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: torch.LongTensor,
+        initial_chunk_size: int,
+        chunk_increase_rate: int,
+        max_chunk_size: int,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        prompt_kv_cache: Optional[dict] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        timings: Optional[dict] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+        **kwargs,
+    ) -> T2SStreamRequest:
+        unsupported = set(kwargs) - self._SAMPLING_KWARGS - self._IGNORED_KWARGS
+        if len(unsupported) > 0:
+            raise TypeError(f"T2SBatchScheduler does not support {sorted(unsupported)}")
+        sampling = {key: value for key, value in kwargs.items() if key in self._SAMPLING_KWARGS}
+        return T2SStreamRequest(
+            x,
+            prompts,
+            bert_feature,
+            initial_chunk_size,
+            chunk_increase_rate,
+            max_chunk_size,
+            loop=loop,
+            should_stop=should_stop,
+            prompt_kv_cache=prompt_kv_cache,
+            timings=timings,
+            progress_callback=progress_callback,
+            **sampling,
+        )
+
+    def stream(
+        self,
+        x: torch.LongTensor,
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: torch.LongTensor,
+        initial_chunk_size: int,
+        chunk_increase_rate: int,
+        max_chunk_size: int,
+        **kwargs,
+    ):
+        """
+        Drop-in replacement for `Text2SemanticDecoder.infer_panel_stream` that decodes in the shared batch.
+
+        Takes the same keyword arguments (sampling, prompt_kv_cache, should_stop, timings,
+        progress_callback), except max_len and static_kv_cache which do not apply; anything else is
+        a TypeError rather than being ignored.
+        """
+        request = self.submit(
+            self._make_request(
+                x, prompts, bert_feature, initial_chunk_size, chunk_increase_rate, max_chunk_size, **kwargs
+            )
+        )
+        try:
+            while True:
+                item = request.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            request.cancel()
+
+    async def astream(
+        self,
+        x: torch.LongTensor,
+        x_lens: torch.LongTensor,
+        prompts: torch.LongTensor,
+        bert_feature: torch.LongTensor,
+        initial_chunk_size: int,
+        chunk_increase_rate: int,
+        max_chunk_size: int,
+        **kwargs,
+    ):
+        """
+        Async version of `stream`, the chunks are delivered through an asyncio.Queue.
+        """
+        request = self.submit(
+            self._make_request(
+                x,
+                prompts,
+                bert_feature,
+                initial_chunk_size,
+                chunk_increase_rate,
+                max_chunk_size,
+                loop=asyncio.get_running_loop(),
+                **kwargs,
+            )
+        )
+        try:
+            while True:
+                item = await request.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            request.cancel()
+
+    @torch.no_grad()
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._admit()
+                if len(self._active) > 0:
+                    self._decode_step()
+            except Exception as e:
+                logger.error("T2S batch scheduler error: %s", e)
+                for request in self._active:
+                    request._put(e)
+                self._active = []
+                self._k_cache = self._v_cache = self._padding_mask = None
+
+        # shut down, release everyone still waiting
+        error = RuntimeError("T2S batch scheduler was shut down")
+        while True:
+            try:
+                self._active.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        for request in self._active:
+            request._put(error)
+        self._active = []
+        self._k_cache = self._v_cache = self._padding_mask = None
+
+    def _admit(self):
+        while len(self._active) < self.max_batch_size:
+            try:
+                # block only when there is nothing to decode
+                if len(self._active) == 0:
+                    request = self._pending.get(timeout=0.1)
+                else:
+                    request = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            if request.is_cancelled():
+                request._put(None)
+                continue
+            try:
+                k_cache, v_cache = self._prefill(request)
+            except Exception as e:
+                logger.error("T2S batch scheduler prefill error: %s", e)
+                request._put(e)
+                continue
+            if not request.finished:
+                self._join(request, k_cache, v_cache)
+
+    def _prefill(self, request: T2SStreamRequest):
+        step_start = time.perf_counter()
+        model = self.model
+        x = model.ar_text_embedding(request.x)
+        x = x + model.bert_proj(request.bert_feature.transpose(1, 2))
+        x = model.ar_text_position(x)
+        x_len = x.shape[1]
+
+        y = request.prompts
+        if y is not None and y.shape[1] > 0:
+            y_emb = model.ar_audio_embedding(y)
+            y_len = y_emb.shape[1]
+            xy_pos = torch.concat([x, model.ar_audio_position(y_emb)], dim=1)
+        else:
+            y_len = 0
+            xy_pos = x
+            y = torch.zeros(x.shape[0], 0, dtype=torch.int64, device=x.device)
+
+        src_len = x_len + y_len
+        x_attn_mask = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool, device=x.device), (0, y_len), value=True
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool, device=x.device), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = torch.concat([x_attn_mask, y_attn_mask], dim=0)
+        xy_attn_mask = xy_attn_mask.unsqueeze(0).expand(model.num_head, -1, -1).view(1, model.num_head, src_len, src_len)
+
+        if request.prompt_kv_cache is not None and y_len > 0:
+            xy_dec, k_cache, v_cache = model.process_prompt_with_kv_cache(xy_pos, x_len, request.prompt_kv_cache)
+        else:
+            xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        request.y = y
+        request.prefix_len = y.shape[1]
+        request.emitted_len = y.shape[1]
+        request.pe_pos = y_len
+        self._sample(request, logits, step_start)
+        return k_cache, v_cache
+
+    def _join(self, request: T2SStreamRequest, k_cache: List[torch.Tensor], v_cache: List[torch.Tensor]):
+        seq_len = k_cache[0].shape[1]
+        padding_mask = torch.zeros((1, seq_len), dtype=torch.bool, device=k_cache[0].device)
+        if len(self._active) == 0:
+            self._k_cache, self._v_cache, self._padding_mask = k_cache, v_cache, padding_mask
+            self._active = [request]
+            return
+
+        # left pad whichever side is shorter so that every row writes at the same position
+        batch_len = self._padding_mask.shape[1]
+        if seq_len < batch_len:
+            pad = batch_len - seq_len
+            k_cache = [F.pad(k, (0, 0, pad, 0)) for k in k_cache]
+            v_cache = [F.pad(v, (0, 0, pad, 0)) for v in v_cache]
+            padding_mask = F.pad(padding_mask, (pad, 0), value=True)
+        elif seq_len > batch_len:
+            pad = seq_len - batch_len
+            self._k_cache = [F.pad(k, (0, 0, pad, 0)) for k in self._k_cache]
+            self._v_cache = [F.pad(v, (0, 0, pad, 0)) for v in self._v_cache]
+            self._padding_mask = F.pad(self._padding_mask, (pad, 0), value=True)
+
+        self._k_cache = [torch.concat([k_batch, k], dim=0) for k_batch, k in zip(self._k_cache, k_cache)]
+        self._v_cache = [torch.concat([v_batch, v], dim=0) for v_batch, v in zip(self._v_cache, v_cache)]
+        self._padding_mask = torch.concat([self._padding_mask, padding_mask], dim=0)
+        self._active.append(request)
+
+    def _decode_step(self):
+        step_start = time.perf_counter()
+        model = self.model
+        for request in self._active:
+            if request.is_cancelled():
+                # ends the consumer's stream if it is still waiting for a chunk
+                request._put(None)
+                request.finished = True
+        self._remove_finished()
+        if len(self._active) == 0:
+            return
+
+        bsz = len(self._active)
+        y_emb = model.ar_audio_embedding(torch.concat([request.y[:, -1:] for request in self._active], dim=0))
+        positions = torch.LongTensor([request.pe_pos for request in self._active]).to(y_emb.device)
+        pe = model.ar_audio_position.pe[0, positions].unsqueeze(1).to(dtype=y_emb.dtype, device=y_emb.device)
+        xy_pos = y_emb * model.ar_audio_position.x_scale + model.ar_audio_position.alpha * pe
+
+        padding_mask = F.pad(self._padding_mask, (0, 1), value=False)
+        attn_mask = padding_mask.view(bsz, 1, 1, -1).expand(-1, model.num_head, -1, -1)
+        xy_dec, self._k_cache, self._v_cache = model.t2s_transformer.decode_next_token(
+            xy_pos, self._k_cache, self._v_cache, attn_mask
+        )
+        self._padding_mask = padding_mask
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        for i, request in enumerate(self._active):
+            request.pe_pos += 1
+            self._sample(request, logits[i : i + 1], step_start)
+        self._remove_finished()
+
+    def _sample(self, request: T2SStreamRequest, logits: torch.Tensor, step_start: float):
+        EOS = self.model.EOS
+        if request.step < 11:  # Ensure at least 10 tokens are generated before stopping
+            logits = logits[:, :-1]
+        samples = sample(
+            logits,
+            request.y,
+            top_k=request.top_k,
+            top_p=request.top_p,
+            repetition_penalty=request.repetition_penalty,
+            temperature=request.temperature,
+        )[0]
+        request.y = torch.concat([request.y, samples], dim=1)
+        # a batched step counts in full for each of its rows, as the request waited for all of it
+        record_step_time(request.timings, request.step, step_start)
+        request.step += 1
+        if request.progress_callback is not None:
+            request.progress_callback("t2s", request.step, 1500)
+
+        stop = False
+        if request.early_stop_num != -1 and request.step > request.early_stop_num:
+            stop = True
+        if torch.argmax(logits, dim=-1)[0] == EOS or samples[0, 0] == EOS:
+            stop = True
+
+        if stop:
+            if request.y[0, -1] != EOS:
+                request.y = torch.concat([request.y, torch.full_like(samples, EOS, dtype=request.y.dtype)], dim=1)
+            logger.debug("T2S Decoding EOS [%s -> %s]", request.prefix_len, request.y.shape[1])
+            request._put(request.y[:, request.emitted_len :])
+            request._put(None)
+            request.finished = True
+        elif request.y.shape[1] - request.emitted_len >= request.curr_max_chunk_size:
+            request.curr_max_chunk_size = min(
+                request.max_chunk_size, request.curr_max_chunk_size + request.chunk_increase_rate
+            )
+            request._put(request.y[:, request.emitted_len :])
+            request.emitted_len = request.y.shape[1]
+
+    def _remove_finished(self):
+        if not any(request.finished for request in self._active):
+            return
+        reserved = [i for i, request in enumerate(self._active) if not request.finished]
+        self._active = [self._active[i] for i in reserved]
+        if len(reserved) == 0:
+            self._k_cache = self._v_cache = self._padding_mask = None
+            return
+
+        index = torch.LongTensor(reserved).to(self._padding_mask.device)
+        self._k_cache = [torch.index_select(k, dim=0, index=index) for k in self._k_cache]
+        self._v_cache = [torch.index_select(v, dim=0, index=index) for v in self._v_cache]
+        self._padding_mask = torch.index_select(self._padding_mask, dim=0, index=index)
+
+        # drop the left padding no remaining row needs
+        start = int(torch.nonzero((~self._padding_mask).any(dim=0))[0])
+        if start > 0:
+            self._k_cache = [k[:, start:] for k in self._k_cache]
+            self._v_cache = [v[:, start:] for v in self._v_cache]
+            self._padding_mask = self._padding_mask[:, start:]
@@ -1,14 +1,17 @@
+import asyncio
 import gc
+import logging
 import math
 import os
 import random
 import sys
+import threading
 import time
 import traceback
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from copy import deepcopy
 
 import torchaudio
-from tqdm import tqdm
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -22,6 +25,7 @@ import torch
 import torch.nn.functional as F
 import yaml
 from GPT_SoVITS.AR.models.t2s_lightning_module import Text2SemanticLightningModule
+from GPT_SoVITS.AR.models.t2s_scheduler import T2SBatchScheduler
 from GPT_SoVITS.BigVGAN.bigvgan import BigVGAN
 from GPT_SoVITS.feature_extractor.cnhubert import CNHubert
 from GPT_SoVITS.module.mel_processing import mel_spectrogram_torch, spectrogram_torch
@@ -33,7 +37,15 @@ from transformers import AutoModelForMaskedLM, AutoTokenizer
 from GPT_SoVITS.tools.audio_sr import AP_BWE
 from GPT_SoVITS.tools.i18n.i18n import I18nAuto, scan_language_list
 from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import splits
+from GPT_SoVITS.TTS_infer_pack.cancellation import CancellationToken, DeadlineExceededError
+from GPT_SoVITS.TTS_infer_pack.log import set_log_level
+from GPT_SoVITS.TTS_infer_pack.prefetch import prefetch
+from GPT_SoVITS.TTS_infer_pack.model_registry import ModelEntry, ModelRegistry
+from GPT_SoVITS.TTS_infer_pack.metrics import REGISTRY, StageTimer, add_timing, observe_timings
 from GPT_SoVITS.TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from GPT_SoVITS.TTS_infer_pack.voice_cache import VoiceCache
+from GPT_SoVITS.TTS_infer_pack.voice_profile import VoiceProfileStore
+from GPT_SoVITS.text.warmup import warmup_frontends
 from GPT_SoVITS.sv import SV
 
 from GPT_SoVITS.TTS_infer_pack.zero_crossing import find_matching_index, find_zero_zone
@@ -57,6 +69,7 @@ def resample(audio_tensor, sr0, sr1, device):
 language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
+logger = logging.getLogger(__name__)
 
 
 spec_min = -12
@@ -153,6 +166,10 @@ class NO_PROMPT_ERROR(Exception):
     pass
 
 
+# yielded by `TTS.run(detach=True)` once the request no longer needs the replica's state, see run_async
+DETACH = object()
+
+
 # configs/tts_infer.yaml
 """
 custom:
@@ -201,7 +218,7 @@ v4:
 def set_seed(seed: int):
     seed = int(seed)
     seed = seed if seed != -1 else random.randint(0, 2**32 - 1)
-    print(f"Set seed to {seed}")
+    logger.debug("Set seed to %s", seed)
     os.environ["PYTHONHASHSEED"] = str(seed)
     random.seed(seed)
     np.random.seed(seed)
@@ -303,7 +320,7 @@ class TTS_Config:
         if configs in ["", None]:
             if not os.path.exists(self.configs_path):
                 self.save_configs()
-                print(f"Create default config file at {self.configs_path}")
+                logger.info("Create default config file at %s", self.configs_path)
             configs: dict = deepcopy(self.default_configs)
 
         if isinstance(configs, str):
@@ -318,12 +335,12 @@ class TTS_Config:
 
         self.device = self.configs.get("device", torch.device("cpu"))
         if "cuda" in str(self.device) and not torch.cuda.is_available():
-            print("Warning: CUDA is not available, set device to CPU.")
+            logger.warning("CUDA is not available, set device to CPU.")
             self.device = torch.device("cpu")
 
         self.is_half = self.configs.get("is_half", False)
         if str(self.device) == "cpu" and self.is_half:
-            print(f"Warning: Half precision is not supported on CPU, set is_half to False.")
+            logger.warning("Half precision is not supported on CPU, set is_half to False.")
             self.is_half = False
 
         version = self.configs.get("version", None)
@@ -333,7 +350,23 @@ class TTS_Config:
         self.vits_weights_path = self.configs.get("vits_weights_path", None)
         self.bert_base_path = self.configs.get("bert_base_path", None)
         self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        self.voice_cache_dir = self.configs.get("voice_cache_dir", None)
+        self.prompt_cache_size = self.configs.get("prompt_cache_size", 8)
+        self.prompt_cache_gpu_bytes = self.configs.get("prompt_cache_gpu_bytes", None)
+        self.prompt_cache_cpu_bytes = self.configs.get("prompt_cache_cpu_bytes", None)
+        # decode the T2S of concurrent streaming requests (run_async) in one batch, at most
+        # continuous_batching_size of them, see TTS.run_async and examples/benchmark_continuous_batching.py
+        self.continuous_batching = self.configs.get("continuous_batching", False)
+        self.continuous_batching_size = self.configs.get("continuous_batching_size", 8)
+        # "INFO" logs every request, "WARNING" is the quiet mode for serving
+        self.log_level = self.configs.get("log_level", "INFO")
+        # keep a (pinned) CPU copy of the T2S/SoVITS weights to restore them after a failed inference without
+        # reading the checkpoint again. costs host RAM the size of each model's weights, for every resident
+        # model (see load_weights) of every replica; off, the weights are reloaded from disk instead
+        self.keep_cpu_weights = self.configs.get("keep_cpu_weights", False)
         self.languages = self.v1_languages if self.version == "v1" else self.v2_languages
+        # text languages whose frontends are loaded at startup, None for all of `languages`, [] to disable
+        self.warmup_languages = self.configs.get("warmup_languages", None)
 
         self.use_vocoder: bool = False
 
@@ -342,25 +375,25 @@ class TTS_Config:
             # If even after downloading the weights, the path does not exist, fall back to default weights
             if not os.path.exists(root_dir / self.t2s_weights_path):
                 self.t2s_weights_path = root_dir / self.default_configs[version]["t2s_weights_path"]
-                print(f"fall back to default t2s_weights_path: {self.t2s_weights_path}")
+                logger.warning("fall back to default t2s_weights_path: %s", self.t2s_weights_path)
         if (self.vits_weights_path in [None, ""]) or (not os.path.exists(root_dir / self.vits_weights_path)):
             self._download_hf_weights_to_local()
             # If even after downloading the weights, the path does not exist, fall back to default weights
             if not os.path.exists(root_dir / self.vits_weights_path):
                 self.vits_weights_path = root_dir / self.default_configs[version]["vits_weights_path"]
-                print(f"fall back to default vits_weights_path: {self.vits_weights_path}")
+                logger.warning("fall back to default vits_weights_path: %s", self.vits_weights_path)
         if (self.bert_base_path in [None, ""]) or (not os.path.exists(root_dir / self.bert_base_path)):
             self._download_hf_weights_to_local()
             # If even after downloading the weights, the path does not exist, fall back to default weights
             if not os.path.exists(root_dir / self.bert_base_path):
                 self.bert_base_path = root_dir / self.default_configs[version]["bert_base_path"]
-                print(f"fall back to default bert_base_path: {self.bert_base_path}")
+                logger.warning("fall back to default bert_base_path: %s", self.bert_base_path)
         if (self.cnhuhbert_base_path in [None, ""]) or (not os.path.exists(root_dir / self.cnhuhbert_base_path)):
             self._download_hf_weights_to_local()
             # If even after downloading the weights, the path does not exist, fall back to default weights
             if not os.path.exists(root_dir / self.cnhuhbert_base_path):
                 self.cnhuhbert_base_path = root_dir / self.default_configs[version]["cnhuhbert_base_path"]
-                print(f"fall back to default cnhuhbert_base_path: {self.cnhuhbert_base_path}")
+                logger.warning("fall back to default cnhuhbert_base_path: %s", self.cnhuhbert_base_path)
         self.update_configs()
 
         self.max_sec = None
@@ -374,7 +407,7 @@ class TTS_Config:
         self.n_speakers: int = 300
 
     def _download_hf_weights_to_local(self):
-        print(f"Downloading missing weights from Hugging Face to local pretrained models directory...")
+        logger.info("Downloading missing weights from Hugging Face to local pretrained models directory...")
         snapshot_download(
             repo_id="lj1995/GPT-SoVITS", 
             local_dir=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pretrained_models"),
@@ -385,7 +418,7 @@ class TTS_Config:
         if os.path.exists(configs_path):
             ...
         else:
-            print(i18n("路径不存在,使用默认配置"))
+            logger.warning(i18n("路径不存在,使用默认配置"))
             self.save_configs(configs_path)
         with open(configs_path, "r", encoding="utf-8") as f:
             configs = yaml.load(f, Loader=yaml.FullLoader)
@@ -411,6 +444,15 @@ class TTS_Config:
             "vits_weights_path": self.vits_weights_path,
             "bert_base_path": self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "voice_cache_dir": self.voice_cache_dir,
+            "prompt_cache_size": self.prompt_cache_size,
+            "prompt_cache_gpu_bytes": self.prompt_cache_gpu_bytes,
+            "prompt_cache_cpu_bytes": self.prompt_cache_cpu_bytes,
+            "continuous_batching": self.continuous_batching,
+            "continuous_batching_size": self.continuous_batching_size,
+            "log_level": self.log_level,
+            "keep_cpu_weights": self.keep_cpu_weights,
+            "warmup_languages": self.warmup_languages,
         }
         return self.config
 
@@ -442,6 +484,16 @@ class TTS:
             self.configs = configs
         else:
             self.configs: TTS_Config = TTS_Config(configs)
+        set_log_level(self.configs.log_level)
+        startup_start = time.perf_counter()
+        # seconds spent loading each component, see _report_startup
+        self.startup_report: dict = {}
+        self._startup_timings: dict = self.startup_report
+        # the language frontends load in the background while the models do
+        warmup_languages = self.configs.warmup_languages
+        frontend_futures = warmup_frontends(
+            self.configs.languages if warmup_languages is None else warmup_languages, self.configs.version
+        )
 
         self.t2s_model: Text2SemanticLightningModule = None
         self.vits_model: Union[SynthesizerTrn, SynthesizerTrnV3] = None
@@ -452,6 +504,9 @@ class TTS:
         self.sr_model: AP_BWE = None
         self.sv_model = None
         self.sr_model_not_exist: bool = False
+        self.voice_profile_store: VoiceProfileStore = (
+            VoiceProfileStore(self.configs.voice_cache_dir) if self.configs.voice_cache_dir else None
+        )
 
         self.vocoder_configs: dict = {
             "sr": None,
@@ -460,6 +515,23 @@ class TTS:
             "upsample_rate": None,
             "overlapped_len": None,
         }
+        # resident T2S/SoVITS checkpoints, t2s_model/vits_model are the models of the active entries
+        self.models: ModelRegistry = ModelRegistry()
+        self.t2s_entry: ModelEntry = None
+        self.vits_entry: ModelEntry = None
+        # SoVITS version -> (vocoder, vocoder_configs), shared by the resident v3/v4 models
+        self._vocoders: dict = {}
+
+        # prompt_cache is the entry of the voice in use, voice_cache keeps the recently used ones
+        self.voice_cache: VoiceCache = VoiceCache(
+            self.configs.prompt_cache_size,
+            max_gpu_bytes=self.configs.prompt_cache_gpu_bytes,
+            max_cpu_bytes=self.configs.prompt_cache_cpu_bytes,
+        )
+        self.prompt_cache: dict = self._new_prompt_cache()
+        # streaming requests running off `executor`, see run_async
+        self._detached_streams: int = 0
+        self._detached_streams_cond = threading.Condition()
 
         self._init_models()
 
@@ -467,7 +539,29 @@ class TTS:
             self.bert_model, self.bert_tokenizer, self.configs.device
         )
 
-        self.prompt_cache: dict = {
+        # cancel tokens of the requests being executed, see stop()
+        self._active_tokens: set = set()
+        self._active_tokens_lock = threading.Lock()
+        # run_async executes here, one inference at a time
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="TTS")
+        # with continuous_batching, the streaming requests continue here once set up, see run_async
+        self.stream_executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self.configs.continuous_batching_size, thread_name_prefix="TTSStream"
+        )
+        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
+
+        with StageTimer(self.startup_report, "frontend_wait"):
+            for component, future in frontend_futures.items():
+                seconds = future.result()
+                if seconds is not None:
+                    self.startup_report[component] = seconds
+        self.startup_report["total"] = time.perf_counter() - startup_start
+        self._startup_timings = None
+        self._report_startup()
+
+    @staticmethod
+    def _new_prompt_cache() -> dict:
+        return {
             "ref_audio_path": None,
             "prompt_semantic": None,
             "refer_spec": [],
@@ -477,23 +571,38 @@ class TTS:
             "bert_features": None,
             "norm_text": None,
             "aux_ref_audio_paths": [],
+            "ge": None,
+            "t2s_prompt_kv": None,
         }
 
-        self.stop_flag: bool = False
-        self.precision: torch.dtype = torch.float16 if self.configs.is_half else torch.float32
-
     def _init_models(
         self,
     ):
-        self.init_t2s_weights(self.configs.t2s_weights_path)
-        self.init_vits_weights(self.configs.vits_weights_path)
-        self.init_bert_weights(self.configs.bert_base_path)
-        self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
+        with StageTimer(self._startup_timings, "t2s"):
+            self.init_t2s_weights(self.configs.t2s_weights_path)
+        with StageTimer(self._startup_timings, "vits"):
+            self.init_vits_weights(self.configs.vits_weights_path)
+        # sv and vocoder are loaded with the SoVITS model, report them on their own
+        if self._startup_timings is not None:
+            for component in ["sv", "vocoder"]:
+                self._startup_timings["vits"] -= self._startup_timings.get(component, 0.0)
+        with StageTimer(self._startup_timings, "bert"):
+            self.init_bert_weights(self.configs.bert_base_path)
+        with StageTimer(self._startup_timings, "hubert"):
+            self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
         # self.enable_half_precision(self.configs.is_half)
 
+    def _report_startup(self):
+        """
+        Log `startup_report`: the model loads run one after the other, the frontends (frontend_*,
+        lang_segmenter) in parallel with them; frontend_wait is what they added on top of the model loads.
+        """
+        lines = [f"{component.ljust(20)}: {seconds:.3f}s" for component, seconds in self.startup_report.items()]
+        logger.info("%s\n%s", "TTS startup".center(50, "-"), "\n".join(lines))
+
     def init_cnhuhbert_weights(self, base_path: str):
         base_path = str(root_dir / base_path)
-        print(f"Loading CNHuBERT weights from {base_path}")
+        logger.info("Loading CNHuBERT weights from %s", base_path)
         self.cnhuhbert_model = CNHubert(base_path)
         self.cnhuhbert_model = self.cnhuhbert_model.eval()
         self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
@@ -502,7 +611,7 @@ class TTS:
 
     def init_bert_weights(self, base_path: str):
         base_path = str(root_dir / base_path)
-        print(f"Loading BERT weights from {base_path}")
+        logger.info("Loading BERT weights from %s", base_path)
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
         self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
         self.bert_model = self.bert_model.eval()
@@ -511,7 +620,18 @@ class TTS:
             self.bert_model = self.bert_model.half()
 
     def init_vits_weights(self, weights_path: str):
-        self.configs.vits_weights_path = weights_path
+        """
+        Load the SoVITS weights and switch to them right away, see `load_weights` for the non-blocking way.
+        """
+        entry = self.models.add(self._load_vits_weights(weights_path), activate=True)
+        self._activate_vits(entry, save=True)
+
+    def _load_vits_weights(self, weights_path: str, name: str = None) -> ModelEntry:
+        """
+        Build the SoVITS model of `weights_path` without touching the pipeline state, so that it can run
+        on the loading thread while requests keep using the current model.
+        """
+        name = str(weights_path) if name in [None, ""] else name
         version, model_version, if_lora_v3 = get_sovits_version_from_path_fast(weights_path)
         if "Pro" in model_version:
             self.init_sv_model()
@@ -522,6 +642,7 @@ class TTS:
             raise FileExistsError(info)
 
         # dict_s2 = torch.load(weights_path, map_location=self.configs.device,weights_only=False)
+        entry_weights_path = weights_path
         weights_path = str(root_dir / weights_path)
         dict_s2 = load_sovits_new(weights_path)
         hps = dict_s2["config"]
@@ -542,50 +663,50 @@ class TTS:
         else:
             hps["model"]["version"] = model_version
 
-        self.configs.filter_length = hps["data"]["filter_length"]
-        self.configs.segment_size = hps["train"]["segment_size"]
-        self.configs.sampling_rate = hps["data"]["sampling_rate"]
-        self.configs.hop_length = hps["data"]["hop_length"]
-        self.configs.win_length = hps["data"]["win_length"]
-        self.configs.n_speakers = hps["data"]["n_speakers"]
-        self.configs.semantic_frame_rate = hps["model"]["semantic_frame_rate"]
+        # applied to self.configs by _activate_vits
+        meta = {
+            "filter_length": hps["data"]["filter_length"],
+            "segment_size": hps["train"]["segment_size"],
+            "sampling_rate": hps["data"]["sampling_rate"],
+            "hop_length": hps["data"]["hop_length"],
+            "win_length": hps["data"]["win_length"],
+            "n_speakers": hps["data"]["n_speakers"],
+            "semantic_frame_rate": hps["model"]["semantic_frame_rate"],
+            "model_version": model_version,
+            "use_vocoder": model_version in v3v4set,
+        }
         kwargs = hps["model"]
-        # print(f"self.configs.sampling_rate:{self.configs.sampling_rate}")
 
-        self.configs.update_version(model_version)
-
-        # print(f"model_version:{model_version}")
-        # print(f'hps["model"]["version"]:{hps["model"]["version"]}')
         if model_version not in v3v4set:
             vits_model = SynthesizerTrn(
-                self.configs.filter_length // 2 + 1,
-                self.configs.segment_size // self.configs.hop_length,
-                n_speakers=self.configs.n_speakers,
+                meta["filter_length"] // 2 + 1,
+                meta["segment_size"] // meta["hop_length"],
+                n_speakers=meta["n_speakers"],
                 **kwargs,
             )
-            self.configs.use_vocoder = False
         else:
             kwargs["version"] = model_version
             vits_model = SynthesizerTrnV3(
-                self.configs.filter_length // 2 + 1,
-                self.configs.segment_size // self.configs.hop_length,
-                n_speakers=self.configs.n_speakers,
+                meta["filter_length"] // 2 + 1,
+                meta["segment_size"] // meta["hop_length"],
+                n_speakers=meta["n_speakers"],
                 **kwargs,
             )
-            self.configs.use_vocoder = True
-            self.init_vocoder(model_version)
+            self._load_vocoder(model_version)
             if "pretrained" not in weights_path and hasattr(vits_model, "enc_q"):
                 del vits_model.enc_q
 
-        self.is_v2pro = model_version in {"v2Pro", "v2ProPlus"}
-
         if if_lora_v3 == False:
-            print(
-                f"Loading VITS weights from {weights_path}. {vits_model.load_state_dict(dict_s2['weight'], strict=False)}"
+            logger.info(
+                "Loading VITS weights from %s. %s",
+                weights_path,
+                vits_model.load_state_dict(dict_s2["weight"], strict=False),
             )
         else:
-            print(
-                f"Loading VITS pretrained weights from {weights_path}. {vits_model.load_state_dict(load_sovits_new(path_sovits)['weight'], strict=False)}"
+            logger.info(
+                "Loading VITS pretrained weights from %s. %s",
+                weights_path,
+                vits_model.load_state_dict(load_sovits_new(path_sovits)["weight"], strict=False),
             )
             lora_rank = dict_s2["lora_rank"]
             lora_config = LoraConfig(
@@ -595,71 +716,288 @@ class TTS:
                 init_lora_weights=True,
             )
             vits_model.cfm = get_peft_model(vits_model.cfm, lora_config)
-            print(
-                f"Loading LoRA weights from {weights_path}. {vits_model.load_state_dict(dict_s2['weight'], strict=False)}"
+            logger.info(
+                "Loading LoRA weights from %s. %s",
+                weights_path,
+                vits_model.load_state_dict(dict_s2["weight"], strict=False),
             )
 
             vits_model.cfm = vits_model.cfm.merge_and_unload()
 
         vits_model = vits_model.to(self.configs.device)
         vits_model = vits_model.eval()
-
-        self.vits_model = vits_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
-            self.vits_model = self.vits_model.half()
+            vits_model = vits_model.half()
 
-        self.configs.save_configs()
+        entry = ModelEntry("vits", name, entry_weights_path, vits_model, meta)
+        entry.cpu_weights = self._cpu_weights(vits_model)
+        return entry
 
+    def _activate_vits(self, entry: ModelEntry, save: bool = False, restore_voice: bool = True):
+        """
+        Make `entry` the SoVITS model of the following requests: its hps go to self.configs, and with
+        `restore_voice` the reference voice in use is recomputed for it (voice_cache keeps the voices of
+        every resident model).
+        """
+        self._wait_for_detached_streams()
+        previous = self.vits_entry
+        meta = entry.meta
+        for key in [
+            "filter_length",
+            "segment_size",
+            "sampling_rate",
+            "hop_length",
+            "win_length",
+            "n_speakers",
+            "semantic_frame_rate",
+        ]:
+            setattr(self.configs, key, meta[key])
+        self.configs.vits_weights_path = entry.weights_path
+        self.configs.update_version(meta["model_version"])
+        self.configs.use_vocoder = meta["use_vocoder"]
+        if meta["use_vocoder"]:
+            self.init_vocoder(meta["model_version"])
+        self.is_v2pro = meta["model_version"] in {"v2Pro", "v2ProPlus"}
+        self.vits_entry = entry
+        self.vits_model = entry.model
+        if save:
+            self.configs.save_configs()
 
+        # prompt_semantic, refer_spec and ge all come from the SoVITS model
+        prompt_cache = self.prompt_cache
+        self.prompt_cache = self._new_prompt_cache()
+        if restore_voice and previous is not None and prompt_cache["ref_audio_path"] is not None:
+            try:
+                self.set_ref_audio(
+                    prompt_cache["ref_audio_path"], prompt_cache["prompt_text"], prompt_cache["prompt_lang"]
+                )
+            except Exception as e:
+                logger.warning("Failed to set %s again for %s: %s", prompt_cache["ref_audio_path"], entry.name, e)
 
     def init_t2s_weights(self, weights_path: str):
+        """
+        Load the T2S weights and switch to them right away, see `load_weights` for the non-blocking way.
+        """
+        entry = self.models.add(self._load_t2s_weights(weights_path), activate=True)
+        self._activate_t2s(entry, save=True)
+
+    def _load_t2s_weights(self, weights_path: str, name: str = None) -> ModelEntry:
+        name = str(weights_path) if name in [None, ""] else name
         weights_path = str(root_dir / weights_path)
-        print(f"Loading Text2Semantic weights from {weights_path}")
-        self.configs.t2s_weights_path = weights_path
-        self.configs.save_configs()
-        self.configs.hz = 50
+        logger.info("Loading Text2Semantic weights from %s", weights_path)
         dict_s1 = torch.load(weights_path, map_location=self.configs.device, weights_only=False)
         config = dict_s1["config"]
-        self.configs.max_sec = config["data"]["max_sec"]
         t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
         t2s_model.load_state_dict(dict_s1["weight"])
         t2s_model = t2s_model.to(self.configs.device)
         t2s_model = t2s_model.eval()
-        self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device) != "cpu":
-            self.t2s_model = self.t2s_model.half()
+            t2s_model = t2s_model.half()
+
+        entry = ModelEntry("t2s", name, weights_path, t2s_model, {"max_sec": config["data"]["max_sec"]})
+        entry.cpu_weights = self._cpu_weights(t2s_model)
+        return entry
+
+    def _activate_t2s(self, entry: ModelEntry, save: bool = False):
+        """
+        Make `entry` the T2S model of the following requests.
+        """
+        self._wait_for_detached_streams()
+        previous = self.t2s_entry
+        self.configs.t2s_weights_path = entry.weights_path
+        self.configs.hz = 50
+        self.configs.max_sec = entry.meta["max_sec"]
+        self.t2s_entry = entry
+        self.t2s_model = entry.model
+        if save:
+            self.configs.save_configs()
+        # the prompt K/V come from the T2S model
+        self.prompt_cache["t2s_prompt_kv"] = None
+        for voice in self.voice_cache.values():
+            voice["t2s_prompt_kv"] = None
+        # a replaced model has no user left once we switch away from it
+        if previous is not None and previous.scheduler is not None and previous not in self.models.entries("t2s"):
+            previous.scheduler.shutdown()
+            previous.scheduler = None
+
+    def load_weights(self, kind: str, weights_path: str, name: str = None, activate: bool = True) -> Future:
+        """
+        Load a T2S ("t2s") or SoVITS ("vits") checkpoint on the background loading thread and keep it
+        resident under `name` (the weights path by default), replacing the model of that name if any.
+
+        Requests pick a resident model with inputs["gpt_model"] / inputs["sovits_model"], the active one
+        being used otherwise. With `activate`, the new model becomes the active one once loaded and the
+        switch happens on `executor`, between requests: the running one finishes on the previous weights.
+
+        Returns a Future of the ModelEntry, done after the switch.
+        """
+        load = self._load_t2s_weights if kind == "t2s" else self._load_vits_weights
+
+        def task():
+            entry = self.models.add(load(weights_path, name), activate=activate)
+            if activate:
+                self.executor.submit(self._use_models, None, None, save=True).result()
+            return entry
+
+        return self.models.executor.submit(task)
+
+    def unload_weights(self, kind: str, name: str) -> Future:
+        """
+        Drop a resident model that is not the active one, after the requests already queued on `executor`.
+        """
+
+        def task():
+            self._wait_for_detached_streams()
+            entry = self.models.unload(kind, name)
+            if entry.scheduler is not None:
+                entry.scheduler.shutdown()
+                entry.scheduler = None
+            del entry
+            self.empty_cache()
+
+        return self.executor.submit(task)
+
+    def _use_models(
+        self, gpt_model: str = None, sovits_model: str = None, ref_audio_path: str = None, save: bool = False
+    ):
+        """
+        Switch to the requested resident models (the active ones for None), a reference swap when they
+        are already loaded. Called at the start of every request, so a request keeps the models it
+        started with; such per-request switches leave the config file alone, it is written (`save`) when
+        the active models change in `load_weights`.
+
+        With `ref_audio_path`, the request brings its own reference voice and the one in use is not
+        recomputed for the new SoVITS model.
+        """
+        t2s_entry = self.models.get("t2s", gpt_model)
+        vits_entry = self.models.get("vits", sovits_model)
+        switched = False
+        if t2s_entry is not self.t2s_entry:
+            self._activate_t2s(t2s_entry)
+            switched = True
+        if vits_entry is not self.vits_entry:
+            self._activate_vits(vits_entry, restore_voice=ref_audio_path in [None, ""])
+            switched = True
+        if save and switched:
+            self.configs.save_configs()
+
+    def _cpu_weights(self, model: torch.nn.Module) -> dict:
+        """
+        A CPU copy of `model`'s state dict, in pinned memory when the model is on CUDA so that restoring
+        it is a plain host to device copy. None when `keep_cpu_weights` is off.
+        """
+        if not self.configs.keep_cpu_weights:
+            return None
+        pin = "cuda" in str(self.configs.device) and torch.cuda.is_available()
+        weights = {}
+        for key, value in model.state_dict().items():
+            value = value.detach().to("cpu", copy=True)
+            weights[key] = value.pin_memory() if pin else value
+        return weights
+
+    def _restore_weights(self):
+        """
+        Put back the T2S and SoVITS weights as they were loaded, from the CPU copies, or from disk when
+        there is none.
+        """
+        self._wait_for_detached_streams()
+        if self.t2s_entry.cpu_weights is not None:
+            self.t2s_model.load_state_dict(self.t2s_entry.cpu_weights)
+        else:
+            entry = self.models.add(self._load_t2s_weights(self.t2s_entry.weights_path, self.t2s_entry.name))
+            self._activate_t2s(entry)
+        if self.vits_entry.cpu_weights is not None:
+            self.vits_model.load_state_dict(self.vits_entry.cpu_weights)
+        else:
+            entry = self.models.add(self._load_vits_weights(self.vits_entry.weights_path, self.vits_entry.name))
+            self._activate_vits(entry)
+
+    @staticmethod
+    def _is_oom_error(e: BaseException) -> bool:
+        if isinstance(e, getattr(torch.cuda, "OutOfMemoryError", ())):
+            return True
+        return isinstance(e, RuntimeError) and "out of memory" in str(e)
+
+    def _recover_from_error(self, e: Exception):
+        """
+        Clean up after a failed request without reloading every model from disk.
+
+        The traceback keeps the frames of `_run` and of the models alive, and with them every tensor
+        of the request, so their locals are cleared before emptying the allocator cache. Out of memory
+        only needs that, plus dropping the cached prompt K/V (recomputed on demand). Other
+        RuntimeErrors come from the model code (CUDA / kernel errors), and the weights are put back
+        from their CPU copies in case they were left half updated. Anything else is a request error
+        (bad input, missing file...) and the models are left alone.
+        """
+        logger.error("TTS inference failed", exc_info=e)
+        traceback.clear_frames(e.__traceback__)
+        if self._is_oom_error(e):
+            REGISTRY.inc("tts_oom_total", "TTS.run calls that ran out of memory")
+            logger.warning(i18n("显存不足, 已释放该请求占用的显存"))
+            self.prompt_cache["t2s_prompt_kv"] = None
+            for entry in self.voice_cache.values():
+                entry["t2s_prompt_kv"] = None
+        elif isinstance(e, RuntimeError):
+            REGISTRY.inc("tts_weight_restores_total", "Model weights restored after an inference error")
+            self._restore_weights()
+        self.empty_cache()
+
+    def get_t2s_scheduler(self) -> T2SBatchScheduler:
+        """
+        The continuous-batching engine that merges concurrent streaming requests into one T2S decode loop,
+        one per resident T2S model.
+        """
+        if self.t2s_entry.scheduler is None:
+            self.t2s_entry.scheduler = T2SBatchScheduler(
+                self.t2s_entry.model.model, max_batch_size=self.configs.continuous_batching_size
+            )
+        return self.t2s_entry.scheduler
+
+    def _wait_for_detached_streams(self):
+        """
+        Wait for the detached streaming requests (see run_async) to finish. They use the voice and the
+        models as they were when they were set up, so this is called before changing either.
+        """
+        with self._detached_streams_cond:
+            if self._detached_streams > 0:
+                logger.debug("Waiting for %s streaming requests to finish", self._detached_streams)
+            self._detached_streams_cond.wait_for(lambda: self._detached_streams == 0)
+
+    def _end_detached_stream(self):
+        with self._detached_streams_cond:
+            self._detached_streams -= 1
+            self._detached_streams_cond.notify_all()
 
     def init_vocoder(self, version: str):
-        if version == "v3":
-            if self.vocoder is not None and self.vocoder.__class__.__name__ == "BigVGAN":
-                return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
+        self.vocoder, vocoder_configs = self._load_vocoder(version)
+        self.vocoder_configs.update(vocoder_configs)
 
-            self.vocoder = BigVGAN.from_pretrained(
+    def _load_vocoder(self, version: str):
+        """
+        The vocoder of SoVITS `version` ("v3"/"v4") and its configs, loaded once and kept for every
+        resident model of that version.
+        """
+        if version in self._vocoders:
+            return self._vocoders[version]
+        load_start = time.perf_counter()
+        if version == "v3":
+            vocoder = BigVGAN.from_pretrained(
                 "%s/GPT_SoVITS/pretrained_models/models--nvidia--bigvgan_v2_24khz_100band_256x" % (now_dir,),
                 use_cuda_kernel=False,
             )  # if True, RuntimeError: Ninja is required to load C++ extensions
             # remove weight norm in the model and set to eval mode
-            self.vocoder.remove_weight_norm()
-
-            self.vocoder_configs["sr"] = 24000
-            self.vocoder_configs["T_ref"] = 468
-            self.vocoder_configs["T_chunk"] = 934
-            self.vocoder_configs["upsample_rate"] = 256
-            self.vocoder_configs["overlapped_len"] = 12
+            vocoder.remove_weight_norm()
+
+            vocoder_configs = {
+                "sr": 24000,
+                "T_ref": 468,
+                "T_chunk": 934,
+                "upsample_rate": 256,
+                "overlapped_len": 12,
+            }
 
         elif version == "v4":
-            if self.vocoder is not None and self.vocoder.__class__.__name__ == "Generator":
-                return
-            if self.vocoder is not None:
-                self.vocoder.cpu()
-                del self.vocoder
-                self.empty_cache()
-
-            self.vocoder = Generator(
+            vocoder = Generator(
                 initial_channel=100,
                 resblock="1",
                 resblock_kernel_sizes=[3, 7, 11],
@@ -670,25 +1008,32 @@ class TTS:
                 gin_channels=0,
                 is_bias=True,
             )
-            self.vocoder.remove_weight_norm()
+            vocoder.remove_weight_norm()
             state_dict_g = torch.load(
                 "%s/GPT_SoVITS/pretrained_models/gsv-v4-pretrained/vocoder.pth" % (now_dir,),
                 map_location="cpu",
                 weights_only=False,
             )
-            print("loading vocoder", self.vocoder.load_state_dict(state_dict_g))
-
-            self.vocoder_configs["sr"] = 48000
-            self.vocoder_configs["T_ref"] = 500
-            self.vocoder_configs["T_chunk"] = 1000
-            self.vocoder_configs["upsample_rate"] = 480
-            self.vocoder_configs["overlapped_len"] = 12
+            logger.info("loading vocoder %s", vocoder.load_state_dict(state_dict_g))
+
+            vocoder_configs = {
+                "sr": 48000,
+                "T_ref": 500,
+                "T_chunk": 1000,
+                "upsample_rate": 480,
+                "overlapped_len": 12,
+            }
+        else:
+            raise ValueError(f"no vocoder for SoVITS {version}")
 
-        self.vocoder = self.vocoder.eval()
+        vocoder = vocoder.eval()
         if self.configs.is_half == True:
-            self.vocoder = self.vocoder.half().to(self.configs.device)
+            vocoder = vocoder.half().to(self.configs.device)
         else:
-            self.vocoder = self.vocoder.to(self.configs.device)
+            vocoder = vocoder.to(self.configs.device)
+        add_timing(self._startup_timings, "vocoder", time.perf_counter() - load_start)
+        self._vocoders[version] = (vocoder, vocoder_configs)
+        return self._vocoders[version]
 
     def init_sr_model(self):
         if self.sr_model is not None:
@@ -697,13 +1042,14 @@ class TTS:
             self.sr_model: AP_BWE = AP_BWE(self.configs.device, DictToAttrRecursive)
             self.sr_model_not_exist = False
         except FileNotFoundError:
-            print(i18n("你没有下载超分模型的参数，因此不进行超分。如想超分请先参照教程把文件下载好"))
+            logger.warning(i18n("你没有下载超分模型的参数，因此不进行超分。如想超分请先参照教程把文件下载好"))
             self.sr_model_not_exist = True
 
     def init_sv_model(self):
         if self.sv_model is not None:
             return
-        self.sv_model = SV(self.configs.device, self.configs.is_half)
+        with StageTimer(self._startup_timings, "sv"):
+            self.sv_model = SV(self.configs.device, self.configs.is_half)
 
     def enable_half_precision(self, enable: bool = True, save: bool = True):
         """
@@ -713,11 +1059,15 @@ class TTS:
 
         """
         if str(self.configs.device) == "cpu" and enable:
-            print("Half precision is not supported on CPU.")
+            logger.warning("Half precision is not supported on CPU.")
             return
 
+        self._wait_for_detached_streams()
         self.configs.is_half = enable
         self.precision = torch.float16 if enable else torch.float32
+        self.prompt_cache["ge"] = None
+        self.prompt_cache["t2s_prompt_kv"] = None
+        self.voice_cache.clear()
         if save:
             self.configs.save_configs()
         if enable:
@@ -742,6 +1092,11 @@ class TTS:
                 self.cnhuhbert_model = self.cnhuhbert_model.float()
             if self.vocoder is not None:
                 self.vocoder = self.vocoder.float()
+        # the resident models that are not active (Module.half/float convert in place)
+        for entry in self.models.entries():
+            entry.model.half() if enable else entry.model.float()
+        for vocoder, _ in self._vocoders.values():
+            vocoder.half() if enable else vocoder.float()
 
     def set_device(self, device: torch.device, save: bool = True):
         """
@@ -749,7 +1104,11 @@ class TTS:
         Args:
             device: torch.device, the device to use for all models.
         """
+        self._wait_for_detached_streams()
         self.configs.device = device
+        self.prompt_cache["ge"] = None
+        self.prompt_cache["t2s_prompt_kv"] = None
+        self.voice_cache.clear()
         if save:
             self.configs.save_configs()
         if self.t2s_model is not None:
@@ -764,23 +1123,137 @@ class TTS:
             self.vocoder = self.vocoder.to(device)
         if self.sr_model is not None:
             self.sr_model = self.sr_model.to(device)
+        for entry in self.models.entries():
+            entry.model.to(device)
+        for vocoder, _ in self._vocoders.values():
+            vocoder.to(device)
 
-    def set_ref_audio(self, ref_audio_path: str):
+    def set_ref_audio(self, ref_audio_path: str, prompt_text: str = None, prompt_lang: str = None):
         """
         To set the reference audio for the TTS model,
             including the prompt_semantic and refer_spepc.
         Args:
             ref_audio_path: str, the path of the reference audio.
+            prompt_text: str, (optional) the prompt text of the reference audio, its features are set as well.
+            prompt_lang: str, (optional) the language of the prompt text.
+
+        Recently used voices are kept in memory by `voice_cache`, switching back to one of them
+        only swaps `prompt_cache`. When `voice_cache_dir` is configured, the voice profile is
+        loaded from disk if it was computed before, and saved after it is computed otherwise.
         """
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
+        self._wait_for_detached_streams()
+        prompt_cache = self.voice_cache.get(self._voice_cache_key(ref_audio_path))
+        if prompt_cache is not None and not (self.is_v2pro and prompt_cache["refer_spec"][0][1] is None):
+            self.prompt_cache = prompt_cache
+            if prompt_text not in [None, ""]:
+                self._update_prompt_text(prompt_text, prompt_lang)
+            return
+
+        previous_prompt_cache = self.prompt_cache
+        self.prompt_cache = self._new_prompt_cache()
+        try:
+            if not self._load_voice_profile(ref_audio_path, prompt_text, prompt_lang):
+                self._set_prompt_semantic(ref_audio_path)
+                self._set_ref_spec(ref_audio_path)
+                self._set_ref_audio_path(ref_audio_path)
+                if prompt_text not in [None, ""]:
+                    self._set_prompt_text(prompt_text, prompt_lang)
+                self._save_voice_profile(ref_audio_path, prompt_text, prompt_lang)
+        except Exception:
+            self.prompt_cache = previous_prompt_cache
+            raise
+        self.voice_cache.put(self._voice_cache_key(ref_audio_path), self.prompt_cache)
+
+    def _voice_cache_key(self, ref_audio_path: str) -> str:
+        # a voice is computed with the SoVITS model, each resident model has its own entries
+        return f"{self.vits_entry.key}|{ref_audio_path}"
+
+    def _update_prompt_text(self, prompt_text: str, prompt_lang: str):
+        if self.prompt_cache["prompt_text"] == prompt_text and self.prompt_cache["prompt_lang"] == prompt_lang:
+            return
+        self._wait_for_detached_streams()
+        if not self._load_voice_profile(self.prompt_cache["ref_audio_path"], prompt_text, prompt_lang):
+            self._set_prompt_text(prompt_text, prompt_lang)
+            self._save_voice_profile(self.prompt_cache["ref_audio_path"], prompt_text, prompt_lang)
+        self.voice_cache.evict()
+
+    def _set_prompt_text(self, prompt_text: str, prompt_lang: str):
+        phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+            prompt_text, prompt_lang, self.configs.version
+        )
+        self.prompt_cache["prompt_text"] = prompt_text
+        self.prompt_cache["prompt_lang"] = prompt_lang
+        self.prompt_cache["phones"] = phones
+        self.prompt_cache["bert_features"] = bert_features
+        self.prompt_cache["norm_text"] = norm_text
+        self.prompt_cache["t2s_prompt_kv"] = None
+
+    def _voice_profile_key(self, ref_audio_path: str, prompt_text: str, prompt_lang: str) -> str:
+        # prompt_semantic and refer_spec depend on the SoVITS weights, not only on the version
+        version = f"{self.configs.version}:{self.configs.vits_weights_path}"
+        return self.voice_profile_store.make_key(ref_audio_path, prompt_text, prompt_lang, version)
+
+    def _load_voice_profile(self, ref_audio_path: str, prompt_text: str = None, prompt_lang: str = None) -> bool:
+        if self.voice_profile_store is None:
+            return False
+        profile = self.voice_profile_store.load(self._voice_profile_key(ref_audio_path, prompt_text, prompt_lang))
+        if profile is None:
+            return False
+
+        device = self.configs.device
+        spec = profile["refer_spec"].to(device)
+        sv_audio = profile["sv_audio"].to(device) if profile["sv_audio"] is not None else None
+        if self.configs.is_half:
+            spec = spec.half()
+            sv_audio = sv_audio.half() if sv_audio is not None else None
+        if self.prompt_cache["refer_spec"] in [[], None]:
+            self.prompt_cache["refer_spec"] = [(spec, sv_audio)]
+        else:
+            self.prompt_cache["refer_spec"][0] = (spec, sv_audio)
+        self.prompt_cache["ge"] = None
+        self.prompt_cache["t2s_prompt_kv"] = None
+        self.prompt_cache["prompt_semantic"] = profile["prompt_semantic"].to(device)
+        self.prompt_cache["raw_audio"] = profile["raw_audio"].to(device) if profile["raw_audio"] is not None else None
+        self.prompt_cache["raw_sr"] = profile["raw_sr"]
         self._set_ref_audio_path(ref_audio_path)
+        if prompt_text not in [None, ""]:
+            self.prompt_cache["prompt_text"] = prompt_text
+            self.prompt_cache["prompt_lang"] = prompt_lang
+            self.prompt_cache["phones"] = profile["phones"]
+            self.prompt_cache["bert_features"] = profile["bert_features"].to(device)
+            self.prompt_cache["norm_text"] = profile["norm_text"]
+        return True
+
+    def _save_voice_profile(self, ref_audio_path: str, prompt_text: str = None, prompt_lang: str = None):
+        if self.voice_profile_store is None:
+            return
+        spec, sv_audio = self.prompt_cache["refer_spec"][0]
+        profile = {
+            "prompt_semantic": self.prompt_cache["prompt_semantic"],
+            "refer_spec": spec.float(),
+            "sv_audio": sv_audio.float() if sv_audio is not None else None,
+            # only the vocoder models (v3/v4) read the raw reference audio back
+            "raw_audio": self.prompt_cache["raw_audio"] if self.configs.use_vocoder else None,
+            "raw_sr": self.prompt_cache["raw_sr"],
+            "phones": None,
+            "bert_features": None,
+            "norm_text": None,
+        }
+        if prompt_text not in [None, ""]:
+            profile["phones"] = self.prompt_cache["phones"]
+            profile["bert_features"] = self.prompt_cache["bert_features"]
+            profile["norm_text"] = self.prompt_cache["norm_text"]
+        try:
+            self.voice_profile_store.save(self._voice_profile_key(ref_audio_path, prompt_text, prompt_lang), profile)
+        except Exception as e:
+            logger.warning("Failed to save voice profile of %s: %s", ref_audio_path, e)
 
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path
 
     def _set_ref_spec(self, ref_audio_path):
         spec_audio = self._get_ref_spec(ref_audio_path)
+        self.prompt_cache["ge"] = None
         if self.prompt_cache["refer_spec"] in [[], None]:
             self.prompt_cache["refer_spec"] = [spec_audio]
         else:
@@ -823,6 +1296,44 @@ class TTS:
             audio = None
         return spec, audio
 
+    def _get_prompt_kv_cache(self):
+        """
+        Get the T2S K/V cache of the current reference prompt, computed once per voice and prompt text.
+        """
+        if self.prompt_cache["t2s_prompt_kv"] is None:
+            self.prompt_cache["t2s_prompt_kv"] = self.t2s_model.model.build_prompt_kv_cache(
+                torch.LongTensor(self.prompt_cache["phones"]).unsqueeze(0).to(self.configs.device),
+                self.prompt_cache["bert_features"].unsqueeze(0).to(dtype=self.precision, device=self.configs.device),
+                self.prompt_cache["prompt_semantic"].unsqueeze(0).to(self.configs.device),
+            )
+        return self.prompt_cache["t2s_prompt_kv"]
+
+    def _get_ge(self):
+        """
+        Get the global conditioning of the current reference set, computed once per reference set.
+
+        The reference encoder (plus the SV embedding for v2Pro) runs over every spectrogram in
+        prompt_cache["refer_spec"] and the results are averaged; the fused tensor is kept in
+        prompt_cache["ge"] until the reference audio, the SoVITS weights, the device or the
+        precision change. SoVITS v3/v4 only condition on the main reference audio.
+        """
+        if self.prompt_cache["ge"] is None and self.configs.use_vocoder:
+            raw_entry = self.prompt_cache["refer_spec"][0]
+            if isinstance(raw_entry, tuple):
+                raw_entry = raw_entry[0]
+            refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
+            self.prompt_cache["ge"] = self.vits_model.get_ge(refer_audio_spec)
+        elif self.prompt_cache["ge"] is None:
+            refer_audio_spec = []
+            sv_emb = [] if self.is_v2pro else None
+            for spec, audio_tensor in self.prompt_cache["refer_spec"]:
+                spec = spec.to(dtype=self.precision, device=self.configs.device)
+                refer_audio_spec.append(spec)
+                if self.is_v2pro:
+                    sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
+            self.prompt_cache["ge"] = self.vits_model.get_ge(refer_audio_spec, sv_emb)
+        return self.prompt_cache["ge"]
+
     def _set_prompt_semantic(self, ref_wav_path: str):
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
@@ -848,6 +1359,7 @@ class TTS:
 
             prompt_semantic = codes[0, 0].to(self.configs.device)
             self.prompt_cache["prompt_semantic"] = prompt_semantic
+            self.prompt_cache["t2s_prompt_kv"] = None
 
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length: int = None):
         seq = sequences[0]
@@ -1005,14 +1517,94 @@ class TTS:
 
     def stop(
         self,
+        cancel_token: CancellationToken = None,
     ):
         """
-        Stop the inference process.
+        Stop the inference process of `cancel_token`, or of every running request when it is None.
+        """
+        if cancel_token is not None:
+            cancel_token.cancel()
+            return
+        with self._active_tokens_lock:
+            tokens = list(self._active_tokens)
+        for token in tokens:
+            token.cancel()
+
+    async def run_async(self, inputs: dict, executor: Executor = None, max_queued_chunks: int = 16):
         """
-        self.stop_flag = True
+        Async version of `run`, see `run` for `inputs`.
+
+        `run` is executed on `executor` (`self.executor` by default) and what it yields is delivered
+        through an asyncio.Queue holding at most `max_queued_chunks` entries. When the consumer stops
+        iterating (client disconnect, task cancellation, `aclose`), decoding is stopped at the next T2S
+        token or vocoder chunk and the executor is free for the next request.
+
+        The deadline of inputs["timeout"] starts at submission, so a request that waited past it in
+        the queue fails with `DeadlineExceededError` without being run.
+
+        With `continuous_batching`, a streaming request (return_fragment) leaves `executor` once its
+        voice, models and T2S stream are set up and continues on `stream_executor`: the next request is
+        set up meanwhile, and the T2S of the concurrent streams is decoded in one batch by the shared
+        `T2SBatchScheduler`. Changing the voice or the models waits for these requests to finish.
+        """
+        submitted = time.perf_counter()
+        timings = inputs.get("timings", None)
+        cancel_token = CancellationToken(timeout=inputs.get("timeout", None), parent=inputs.get("cancel_token", None))
+        inputs = {**inputs, "timings": {} if timings is None else timings, "cancel_token": cancel_token}
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue(maxsize=max(1, max_queued_chunks))
+        done = object()
+
+        def put(item) -> bool:
+            try:
+                future = asyncio.run_coroutine_threadsafe(results.put(item), loop)
+            except RuntimeError:  # event loop closed
+                return False
+            while not cancel_token.cancelled:
+                try:
+                    future.result(timeout=0.1)
+                    return True
+                except FutureTimeoutError:
+                    continue
+            future.cancel()
+            return False
+
+        def drive(generator):
+            try:
+                for item in generator:
+                    if item is DETACH:
+                        self.stream_executor.submit(drive, generator)
+                        generator = None
+                        return
+                    if not put(item):
+                        break
+            except Exception as e:
+                put(e)
+            finally:
+                if generator is not None:
+                    generator.close()
+                    put(done)
+
+        def produce():
+            if cancel_token.cancelled:
+                return
+            inputs["timings"]["queue_wait"] = time.perf_counter() - submitted
+            drive(self.run(inputs, detach=True))
+
+        loop.run_in_executor(executor or self.executor, produce)
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancel_token.cancel()
 
     @torch.no_grad()
-    def run(self, inputs: dict):
+    def run(self, inputs: dict, detach: bool = False):
         """
         Text to speech inference.
 
@@ -1043,12 +1635,88 @@ class TTS:
                     "initial_chunk_size": 10,     # int. the amount of tokens to be yielded per chunk if streaming is enabled.
                     "chunk_increase_rate": 5,     # int. the amount of tokens to increase the chunk size by if streaming is enabled.
                     "max_chunk_size": 20,         # int. the maximum amount of tokens to be yielded per chunk if streaming is enabled.
+                    "context_size": 25,           # int. the amount of already decoded tokens re-fed to SoVITS as left context per streaming chunk.
+                    "lookahead_size": 3,          # int. the amount of trailing tokens held back per streaming chunk until their right context is generated.
+                    "experimental_prompt_kv_cache": False, # bool. EXPERIMENTAL, reuse the T2S K/V of the reference prompt across requests (streaming or parallel_infer=False). the model was not trained with a prompt that does not attend to the target text, results differ, see examples/benchmark_prompt_kv_cache.py.
+                    "timings": None,              # dict.(optional) filled with the latency breakdown of this request, see metrics.py.
+                    "progress_callback": None,    # callable.(optional) progress_callback(stage, step, total), stage being "t2s" (per token) or "vocoder" (per segment).
+                    "cancel_token": None,         # CancellationToken.(optional) cancels this request only, see cancellation.py.
+                    "timeout": None,              # float.(optional) deadline in seconds, DeadlineExceededError is raised once it has passed.
+                    "gpt_model": None,            # str.(optional) name of the resident T2S model to use, the active one by default, see load_weights.
+                    "sovits_model": None,         # str.(optional) name of the resident SoVITS model to use, the active one by default.
                 }
+            detach (bool): let a streaming request continue on another thread, see run_async. `DETACH`
+                is yielded once the request no longer reads the voice or model state, the caller is
+                expected to resume the generator elsewhere.
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
+        timings: dict = inputs.get("timings", None)
+        if timings is None:
+            timings = {}
+        cancel_token: CancellationToken = inputs.get("cancel_token", None)
+        if cancel_token is None:
+            cancel_token = CancellationToken()
+        timeout = inputs.get("timeout", None)
+        if timeout is not None and cancel_token.deadline is None:
+            cancel_token.set_timeout(timeout)
+        with self._active_tokens_lock:
+            self._active_tokens.add(cancel_token)
+        start = time.perf_counter()
+        failed = False
+        detached = False
+        recover_error = None
+        generator = self._run(inputs, timings, cancel_token, detach=detach)
+        try:
+            if cancel_token.deadline_exceeded:
+                raise DeadlineExceededError("deadline exceeded before the request started")
+            for item in generator:
+                if item is DETACH:
+                    with self._detached_streams_cond:
+                        self._detached_streams += 1
+                    detached = True
+                    yield item
+                    continue
+                sr, audio = item
+                if "first_chunk" not in timings:
+                    timings["first_chunk"] = time.perf_counter() - start
+                timings["audio_seconds"] = timings.get("audio_seconds", 0.0) + len(audio) / sr
+                yield sr, audio
+            if cancel_token.deadline_exceeded:
+                raise DeadlineExceededError("deadline exceeded, the request was aborted")
+        except DeadlineExceededError:
+            failed = True
+            raise
+        except Exception as e:
+            failed = True
+            if detached:
+                # on `executor` once this request is over, the other requests may be using the models
+                recover_error = e
+            else:
+                self._recover_from_error(e)
+            raise
+        finally:
+            with self._active_tokens_lock:
+                self._active_tokens.discard(cancel_token)
+            generator.close()
+            del generator
+            if detached:
+                self._end_detached_stream()
+                if recover_error is not None:
+                    self.executor.submit(self._recover_from_error, recover_error)
+            if cancel_token.stopped:
+                # the aborted request's KV caches and activations are unreferenced now, release them
+                self.empty_cache()
+                REGISTRY.inc("tts_request_aborts_total", "TTS.run calls cancelled or past their deadline")
+            timings["total"] = time.perf_counter() - start
+            observe_timings(timings)
+            REGISTRY.inc("tts_requests_total", "Finished TTS.run calls")
+            if failed:
+                REGISTRY.inc("tts_request_errors_total", "TTS.run calls that raised")
+
+    @torch.no_grad()
+    def _run(self, inputs: dict, timings: dict, cancel_token: CancellationToken, detach: bool = False):
         ########## variables initialization ###########
-        self.stop_flag: bool = False
         text: str = inputs.get("text", "")
         text_lang: str = inputs.get("text_lang", "")
         ref_audio_path: str = inputs.get("ref_audio_path", "")
@@ -1075,34 +1743,44 @@ class TTS:
         initial_chunk_size = inputs.get("initial_chunk_size", 10)
         chunk_increase_rate = inputs.get("chunk_increase_rate", 5)
         max_chunk_size = inputs.get("max_chunk_size", 20)
+        context_size = inputs.get("context_size", 25)
+        lookahead_size = inputs.get("lookahead_size", 3)
+        use_prompt_kv_cache = inputs.get("experimental_prompt_kv_cache", False)
+        progress_callback = inputs.get("progress_callback", None)
+
+        self._use_models(inputs.get("gpt_model", None), inputs.get("sovits_model", None), ref_audio_path)
+
+        if use_prompt_kv_cache and parallel_infer and not return_fragment:
+            logger.warning("experimental_prompt_kv_cache is not supported with parallel_infer, it is ignored")
+            use_prompt_kv_cache = False
 
         if parallel_infer:
-            print(i18n("并行推理模式已开启"))
+            logger.info(i18n("并行推理模式已开启"))
             self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
-            print(i18n("并行推理模式已关闭"))
+            logger.info(i18n("并行推理模式已关闭"))
             self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
 
         if return_fragment:
-            print(i18n("分段返回模式已开启"))
+            logger.info(i18n("分段返回模式已开启"))
             if split_bucket:
                 split_bucket = False
-                print(i18n("分段返回模式不支持分桶处理，已自动关闭分桶处理"))
+                logger.info(i18n("分段返回模式不支持分桶处理，已自动关闭分桶处理"))
 
         if split_bucket and speed_factor == 1.0 and not (self.configs.use_vocoder and parallel_infer):
-            print(i18n("分桶处理模式已开启"))
+            logger.info(i18n("分桶处理模式已开启"))
         elif speed_factor != 1.0:
-            print(i18n("语速调节不支持分桶处理，已自动关闭分桶处理"))
+            logger.info(i18n("语速调节不支持分桶处理，已自动关闭分桶处理"))
             split_bucket = False
         elif self.configs.use_vocoder and parallel_infer:
-            print(i18n("当开启并行推理模式时，SoVits V3/4模型不支持分桶处理，已自动关闭分桶处理"))
+            logger.info(i18n("当开启并行推理模式时，SoVits V3/4模型不支持分桶处理，已自动关闭分桶处理"))
             split_bucket = False
         else:
-            print(i18n("分桶处理模式已关闭"))
+            logger.info(i18n("分桶处理模式已关闭"))
 
         if fragment_interval < 0.01:
             fragment_interval = 0.01
-            print(i18n("分段间隔过小，已自动设置为0.01"))
+            logger.info(i18n("分段间隔过小，已自动设置为0.01"))
 
         no_prompt_text = False
         if prompt_text in [None, ""]:
@@ -1124,71 +1802,111 @@ class TTS:
 
         ###### setting reference audio and prompt text preprocessing ########
         t0 = time.perf_counter()
+        if not no_prompt_text:
+            prompt_text = prompt_text.strip("\n")
+            if prompt_text[-1] not in splits:
+                prompt_text += "。" if prompt_lang != "en" else "."
+            logger.info("%s %s", i18n("实际输入的参考文本:"), prompt_text)
+
         if (ref_audio_path is not None) and (
             ref_audio_path != self.prompt_cache["ref_audio_path"]
             or (self.is_v2pro and self.prompt_cache["refer_spec"][0][1] is None)
         ):
             if not os.path.exists(ref_audio_path):
                 raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
+            if no_prompt_text:
+                self.set_ref_audio(ref_audio_path)
+            else:
+                self.set_ref_audio(ref_audio_path, prompt_text, prompt_lang)
 
         aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
         paths = set(aux_ref_audio_paths) & set(self.prompt_cache["aux_ref_audio_paths"])
         if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+            self._wait_for_detached_streams()
             self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
             self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+            self.prompt_cache["ge"] = None
             for path in aux_ref_audio_paths:
                 if path in [None, ""]:
                     continue
                 if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过："), path)
+                    logger.warning("%s %s", i18n("音频文件不存在，跳过："), path)
                     continue
                 self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
 
+        t_ref = time.perf_counter()
+        add_timing(timings, "ref_audio", t_ref - t0)
         if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if prompt_text[-1] not in splits:
-                prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
-                    prompt_text, prompt_lang, self.configs.version
-                )
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
+            self._update_prompt_text(prompt_text, prompt_lang)
 
         ###### text preprocessing ########
         t1 = time.perf_counter()
+        add_timing(timings, "prompt_text", t1 - t_ref)
         data: list = None
 
-        data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
-        if len(data) == 0:
-            yield 16000, np.zeros(int(16000), dtype=np.float32)
-            return
-
         batch_index_list: list = None
-        data, batch_index_list = self.to_batch(
-            data,
-            prompt_data=self.prompt_cache if not no_prompt_text else None,
-            batch_size=batch_size,
-            threshold=batch_threshold,
-            split_bucket=split_bucket,
-            device=self.configs.device,
-            precision=self.precision,
-        )
+        if return_fragment:
+            # segments are preprocessed lazily on a producer thread, synthesis starts as soon as the first one is ready
+            data = self._iter_batches(
+                self.text_preprocessor.preprocess_iter(
+                    text, text_lang, text_split_method, self.configs.version, timings=timings
+                ),
+                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                batch_size=batch_size,
+                device=self.configs.device,
+                precision=self.precision,
+            )
+        else:
+            data = self.text_preprocessor.preprocess(
+                text, text_lang, text_split_method, self.configs.version, timings=timings
+            )
+            if len(data) == 0:
+                yield 16000, np.zeros(int(16000), dtype=np.float32)
+                return
+
+            data, batch_index_list = self.to_batch(
+                data,
+                prompt_data=self.prompt_cache if not no_prompt_text else None,
+                batch_size=batch_size,
+                threshold=batch_threshold,
+                split_bucket=split_bucket,
+                device=self.configs.device,
+                precision=self.precision,
+            )
 
         t2 = time.perf_counter()
+        semantic_stream = None
         try:
-            print("############ 推理 ############")
+            logger.info("############ 推理 ############")
             ###### inference ######
             t_34 = 0.0
             t_45 = 0.0
             audio = []
             output_sr = self.configs.sampling_rate if not self.configs.use_vocoder else self.vocoder_configs["sr"]
-            for item in data:
+            streamed_items = 0
+            if return_fragment:
+                semantic_stream = self._stream_semantic_tokens(
+                    data,
+                    None if no_prompt_text else self.prompt_cache["prompt_semantic"].unsqueeze(0).to(self.configs.device),
+                    initial_chunk_size=initial_chunk_size,
+                    chunk_increase_rate=chunk_increase_rate,
+                    max_chunk_size=max_chunk_size,
+                    top_k=top_k,
+                    top_p=top_p,
+                    temperature=temperature,
+                    early_stop_num=self.configs.hz * self.configs.max_sec,
+                    repetition_penalty=repetition_penalty,
+                    prompt_kv_cache=self._get_prompt_kv_cache() if use_prompt_kv_cache and not no_prompt_text else None,
+                    should_stop=cancel_token.should_stop,
+                    timings=timings,
+                    progress_callback=progress_callback,
+                )
+                if detach and self.configs.continuous_batching:
+                    # the scheduler, prompt and voice are resolved, and ge is cached in prompt_cache
+                    self._get_ge()
+                    yield DETACH
+            # when streaming, the batch items come out of the T2S producer, see _stream_semantic_tokens
+            for item in semantic_stream if return_fragment else data:
                 t3 = time.perf_counter()
 
                 batch_phones: List[torch.LongTensor] = item["phones"]
@@ -1200,7 +1918,7 @@ class TTS:
                 norm_text: str = item["norm_text"]
                 max_len = item["max_len"]
 
-                print(i18n("前端处理后的文本(每句):"), norm_text)
+                logger.info("%s %s", i18n("前端处理后的文本(每句):"), norm_text)
                 if no_prompt_text:
                     prompt = None
                 else:
@@ -1208,144 +1926,125 @@ class TTS:
                         self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
                     )
 
-                print(f"############ {i18n('预测语义Token')} ############")
+                prompt_kv_cache = self._get_prompt_kv_cache() if use_prompt_kv_cache and prompt is not None else None
+
+                logger.info("############ %s ############", i18n("预测语义Token"))
                 if return_fragment:
-                    refer_audio_spec: list[torch.Tensor] = []
-                    if self.is_v2pro:
-                        sv_emb = []
-                        
-                    for spec, audio_tensor in self.prompt_cache["refer_spec"]:
-                        spec = spec.to(dtype=self.precision, device=self.configs.device)
-                        refer_audio_spec.append(spec)
-                        if self.is_v2pro:
-                            sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
-                            
-                    zc_index1 = zc_index2 = crossing_direction = 0
-                    first_chunk = True
-                    last_chunk = False
-                    search_length = output_sr * 5 # Search length of 5 seconds
-                    generated_tokens_list = []
-                    
-                    # start_time = time.time()
-                    for pred_semantic_chunk in self.t2s_model.model.infer_panel_stream(
-                        all_phoneme_ids[0].unsqueeze(0),
-                        all_phoneme_lens[0],
-                        prompt[0].unsqueeze(0) if prompt is not None else None,
-                        all_bert_features[0].unsqueeze(0),
-                        initial_chunk_size=initial_chunk_size,
-                        chunk_increase_rate=chunk_increase_rate,
-                        max_chunk_size=max_chunk_size,
-                        top_k=top_k,
-                        top_p=top_p,
-                        temperature=temperature,
-                        early_stop_num=self.configs.hz * self.configs.max_sec,
-                        max_len=max_len,
-                        repetition_penalty=repetition_penalty,
-                    ):       
-                        # If for some reason we continue generating tokens after the last chunk has been found, break the loop
-                        if last_chunk:
-                            print("Last Chunk Was Already Processed, Breaking Out!")
-                            break
-                        # print(f"Token List Generated ({time.time() - start_time:.2f}s) Of Shape {pred_semantic_chunk.shape}")
-                        # Prepare input for decoding
-                        phones = batch_phones[0].unsqueeze(0).to(self.configs.device)
-                        
-                        generated_tokens_list.append(pred_semantic_chunk)
-                        total_tokens = sum([tokens.size(1) for tokens in generated_tokens_list])
-                        tokens_to_process = torch.cat(generated_tokens_list, dim=1)[:, :total_tokens]
-                        
-                        eos_token = self.t2s_model.model.EOS
-                        eos_found = (tokens_to_process == eos_token).any()
-                        if eos_found:
-                            tokens_to_process = tokens_to_process.masked_fill(tokens_to_process == eos_token, 0)
-                            last_chunk = True
-                            
-                        pred_semantic = tokens_to_process.unsqueeze(0)
-
-                        # Decode all of the tokens into audio chunks
-                        if not self.configs.use_vocoder:
-                            # start_time = time.time()
-                            if self.is_v2pro:
-                                audio_output = self.vits_model.decode(
-                                    pred_semantic, 
-                                    phones, 
-                                    refer_audio_spec, 
+                    streamed_items += 1
+                    ge = self._get_ge()
+                    eos_token = self.t2s_model.model.EOS
+                    # every segment of the batch is streamed, T2S of the next ones runs ahead on the producer thread
+                    for i in range(len(batch_phones)):
+                        phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
+                        semantic_tokens = None
+                        last_chunk = False
+                        # SoVITS v1/v2/v2Pro: windowed decoding, only the new tokens (plus context) are decoded per chunk
+                        decoded_len = 0
+                        fade_tail = None
+                        # SoVITS v3/v4: the whole prefix is re-synthesized and cut at zero crossings
+                        zc_index1 = zc_index2 = crossing_direction = 0
+                        first_chunk = True
+                        search_length = output_sr * 5 # Search length of 5 seconds
+
+                        segment_chunks = self._next_segment_chunks(semantic_stream)
+                        for pred_semantic_chunk in segment_chunks:
+                            if cancel_token.stopped:
+                                return
+                            # If for some reason we continue generating tokens after the last chunk has been found, break the loop
+                            if last_chunk:
+                                logger.debug("Last Chunk Was Already Processed, Breaking Out!")
+                                break
+
+                            eos_found = (pred_semantic_chunk == eos_token).any()
+                            if eos_found:
+                                pred_semantic_chunk = pred_semantic_chunk[:, pred_semantic_chunk[0] != eos_token]
+                                last_chunk = True
+                            if semantic_tokens is None:
+                                semantic_tokens = pred_semantic_chunk
+                            else:
+                                semantic_tokens = torch.cat([semantic_tokens, pred_semantic_chunk], dim=1)
+
+                            if not self.configs.use_vocoder:
+                                with StageTimer(timings, "vocoder"):
+                                    audio_chunk, decoded_len, fade_tail = self._decode_stream_chunk(
+                                        semantic_tokens,
+                                        phones,
+                                        ge,
+                                        decoded_len,
+                                        fade_tail,
+                                        last_chunk,
+                                        context_size=context_size,
+                                        lookahead_size=lookahead_size,
+                                        speed=speed_factor,
+                                    )
+                                if audio_chunk is not None:
+                                    yield output_sr, audio_chunk
+                                continue
+
+                            # Decode all of the tokens into audio chunks
+                            with StageTimer(timings, "vocoder"):
+                                audio_output = self.using_vocoder_synthesis(
+                                    semantic_tokens.unsqueeze(0),
+                                    phones,
                                     speed=speed_factor,
-                                    sv_emb=sv_emb
-                                ).detach()[0, 0, :]
+                                    sample_steps=sample_steps
+                                )
+                                audio_output = audio_output[:].cpu().numpy().astype(np.float32)
+
+                            # Normalize audio if needed
+                            max_val = np.abs(audio_output).max()
+                            if max_val > 1.0:
+                                audio_output /= max_val
+
+                            # In the case that the first chunk is the last chunk, yield the audio and break out of the loop
+                            if first_chunk and eos_found:
+                                logger.debug("EOS Found In First Chunk, Yielding Audio And Breaking Out Of Loop!")
+                                yield output_sr, audio_output
+                                break
+
+                            # Zero-cross splitting
+                            start_index = len(audio_output) - search_length
+                            if start_index < 0:
+                                search_length = len(audio_output)
+                                start_index = 0
+
+                            previous_center_index = zc_index2
+                            max_offset = int(search_length // 2)
+
+                            if first_chunk:
+                                zc_index1, crossing_direction = find_zero_zone(
+                                    audio_output,
+                                    start_index,
+                                    search_length
+                                )
+                                audio_chunk = audio_output[:zc_index1]
+                                first_chunk = False
+                                zc_index2 = zc_index1
+                            elif last_chunk:
+                                zc_index1 = find_matching_index(
+                                    audio_output,
+                                    previous_center_index,
+                                    max_offset,
+                                    crossing_direction
+                                )
+                                audio_chunk = audio_output[zc_index1:]
                             else:
-                                audio_output = self.vits_model.decode(
-                                    pred_semantic, 
-                                    phones, 
-                                    refer_audio_spec, 
-                                    speed=speed_factor
-                                ).detach()[0, 0, :]
-                            # print(f"VITS Decoding took {time.time() - start_time:.2f}s")
-                        else:
-                            # start_time = time.time()
-                            audio_output = self.using_vocoder_synthesis(
-                                pred_semantic,
-                                phones, 
-                                speed=speed_factor,
-                                sample_steps=sample_steps
-                            )
-                            # print(f"Vocoder Decoding took {time.time() - start_time:.2f}s")
-                        audio_output = audio_output[:].cpu().numpy().astype(np.float32)
-                        
-                        # Normalize audio if needed
-                        max_val = np.abs(audio_output).max()
-                        if max_val > 1.0:
-                            audio_output /= max_val
-                        
-                        # In the case that the first chunk is the last chunk, yield the audio and break out of the loop
-                        if first_chunk and eos_found:
-                            print(f"EOS Found In First Chunk, Yielding Audio And Breaking Out Of Loop!")
-                            yield output_sr, audio_output
-                            break
-                        
-                        # Zero-cross splitting
-                        start_index = len(audio_output) - search_length
-                        if start_index < 0:
-                            search_length = len(audio_output)
-                            start_index = 0
-                            
-                        previous_center_index = zc_index2
-                        max_offset = int(search_length // 2)
-                        
-                        if first_chunk:
-                            zc_index1, crossing_direction = find_zero_zone(
-                                audio_output, 
-                                start_index, 
-                                search_length
-                            )
-                            audio_chunk = audio_output[:zc_index1]
-                            # print(f"(First Chunk) ZC Index 1: {zc_index1} | Audio Output Length: {audio_output.shape[0]}")
-                            first_chunk = False
-                            zc_index2 = zc_index1
-                        elif last_chunk:
-                            zc_index1 = find_matching_index(
-                                audio_output,
-                                previous_center_index, 
-                                max_offset, 
-                                crossing_direction
-                            )
-                            audio_chunk = audio_output[zc_index1:]
-                            # print(f"(Last Chunk) ZC Index 1: {zc_index1} | Audio Output Length: {audio_output.shape[0]}")
-                        else:
-                            zc_index1 = find_matching_index(
-                                audio_output, 
-                                previous_center_index,
-                                max_offset,
-                                crossing_direction
-                            )
-                            zc_index2, crossing_direction = find_zero_zone(
-                                audio_output, 
-                                start_index,
-                                search_length
-                            )
-                            audio_chunk = audio_output[zc_index1:zc_index2]
-                            # print(f"(Mid Chunk) ZC Index 1: {zc_index1} | ZC Index 2: {zc_index2} | Audio Output Length: {audio_output.shape[0]}")
-                        yield output_sr, audio_chunk
+                                zc_index1 = find_matching_index(
+                                    audio_output,
+                                    previous_center_index,
+                                    max_offset,
+                                    crossing_direction
+                                )
+                                zc_index2, crossing_direction = find_zero_zone(
+                                    audio_output,
+                                    start_index,
+                                    search_length
+                                )
+                                audio_chunk = audio_output[zc_index1:zc_index2]
+                            yield output_sr, audio_chunk
+                        # drop what is left of this segment after an early break
+                        for _ in segment_chunks:
+                            pass
                     self.empty_cache()
                 else:
                     pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
@@ -1360,18 +2059,15 @@ class TTS:
                         early_stop_num=self.configs.hz * self.configs.max_sec,
                         max_len=max_len,
                         repetition_penalty=repetition_penalty,
+                        prompt_kv_cache=prompt_kv_cache,
+                        should_stop=cancel_token.should_stop,
+                        timings=timings,
+                        progress_callback=progress_callback,
                     )
                     t4 = time.perf_counter()
                     t_34 += t4 - t3
 
-                    refer_audio_spec = []
-                    if self.is_v2pro:
-                        sv_emb = []
-                    for spec, audio_tensor in self.prompt_cache["refer_spec"]:
-                        spec = spec.to(dtype=self.precision, device=self.configs.device)
-                        refer_audio_spec.append(spec)
-                        if self.is_v2pro:
-                            sv_emb.append(self.sv_model.compute_embedding3(audio_tensor))
+                    ge = self._get_ge()
 
                     batch_audio_fragment = []
 
@@ -1387,10 +2083,10 @@ class TTS:
                     # batch_audio_fragment = (self.vits_model.batched_decode(
                     #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
                     #     ))
-                    print(f"############ {i18n('合成音频')} ############")
+                    logger.info("############ %s ############", i18n("合成音频"))
                     if not self.configs.use_vocoder:
                         if speed_factor == 1.0:
-                            print(f"{i18n('并行合成中')}...")
+                            logger.info("%s...", i18n("并行合成中"))
                             # ## vits并行推理 method 2
                             pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
                             upsample_rate = math.prod(self.vits_model.upsample_rates)
@@ -1403,14 +2099,9 @@ class TTS:
                                 torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
                             )
                             _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
-                            if self.is_v2pro != True:
-                                _batch_audio_fragment = self.vits_model.decode(
-                                    all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor
-                                ).detach()[0, 0, :]
-                            else:
-                                _batch_audio_fragment = self.vits_model.decode(
-                                    all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                ).detach()[0, 0, :]
+                            _batch_audio_fragment = self.vits_model.decode(
+                                all_pred_semantic, _batch_phones, None, speed=speed_factor, ge=ge
+                            ).detach()[0, 0, :]
                             audio_frag_end_idx.insert(0, 0)
                             batch_audio_fragment = [
                                 _batch_audio_fragment[audio_frag_end_idx[i - 1] : audio_frag_end_idx[i]]
@@ -1418,29 +2109,28 @@ class TTS:
                             ]
                         else:
                             # ## vits串行推理
-                            for i, idx in enumerate(tqdm(idx_list)):
+                            for i, idx in enumerate(idx_list):
                                 phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
                                 _pred_semantic = (
                                     pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
                                 )  # .unsqueeze(0)#mq要多unsqueeze一次
-                                if self.is_v2pro != True:
-                                    audio_fragment = self.vits_model.decode(
-                                        _pred_semantic, phones, refer_audio_spec, speed=speed_factor
-                                    ).detach()[0, 0, :]
-                                else:
-                                    audio_fragment = self.vits_model.decode(
-                                        _pred_semantic, phones, refer_audio_spec, speed=speed_factor, sv_emb=sv_emb
-                                    ).detach()[0, 0, :]
+                                audio_fragment = self.vits_model.decode(
+                                    _pred_semantic, phones, None, speed=speed_factor, ge=ge
+                                ).detach()[0, 0, :]
                                 batch_audio_fragment.append(audio_fragment)  ###试试重建不带上prompt部分
+                                if cancel_token.stopped:
+                                    break
+                                if progress_callback is not None:
+                                    progress_callback("vocoder", i + 1, len(idx_list))
                     else:
                         if parallel_infer:
-                            print(f"{i18n('并行合成中')}...")
+                            logger.info("%s...", i18n("并行合成中"))
                             audio_fragments = self.using_vocoder_synthesis_batched_infer(
                                 idx_list, pred_semantic_list, batch_phones, speed=speed_factor, sample_steps=sample_steps
                             )
                             batch_audio_fragment.extend(audio_fragments)
                         else:
-                            for i, idx in enumerate(tqdm(idx_list)):
+                            for i, idx in enumerate(idx_list):
                                 phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
                                 _pred_semantic = (
                                     pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0)
@@ -1449,17 +2139,26 @@ class TTS:
                                     _pred_semantic, phones, speed=speed_factor, sample_steps=sample_steps
                                 )
                                 batch_audio_fragment.append(audio_fragment)
+                                if cancel_token.stopped:
+                                    break
+                                if progress_callback is not None:
+                                    progress_callback("vocoder", i + 1, len(idx_list))
 
                     t5 = time.perf_counter()
                     t_45 += t5 - t4
+                    add_timing(timings, "vocoder", t5 - t4)
                     audio.append(batch_audio_fragment)
 
-                    if self.stop_flag:
+                    if cancel_token.stopped:
                         yield 16000, np.zeros(int(16000), dtype=np.float32)
                         return
 
+            if return_fragment and streamed_items == 0:
+                yield 16000, np.zeros(int(16000), dtype=np.float32)
+                return
+
             if not return_fragment:
-                print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t_34, t_45))
+                logger.info("%.3f\t%.3f\t%.3f\t%.3f", t1 - t0, t2 - t1, t_34, t_45)
                 if len(audio) == 0:
                     yield 16000, np.zeros(int(16000), dtype=np.float32)
                     return
@@ -1473,21 +2172,134 @@ class TTS:
                     super_sampling if self.configs.use_vocoder and self.configs.version == "v3" else False,
                 )
 
-        except Exception as e:
-            traceback.print_exc()
-            # 必须返回一个空音频, 否则会导致显存不释放。
-            yield 16000, np.zeros(int(16000), dtype=np.float32)
-            # 重置模型, 否则会导致显存释放不完全。
-            del self.t2s_model
-            del self.vits_model
-            self.t2s_model = None
-            self.vits_model = None
-            self.init_t2s_weights(self.configs.t2s_weights_path)
-            self.init_vits_weights(self.configs.vits_weights_path)
-            raise e
+        # errors are handled by run, see _recover_from_error
         finally:
+            if semantic_stream is not None:
+                semantic_stream.close()
             self.empty_cache()
 
+    def _stream_semantic_tokens(self, data, prompt: torch.Tensor, max_queued_chunks: int = 16, **kwargs):
+        """
+        Run streaming T2S over the batch items of `data` on a producer thread.
+
+        Yields every batch item when its T2S starts, followed by (segment index, chunk) for each of its
+        segments, chunk being None once a segment is finished. The producer moves on to the next
+        segment as soon as the current one hits EOS, so its tokens are generated while the caller is
+        still vocoding the previous segment. At most `max_queued_chunks` entries are buffered ahead of
+        the caller.
+        """
+        infer_panel_stream = (
+            self.get_t2s_scheduler().stream if self.configs.continuous_batching else self.t2s_model.model.infer_panel_stream
+        )
+        should_stop = kwargs["should_stop"]
+
+        def generate():
+            for item in data:
+                if should_stop():
+                    return
+                yield item
+                for i in range(len(item["all_phones"])):
+                    for chunk in infer_panel_stream(
+                        item["all_phones"][i].unsqueeze(0),
+                        item["all_phones_len"][i],
+                        prompt,
+                        item["all_bert_features"][i].unsqueeze(0),
+                        max_len=item["max_len"],
+                        **kwargs,
+                    ):
+                        if should_stop():
+                            return
+                        yield i, chunk
+                    yield i, None
+
+        # joined when the stream is closed, so that no decode step is still running when _run returns
+        # (the next request, or _restore_weights, would share the T2S model with it)
+        return prefetch(generate(), max_prefetch=max_queued_chunks, name="T2SStreamProducer", join_timeout=10)
+
+    def _iter_batches(self, segments, batch_size: int = 1, **kwargs):
+        """
+        `to_batch` over consecutive groups of `batch_size` lazily produced segments, in input order.
+        """
+        group = []
+        for segment in segments:
+            group.append(segment)
+            if len(group) >= batch_size:
+                yield from self.to_batch(group, batch_size=batch_size, split_bucket=False, **kwargs)[0]
+                group = []
+        if len(group) > 0:
+            yield from self.to_batch(group, batch_size=batch_size, split_bucket=False, **kwargs)[0]
+
+    @staticmethod
+    def _next_segment_chunks(semantic_stream):
+        for _, chunk in semantic_stream:
+            if chunk is None:
+                return
+            yield chunk
+
+    def _decode_stream_chunk(
+        self,
+        semantic_tokens: torch.Tensor,
+        phones: torch.Tensor,
+        ge: torch.Tensor,
+        decoded_len: int,
+        fade_tail: torch.Tensor,
+        last_chunk: bool,
+        context_size: int = 25,
+        lookahead_size: int = 3,
+        speed: float = 1.0,
+    ):
+        """
+        Decode the semantic tokens generated since the previous streaming chunk.
+
+        Only the new tokens plus at most `context_size` already decoded tokens are passed to SoVITS,
+        so the cost of a chunk does not grow with the position in the sentence. The last
+        `lookahead_size` tokens are held back until the next chunk gives them right context, and the
+        start of every chunk is cross-faded with the tail decoded ahead of time by the previous one.
+
+        Args:
+            semantic_tokens (torch.Tensor): all semantic tokens generated so far, shape (1, T).
+            ge (torch.Tensor): global conditioning of the reference set, see _get_ge().
+            decoded_len (int): number of tokens whose audio has already been emitted.
+            fade_tail (torch.Tensor): audio decoded past `decoded_len` by the previous chunk.
+            last_chunk (bool): whether generation has finished.
+
+        Returns:
+            Tuple[np.ndarray, int, torch.Tensor]: the audio to emit (None if no token is ready yet),
+                the updated `decoded_len` and the tail to cross-fade into the next chunk.
+        """
+        total_len = semantic_tokens.shape[-1]
+        end = total_len if last_chunk else total_len - lookahead_size
+        if end <= decoded_len:
+            return None, decoded_len, fade_tail
+
+        start = max(0, decoded_len - context_size)
+        audio = self.vits_model.decode(
+            semantic_tokens[:, start:].unsqueeze(0),
+            phones,
+            None,
+            speed=speed,
+            ge=ge,
+            context_length=decoded_len - start,
+        ).detach()[0, 0, :]
+
+        samples_per_token = audio.shape[-1] / (total_len - decoded_len)
+        emit_len = audio.shape[-1] if last_chunk else int((end - decoded_len) * samples_per_token)
+        audio_chunk = audio[:emit_len].clone()
+        if fade_tail is not None:
+            fade_len = min(fade_tail.shape[-1], audio_chunk.shape[-1])
+            fade_in = torch.linspace(0, 1, fade_len, dtype=audio_chunk.dtype, device=audio_chunk.device)
+            audio_chunk[:fade_len] = audio_chunk[:fade_len] * fade_in + fade_tail[:fade_len] * (1 - fade_in)
+
+        fade_tail = audio[emit_len : emit_len + int(samples_per_token)]
+        if last_chunk or fade_tail.shape[-1] == 0:
+            fade_tail = None
+
+        audio_chunk = audio_chunk.cpu().numpy().astype(np.float32)
+        max_val = np.abs(audio_chunk).max()
+        if max_val > 1.0:
+            audio_chunk /= max_val
+        return audio_chunk, end, fade_tail
+
     def empty_cache(self):
         try:
             gc.collect()  # 触发gc的垃圾回收。避免内存一直增长。
@@ -1529,7 +2341,7 @@ class TTS:
         audio = torch.cat(audio, dim=0)
 
         if super_sampling:
-            print(f"############ {i18n('音频超采样')} ############")
+            logger.info("############ %s ############", i18n("音频超采样"))
             t1 = time.perf_counter()
             self.init_sr_model()
             if not self.sr_model_not_exist:
@@ -1538,7 +2350,7 @@ class TTS:
                 if max_audio > 1:
                     audio /= max_audio
             t2 = time.perf_counter()
-            print(f"超采样用时：{t2 - t1:.3f}s")
+            logger.info("超采样用时：%.3fs", t2 - t1)
         else:
             # audio = audio.cpu().numpy()
             audio = audio.cpu().numpy().astype(np.float32)
@@ -1563,7 +2375,7 @@ class TTS:
             raw_entry = raw_entry[0]
         refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
 
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
+        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec, self._get_ge())
         ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
         ref_sr = self.prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
@@ -1633,7 +2445,7 @@ class TTS:
             raw_entry = raw_entry[0]
         refer_audio_spec = raw_entry.to(dtype=self.precision, device=self.configs.device)
 
-        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec)
+        fea_ref, ge = self.vits_model.decode_encp(prompt_semantic_tokens, prompt_phones, refer_audio_spec, self._get_ge())
         ref_audio: torch.Tensor = self.prompt_cache["raw_audio"]
         ref_sr = self.prompt_cache["raw_sr"]
         ref_audio = ref_audio.to(self.configs.device).float()
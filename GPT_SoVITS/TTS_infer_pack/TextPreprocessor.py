@@ -1,27 +1,32 @@
+import logging
 import os
 import sys
 import threading
-
-from tqdm import tqdm
+from contextlib import nullcontext
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
+import time
 import torch
 from GPT_SoVITS.text.LangSegmenter import LangSegmenter
 from GPT_SoVITS.text import chinese
 from typing import Dict, List, Tuple
 from GPT_SoVITS.text.cleaner import clean_text
+from GPT_SoVITS.text.g2p_cache import G2P_CACHE
 from GPT_SoVITS.text import cleaned_text_to_sequence
 from transformers import AutoModelForMaskedLM, AutoTokenizer
 from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from GPT_SoVITS.TTS_infer_pack.prefetch import prefetch
+from GPT_SoVITS.TTS_infer_pack.metrics import StageTimer, add_timing
 
 from GPT_SoVITS.tools.i18n.i18n import I18nAuto, scan_language_list
 
 language = os.environ.get("language", "Auto")
 language = sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
+logger = logging.getLogger(__name__)
 punctuation = set(["!", "?", "…", ",", ".", "-"])
 
 
@@ -56,32 +61,75 @@ class TextPreprocessor:
         self.device = device
         self.bert_lock = threading.RLock()
 
-    def preprocess(self, text: str, lang: str, text_split_method: str, version: str = "v2") -> List[Dict]:
-        print(f"############ {i18n('切分文本')} ############")
+    def preprocess(
+        self, text: str, lang: str, text_split_method: str, version: str = "v2", timings: dict = None
+    ) -> List[Dict]:
+        start = time.perf_counter()
+        logger.info("############ %s ############", i18n("切分文本"))
         text = self.replace_consecutive_punctuation(text)
         texts = self.pre_seg_text(text, lang, text_split_method)
         result = []
-        print(f"############ {i18n('提取文本Bert特征')} ############")
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
-            if phones is None or norm_text == "":
-                continue
-            res = {
-                "phones": phones,
-                "bert_features": bert_features,
-                "norm_text": norm_text,
-            }
-            result.append(res)
+        logger.info("############ %s ############", i18n("提取文本Bert特征"))
+        for phones, bert_features, norm_text in self.get_phones_and_bert_batch(texts, lang, version, timings=timings):
+            res = self.make_segment(phones, bert_features, norm_text)
+            if res is not None:
+                result.append(res)
+        add_timing(timings, "text_frontend", time.perf_counter() - start)
         return result
 
+    def preprocess_iter(
+        self,
+        text: str,
+        lang: str,
+        text_split_method: str,
+        version: str = "v2",
+        lookahead: int = 2,
+        timings: dict = None,
+    ):
+        """
+        Lazy version of `preprocess`.
+
+        The text is split up front, then the segments are converted on a producer thread and yielded as
+        soon as their phones and BERT features are ready, so synthesis of the first segment overlaps the
+        frontend of the next ones. At most `lookahead` finished segments wait for the consumer, which
+        keeps memory flat for book-length input.
+        """
+        with StageTimer(timings, "text_frontend"):
+            logger.info("############ %s ############", i18n("切分文本"))
+            text = self.replace_consecutive_punctuation(text)
+            texts = self.pre_seg_text(text, lang, text_split_method)
+
+        def segments():
+            for text in texts:
+                with StageTimer(timings, "text_frontend"):
+                    res = self.preprocess_segment(text, lang, version, timings=timings)
+                if res is not None:
+                    yield res
+
+        return prefetch(segments(), max_prefetch=lookahead, name="TextPreprocessor")
+
+    def preprocess_segment(self, text: str, lang: str, version: str = "v2", timings: dict = None) -> Dict:
+        phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version, timings)
+        return self.make_segment(phones, bert_features, norm_text)
+
+    @staticmethod
+    def make_segment(phones: list, bert_features: torch.Tensor, norm_text: str) -> Dict:
+        if phones is None or norm_text == "":
+            return None
+        return {
+            "phones": phones,
+            "bert_features": bert_features,
+            "norm_text": norm_text,
+        }
+
     def pre_seg_text(self, text: str, lang: str, text_split_method: str):
         text = text.strip("\n")
         if len(text) == 0:
             return []
         if text[0] not in splits and len(get_first(text)) < 4:
             text = "。" + text if lang != "en" else "." + text
-        print(i18n("实际输入的目标文本:"))
-        print(text)
+        logger.info(i18n("实际输入的目标文本:"))
+        logger.info(text)
 
         seg_method = get_seg_method(text_split_method)
         text = seg_method(text)
@@ -110,98 +158,172 @@ class TextPreprocessor:
             else:
                 texts.append(text)
 
-        print(i18n("实际输入的目标文本(切句后):"))
-        print(texts)
+        logger.info(i18n("实际输入的目标文本(切句后):"))
+        logger.info("%s", texts)
         return texts
 
     def segment_and_extract_feature_for_text(
-        self, text: str, language: str, version: str = "v1"
+        self, text: str, language: str, version: str = "v1", timings: dict = None
     ) -> Tuple[list, torch.Tensor, str]:
-        return self.get_phones_and_bert(text, language, version)
+        return self.get_phones_and_bert(text, language, version, timings=timings)
+
+    def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False, timings: dict = None):
+        return self.get_phones_and_bert_batch([text], language, version, final, timings)[0]
 
-    def get_phones_and_bert(self, text: str, language: str, version: str, final: bool = False):
+    def get_phones_and_bert_batch(
+        self, texts: List[str], language: str, version: str, final: bool = False, timings: dict = None
+    ) -> List[Tuple[list, torch.Tensor, str]]:
+        """
+        `get_phones_and_bert` for several texts, the BERT features of all their Chinese runs are
+        computed together in padded batches.
+        """
         with self.bert_lock:
-            text = re.sub(r' {2,}', ' ', text)
-            textlist = []
-            langlist = []
-            if language == "all_zh":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_yue":
-                for tmp in LangSegmenter.getTexts(text,"zh"):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ja":
-                for tmp in LangSegmenter.getTexts(text,"ja"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "all_ko":
-                for tmp in LangSegmenter.getTexts(text,"ko"):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "en":
-                langlist.append("en")
-                textlist.append(text)
-            elif language == "auto":
-                for tmp in LangSegmenter.getTexts(text):
-                    langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            elif language == "auto_yue":
-                for tmp in LangSegmenter.getTexts(text):
-                    if tmp["lang"] == "zh":
-                        tmp["lang"] = "yue"
+            texts = [re.sub(r' {2,}', ' ', text) for text in texts]
+            sub_texts = []
+            for i, text in enumerate(texts):
+                textlist, langlist = self.split_languages(text, language)
+                sub_texts.extend((i, sub_text, lang) for sub_text, lang in zip(textlist, langlist))
+            # g2pw of all the Chinese runs (not cached yet) in one ONNX run
+            zh_texts = [
+                sub_text
+                for _, sub_text, lang in sub_texts
+                if lang.replace("all_", "") == "zh" and not G2P_CACHE.contains("zh", version, sub_text)
+            ]
+            runs = []
+            with self.g2pw_batch(zh_texts, version):
+                for i, sub_text, lang in sub_texts:
+                    phones, word2ph, norm_text = self.clean_text_inf(sub_text, lang, version)
+                    runs.append((i, phones, word2ph, norm_text, lang.replace("all_", "")))
+
+            zh_runs = [run for run in runs if run[4] == "zh"]
+            with StageTimer(timings, "bert"):
+                zh_features = iter(self.get_bert_features([run[3] for run in zh_runs], [run[2] for run in zh_runs]))
+
+            phones_list = [[] for _ in texts]
+            bert_list = [[] for _ in texts]
+            norm_text_list = [[] for _ in texts]
+            for i, phones, word2ph, norm_text, lang in runs:
+                if lang == "zh":
+                    bert = next(zh_features)
+                else:
+                    bert = torch.zeros(
+                        (1024, len(phones)),
+                        dtype=torch.float32,
+                    ).to(self.device)
+                phones_list[i].extend(phones)
+                bert_list[i].append(bert)
+                norm_text_list[i].append(norm_text)
+
+            results = [
+                (phones_list[i], torch.cat(bert_list[i], dim=1), "".join(norm_text_list[i])) for i in range(len(texts))
+            ]
+
+            short = [i for i in range(len(texts)) if not final and len(results[i][0]) < 6]
+            if len(short) > 0:
+                retried = self.get_phones_and_bert_batch(
+                    ["." + texts[i] for i in short], language, version, final=True, timings=timings
+                )
+                for i, result in zip(short, retried):
+                    results[i] = result
+
+            return results
+
+    @staticmethod
+    def g2pw_batch(texts: List[str], version: str):
+        if version == "v1" or len(texts) == 0:
+            # v1 uses the pypinyin frontend (text.chinese)
+            return nullcontext()
+        from GPT_SoVITS.text import chinese2
+
+        return chinese2.g2pw_batch(texts)
+
+    def split_languages(self, text: str, language: str) -> Tuple[List[str], List[str]]:
+        textlist = []
+        langlist = []
+        if language == "all_zh":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_yue":
+            for tmp in LangSegmenter.getTexts(text,"zh"):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ja":
+            for tmp in LangSegmenter.getTexts(text,"ja"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "all_ko":
+            for tmp in LangSegmenter.getTexts(text,"ko"):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "en":
+            langlist.append("en")
+            textlist.append(text)
+        elif language == "auto":
+            for tmp in LangSegmenter.getTexts(text):
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        elif language == "auto_yue":
+            for tmp in LangSegmenter.getTexts(text):
+                if tmp["lang"] == "zh":
+                    tmp["lang"] = "yue"
+                langlist.append(tmp["lang"])
+                textlist.append(tmp["text"])
+        else:
+            for tmp in LangSegmenter.getTexts(text):
+                if langlist:
+                    if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
+                        textlist[-1] += tmp["text"]
+                        continue
+                if tmp["lang"] == "en":
                     langlist.append(tmp["lang"])
-                    textlist.append(tmp["text"])
-            else:
-                for tmp in LangSegmenter.getTexts(text):
-                    if langlist:
-                        if (tmp["lang"] == "en" and langlist[-1] == "en") or (tmp["lang"] != "en" and langlist[-1] != "en"):
-                            textlist[-1] += tmp["text"]
-                            continue
-                    if tmp["lang"] == "en":
-                        langlist.append(tmp["lang"])
-                    else:
-                        # 因无法区别中日韩文汉字,以用户输入为准
-                        langlist.append(language)
-                    textlist.append(tmp["text"])
-            # print(textlist)
-            # print(langlist)
-            phones_list = []
-            bert_list = []
-            norm_text_list = []
-            for i in range(len(textlist)):
-                lang = langlist[i]
-                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                phones_list.append(phones)
-                norm_text_list.append(norm_text)
-                bert_list.append(bert)
-            bert = torch.cat(bert_list, dim=1)
-            phones = sum(phones_list, [])
-            norm_text = "".join(norm_text_list)
-
-            if not final and len(phones) < 6:
-                return self.get_phones_and_bert("." + text, language, version, final=True)
-
-            return phones, bert, norm_text
+                else:
+                    # 因无法区别中日韩文汉字,以用户输入为准
+                    langlist.append(language)
+                textlist.append(tmp["text"])
+        return textlist, langlist
 
     def get_bert_feature(self, text: str, word2ph: list) -> torch.Tensor:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+        return self.get_bert_features([text], [word2ph])[0]
+
+    def get_bert_features(self, texts: List[str], word2phs: List[list], batch_size: int = 16) -> List[torch.Tensor]:
+        """
+        Phone-level BERT features, (1024, len(phones)) each, of several texts.
+
+        Texts of similar length are padded into one forward pass that stops at the third to last hidden
+        layer (the last two encoder layers and the masked LM head are skipped), which is expanded to phone
+        level with repeat_interleave.
+        """
+        features = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            index = order[start : start + batch_size]
+            with torch.no_grad():
+                inputs = self.tokenizer([texts[i] for i in index], return_tensors="pt", padding=True)
+                for key in inputs:
+                    inputs[key] = inputs[key].to(self.device)
+                hidden_states = self._bert_hidden_states(inputs, skip_last_layers=2)
+                token_lens = inputs["attention_mask"].sum(dim=1).tolist()
+            for j, i in enumerate(index):
+                assert len(word2phs[i]) == len(texts[i])
+                res_i = hidden_states[j, 1 : token_lens[j] - 1]
+                repeats = torch.tensor(word2phs[i], dtype=torch.long, device=res_i.device)
+                features[i] = torch.repeat_interleave(res_i, repeats, dim=0).T
+        return features
+
+    def _bert_hidden_states(self, inputs, skip_last_layers: int) -> torch.Tensor:
+        # hidden_states[-1 - skip_last_layers] of the base model, without running the skipped layers
+        bert = self.bert_model.base_model
+        attention_mask = bert.get_extended_attention_mask(inputs["attention_mask"], inputs["input_ids"].shape)
+        hidden_states = bert.embeddings(
+            input_ids=inputs["input_ids"], token_type_ids=inputs.get("token_type_ids", None)
+        )
+        for layer in bert.encoder.layer[: len(bert.encoder.layer) - skip_last_layers]:
+            outputs = layer(hidden_states, attention_mask=attention_mask)
+            hidden_states = outputs[0] if isinstance(outputs, tuple) else outputs
+        return hidden_states
 
     def clean_text_inf(self, text: str, language: str, version: str = "v2"):
         language = language.replace("all_", "")
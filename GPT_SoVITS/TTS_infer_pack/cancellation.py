@@ -0,0 +1,67 @@
+import time
+from typing import Optional
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    Raised by `TTS.run` when the request's deadline passed before it finished.
+    """
+
+
+class CancellationToken:
+    """
+    Cancellation and deadline of one TTS request, pass it as inputs["cancel_token"].
+
+    `cancel()` may be called from any thread. The T2S decode loops poll `should_stop()` once per
+    token: the cancel flag is a plain attribute read, while the deadline (and the parent token, if
+    any) is only looked at every `check_interval` calls, so polling costs no clock read per token.
+    Vocoder chunk boundaries use the exact `stopped`.
+
+    A token created with `parent` also stops when the parent does, e.g. run_async wraps the caller's
+    token so that closing the async generator does not cancel the caller's one.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        parent: Optional["CancellationToken"] = None,
+        check_interval: int = 8,
+    ):
+        self.deadline: Optional[float] = None
+        self.parent = parent
+        self.check_interval = max(1, int(check_interval))
+        self._cancelled: bool = False
+        self._calls: int = 0
+        if timeout is not None:
+            self.set_timeout(timeout)
+
+    def set_timeout(self, timeout: float):
+        """
+        Set the deadline `timeout` seconds from now.
+        """
+        self.deadline = time.monotonic() + float(timeout)
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled or (self.parent is not None and self.parent.cancelled)
+
+    @property
+    def deadline_exceeded(self) -> bool:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.parent is not None and self.parent.deadline_exceeded
+
+    @property
+    def stopped(self) -> bool:
+        return self.cancelled or self.deadline_exceeded
+
+    def should_stop(self) -> bool:
+        if self._cancelled:
+            return True
+        self._calls += 1
+        if self._calls % self.check_interval != 0:
+            return False
+        return self.stopped
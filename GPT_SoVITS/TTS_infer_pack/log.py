@@ -0,0 +1,19 @@
+import logging
+
+LOGGER_NAME = "GPT_SoVITS"
+
+
+def set_log_level(level="INFO"):
+    """
+    Set the level of the `GPT_SoVITS.*` loggers, "WARNING" being the quiet mode for serving (only
+    problems are logged, the per-request messages are skipped).
+
+    When the application has not configured logging, a plain stderr handler is attached so the
+    messages show up as they did with print.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
@@ -0,0 +1,158 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# A request's timings are a plain dict filled by TTS.run (and TTS.run_async / the api), pass
+# inputs["timings"] = {} to get it back. Stage values are seconds summed over the request.
+#   queue_wait     waiting for a free TTS executor (run_async)
+#   ref_audio      loading the reference audio(s): spectrogram, hubert, sv embedding
+#   prompt_text    prompt text phones and BERT features
+#   text_frontend  target text segmentation, G2P and BERT (bert is also reported on its own)
+#   bert           BERT forward passes of the target text
+#   t2s_prefill    T2S first step over the prompt
+#   t2s_decode     T2S following steps, one token each (t2s_tokens counts them)
+#   vocoder        SoVITS / vocoder decoding
+#   encode         packing to the output media type (api)
+#   first_chunk    run start to first yielded audio
+#   total          run start to end
+# plus the counters t2s_tokens and audio_seconds.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PER_TOKEN_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+STAGES = [
+    "queue_wait",
+    "ref_audio",
+    "prompt_text",
+    "text_frontend",
+    "bert",
+    "t2s_prefill",
+    "t2s_decode",
+    "vocoder",
+    "encode",
+    "first_chunk",
+    "total",
+]
+
+
+def add_timing(timings: Optional[dict], stage: str, seconds: float):
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+class Histogram:
+    """
+    Prometheus style histogram: cumulative bucket counts, sum and count.
+    """
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters rendered in the Prometheus text format. Collectors are callables
+    returning extra exposition lines (gauges read from live objects, e.g. cache statistics).
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, list] = {}
+        self.collectors: List[Callable[[], List[str]]] = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help: str = "", buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, help, buckets)
+            return self.histograms[name]
+
+    def inc(self, name: str, help: str = "", value: float = 1):
+        with self._lock:
+            if name not in self.counters:
+                self.counters[name] = [help, 0]
+            self.counters[name][1] += value
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = list(self.histograms.values())
+            counters = [(name, help, value) for name, (help, value) in self.counters.items()]
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for name, help, value in counters:
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {value}"])
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def observe_timings(timings: dict, registry: MetricsRegistry = REGISTRY):
+    """
+    Record the stages of one request in the `registry` histograms.
+    """
+    for stage in STAGES:
+        if stage in timings:
+            registry.histogram(f"tts_{stage}_seconds", f"Per request time spent in {stage}").observe(timings[stage])
+    tokens = timings.get("t2s_tokens", 0)
+    if tokens > 0 and "t2s_decode" in timings:
+        registry.histogram(
+            "tts_t2s_token_seconds", "Average T2S decode time per token of a request", PER_TOKEN_BUCKETS
+        ).observe(timings["t2s_decode"] / tokens)
+        registry.inc("tts_t2s_tokens_total", "Generated T2S tokens", tokens)
+    audio_seconds = timings.get("audio_seconds", 0.0)
+    if audio_seconds > 0 and "total" in timings:
+        registry.histogram("tts_rtf", "Real time factor (processing time / audio duration)", RTF_BUCKETS).observe(
+            timings["total"] / audio_seconds
+        )
+        registry.inc("tts_audio_seconds_total", "Synthesized audio duration", audio_seconds)
+
+
+class StageTimer:
+    """
+    `with StageTimer(timings, "vocoder"):` adds the elapsed time of the block to the stage.
+    """
+
+    def __init__(self, timings: Optional[dict], stage: str):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        add_timing(self.timings, self.stage, time.perf_counter() - self.start)
@@ -0,0 +1,118 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# "t2s" is the GPT (Text2Semantic) model, "vits" the SoVITS model
+MODEL_KINDS = ("t2s", "vits")
+
+
+class ModelEntry:
+    """
+    One resident checkpoint. The entry is not modified once published: loading weights again under the
+    same name makes a new entry, with a higher `revision`, that replaces this one by reference.
+
+    `meta` holds what the pipeline has to apply when switching to the model (SoVITS hps, max_sec...).
+    """
+
+    def __init__(self, kind: str, name: str, weights_path: str, model, meta: Optional[dict] = None):
+        assert kind in MODEL_KINDS, f"unknown model kind: {kind}"
+        self.kind = kind
+        self.name = name
+        self.weights_path = weights_path
+        self.model = model
+        self.meta: dict = meta if meta is not None else {}
+        self.revision: int = 0
+        self.loaded_at: float = time.time()
+        # CPU state dict used to restore the weights after a failed inference, see TTS._restore_weights
+        self.cpu_weights: Optional[dict] = None
+        # continuous batching engine of a T2S model, created on first use, see TTS.get_t2s_scheduler
+        self.scheduler = None
+
+    @property
+    def key(self) -> str:
+        return f"{self.kind}:{self.name}@{self.revision}"
+
+
+class ModelRegistry:
+    """
+    The T2S and SoVITS checkpoints resident in one TTS replica, by name, plus the active (default) one of
+    each kind.
+
+    Publishing (`add`) and switching the default (`set_active`) only swap references under a lock, the
+    slow part (torch.load, building the model, moving it to the device) is done by the caller before,
+    typically on `executor`, the registry's background loading thread. Requests resolve their entry
+    with `get` when they start and keep the reference until they finish, so replacing or unloading a
+    model never changes the weights under a running request; the old model is freed with its last user.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, ModelEntry]] = {kind: {} for kind in MODEL_KINDS}
+        self._active: Dict[str, str] = {}
+        self._revision: int = 0
+        self._lock = threading.Lock()
+        # models are loaded here, one at a time, off the inference executor
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModelLoader")
+
+    def add(self, entry: ModelEntry, activate: bool = False) -> ModelEntry:
+        """
+        Publish `entry`, replacing the entry of the same kind and name if any. The first model of a kind
+        becomes the active one.
+        """
+        with self._lock:
+            self._revision += 1
+            entry.revision = self._revision
+            self._entries[entry.kind][entry.name] = entry
+            if activate or entry.kind not in self._active:
+                self._active[entry.kind] = entry.name
+        return entry
+
+    def get(self, kind: str, name: str = None) -> ModelEntry:
+        """
+        The entry named `name`, or the active one when `name` is empty.
+        """
+        with self._lock:
+            if name in [None, ""]:
+                name = self._active.get(kind, None)
+            entry = self._entries[kind].get(name, None)
+        if entry is None:
+            raise ValueError(f"{kind} model {name} is not loaded")
+        return entry
+
+    def set_active(self, kind: str, name: str):
+        with self._lock:
+            if name not in self._entries[kind]:
+                raise ValueError(f"{kind} model {name} is not loaded")
+            self._active[kind] = name
+
+    def unload(self, kind: str, name: str) -> ModelEntry:
+        """
+        Drop `name` from the registry. The active model cannot be unloaded, switch to another one first.
+        """
+        with self._lock:
+            if self._active.get(kind, None) == name:
+                raise ValueError(f"{kind} model {name} is active and cannot be unloaded")
+            entry = self._entries[kind].pop(name, None)
+        if entry is None:
+            raise ValueError(f"{kind} model {name} is not loaded")
+        return entry
+
+    def entries(self, kind: str = None) -> List[ModelEntry]:
+        with self._lock:
+            kinds = MODEL_KINDS if kind is None else (kind,)
+            return [entry for kind in kinds for entry in self._entries[kind].values()]
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                kind: [
+                    {
+                        "name": entry.name,
+                        "weights_path": str(entry.weights_path),
+                        "revision": entry.revision,
+                        "active": self._active.get(kind, None) == entry.name,
+                    }
+                    for entry in self._entries[kind].values()
+                ]
+                for kind in MODEL_KINDS
+            }
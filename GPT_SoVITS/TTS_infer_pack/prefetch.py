@@ -0,0 +1,62 @@
+import logging
+import queue
+import threading
+from typing import Iterable
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def prefetch(iterable: Iterable, max_prefetch: int = 1, name: str = None, join_timeout: float = None):
+    """
+    Iterate `iterable` on a background thread, keeping at most `max_prefetch` items ready ahead of the consumer.
+
+    Exceptions raised by the producer are re-raised to the consumer. Closing the returned generator
+    (or dropping it) stops the producer at its next item. With `join_timeout`, closing also waits up to
+    that many seconds for the producer thread to exit, for producers that use state the consumer is
+    about to change (e.g. the models).
+    """
+    items = queue.Queue(maxsize=max(1, max_prefetch))
+    stop_event = threading.Event()
+    item_, error_, done_ = 0, 1, 2
+
+    def put(entry) -> bool:
+        while not stop_event.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            with torch.no_grad():
+                for item in iterator:
+                    if not put((item_, item)):
+                        return
+        except Exception as e:
+            put((error_, e))
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            put((done_, None))
+
+    producer = threading.Thread(target=produce, name=name, daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, payload = items.get()
+            if kind == done_:
+                return
+            if kind == error_:
+                raise payload
+            yield payload
+    finally:
+        stop_event.set()
+        if join_timeout is not None and producer is not threading.current_thread():
+            producer.join(join_timeout)
+            if producer.is_alive():
+                logger.warning("%s thread still running %ss after it was stopped", producer.name, join_timeout)
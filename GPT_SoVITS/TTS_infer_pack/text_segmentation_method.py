@@ -184,6 +184,61 @@ def cut5(inp):
     return "\n".join(opt)
 
 
+class IncrementalSegmenter:
+    """
+    Splits text that arrives in pieces (e.g. LLM tokens) with one of the registered methods.
+
+    `feed` returns the segments that are complete, i.e. followed by the start of another segment, and
+    keeps the last one buffered since more text may still extend it ("3." + "14"). `flush` returns
+    what is left once the input ends.
+    """
+
+    def __init__(self, method: str = "cut5"):
+        self.method = get_method(method)
+        self.buffer = ""
+
+    def _split(self, text: str) -> list:
+        return [item for item in self.method(text).split("\n") if item.strip() and item != "/n"]
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        if not self.buffer.strip():
+            return []
+        segments = self._split(self.buffer)
+        if len(segments) < 2:
+            return []
+        # the last segment is still open, keep the raw text it came from (the methods may rewrite it, e.g.
+        # split() terminates it with "。", so it cannot be searched for in the buffer)
+        consumed = self._consumed(segments[:-1])
+        if consumed is None:
+            return []
+        self.buffer = self.buffer[consumed:]
+        return segments[:-1]
+
+    def _consumed(self, segments: list):
+        # length of the shortest prefix of the buffer that splits into `segments`
+        for end in range(1, len(self.buffer) + 1):
+            if self._split(self.buffer[:end]) == segments:
+                return end
+        return None
+
+    def flush(self) -> list:
+        text, self.buffer = self.buffer, ""
+        if not text.strip():
+            return []
+        return self._split(text)
+
+    def reset(self):
+        self.buffer = ""
+
+
 if __name__ == "__main__":
     method = get_method("cut5")
     print(method("你好，我是小明。你好，我是小红。你好，我是小刚。你好，我是小张。"))
+
+    # 逐字输入的切分结果拼接后应与原文一致 (保留标点的方法)
+    text = "你好，我是小明。今天天气不错…好不好？明天也许会下雨…晚上我们看电影，然后早点睡觉。" * 3
+    for name in ["cut1", "cut2", "cut5"]:
+        segmenter = IncrementalSegmenter(name)
+        segments = [segment for char in text for segment in segmenter.feed(char)] + segmenter.flush()
+        assert "".join(segments) == text, (name, segments)
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+
+def tensor_bytes(obj) -> tuple:
+    """
+    Return the (gpu_bytes, cpu_bytes) held by the tensors in `obj`, looking into dicts, lists and tuples.
+    """
+    if isinstance(obj, torch.Tensor):
+        size = obj.numel() * obj.element_size()
+        return (0, size) if obj.device.type == "cpu" else (size, 0)
+    if isinstance(obj, dict):
+        obj = obj.values()
+    elif not isinstance(obj, (list, tuple)):
+        return 0, 0
+    gpu_bytes = cpu_bytes = 0
+    for item in obj:
+        _gpu_bytes, _cpu_bytes = tensor_bytes(item)
+        gpu_bytes += _gpu_bytes
+        cpu_bytes += _cpu_bytes
+    return gpu_bytes, cpu_bytes
+
+
+class VoiceCache:
+    """
+    LRU map of reference voices, each entry being a `TTS.prompt_cache` dict.
+
+    Entries are evicted from the least recently used end when there are more than `capacity` of
+    them, or when the tensors they hold exceed `max_gpu_bytes` (any non-CPU device) or
+    `max_cpu_bytes`. The most recently used entry is never evicted, as it is the one in use.
+    Entries are mutated after insertion (lazily computed `ge`, prompt text features), so sizes are
+    measured at eviction time.
+    """
+
+    def __init__(self, capacity: int = 8, max_gpu_bytes: Optional[int] = None, max_cpu_bytes: Optional[int] = None):
+        self.capacity = max(1, int(capacity))
+        self.max_gpu_bytes = max_gpu_bytes
+        self.max_cpu_bytes = max_cpu_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry: dict) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            while len(self._entries) > 1 and self._over_budget():
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def values(self) -> list:
+        with self._lock:
+            return list(self._entries.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _over_budget(self) -> bool:
+        if len(self._entries) > self.capacity:
+            return True
+        if self.max_gpu_bytes is None and self.max_cpu_bytes is None:
+            return False
+        gpu_bytes, cpu_bytes = tensor_bytes(list(self._entries.values()))
+        if self.max_gpu_bytes is not None and gpu_bytes > self.max_gpu_bytes:
+            return True
+        if self.max_cpu_bytes is not None and cpu_bytes > self.max_cpu_bytes:
+            return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            gpu_bytes, cpu_bytes = tensor_bytes(list(self._entries.values()))
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "gpu_bytes": gpu_bytes,
+                "cpu_bytes": cpu_bytes,
+            }
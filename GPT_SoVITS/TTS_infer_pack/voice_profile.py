@@ -0,0 +1,71 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceProfileStore:
+    """
+    On-disk store of preprocessed reference voices.
+
+    A profile holds everything TTS derives from a reference audio and its prompt text
+    (prompt_semantic, refer_spec, the 16 kHz SV audio, the raw audio for the vocoder models and the
+    prompt phones/bert_features/norm_text), so switching to a known voice costs one file read
+    instead of a CNHuBERT, STFT and BERT forward. Profiles are keyed by the content hash of the
+    reference audio, the prompt text, the prompt language and the model version.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._audio_hashes: dict = {}
+        self._lock = threading.Lock()
+
+    def audio_hash(self, audio_path: str) -> str:
+        stat = os.stat(audio_path)
+        stamp = (os.path.abspath(audio_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp in self._audio_hashes:
+                return self._audio_hashes[stamp]
+
+        hash_sha256 = hashlib.sha256()
+        with open(audio_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hash_sha256.update(chunk)
+        digest = hash_sha256.hexdigest()
+        with self._lock:
+            self._audio_hashes[stamp] = digest
+        return digest
+
+    def make_key(self, audio_path: str, prompt_text: Optional[str], prompt_lang: Optional[str], version: str) -> str:
+        key = json.dumps(
+            [self.audio_hash(audio_path), prompt_text or "", prompt_lang or "", version], ensure_ascii=False
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def load(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return torch.load(path, map_location="cpu", weights_only=True)
+        except Exception as e:
+            logger.warning("Failed to load voice profile %s: %s", path, e)
+            return None
+
+    def save(self, key: str, profile: dict) -> None:
+        profile = {k: v.detach().cpu() if isinstance(v, torch.Tensor) else v for k, v in profile.items()}
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(profile, tmp_path)
+        # the rename is atomic, concurrent readers never see a partially written profile
+        os.replace(tmp_path, path)
@@ -0,0 +1,134 @@
+import logging
+import threading
+import zlib
+from concurrent.futures import Future
+from typing import Callable, List, Union
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(RuntimeError):
+    """
+    Raised by `TTSWorkerPool.submit` when every worker already has `max_queue_size` requests.
+    """
+
+
+def voice_key(inputs: dict) -> str:
+    return "|".join([inputs.get("ref_audio_path", "") or ""] + list(inputs.get("aux_ref_audio_paths", None) or []))
+
+
+class TTSStream:
+    """
+    The audio of one request routed by `TTSWorkerPool.submit`, an async iterator of `TTS.run_async` items.
+
+    It holds a slot of its worker until the iteration ends or `aclose()` is called. The slot is released
+    by these explicit calls, not by the finalization of the underlying async generator (which does not run
+    if the generator was never started), so the caller must `aclose()` it on every path, including when it
+    never iterates.
+    """
+
+    def __init__(self, pool: "TTSWorkerPool", worker: "TTSWorker", generator):
+        self.pool = pool
+        self.worker = worker
+        self._generator = generator
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._generator.__anext__()
+        except BaseException:
+            # the generator is finished (exhausted, failed or cancelled)
+            self.release()
+            raise
+
+    def release(self):
+        with self.pool._lock:
+            if self._released:
+                return
+            self._released = True
+            self.worker.pending -= 1
+        for callback in self.pool.release_callbacks:
+            callback()
+
+    async def aclose(self):
+        self.release()
+        await self._generator.aclose()
+
+
+class TTSWorker:
+    """
+    One `TTS` replica. Its requests run one at a time on the replica's own executor (`TTS.executor`).
+    """
+
+    def __init__(self, index: int, configs: Union[dict, str, TTS_Config]):
+        self.index = index
+        self.tts: TTS = TTS(configs)
+        # queued and running requests, guarded by the pool lock
+        self.pending: int = 0
+
+
+class TTSWorkerPool:
+    """
+    `num_workers` TTS replicas, each with its own models and voice cache, behind one dispatcher.
+
+    A request goes to the worker its reference voice hashes to, so a speaker keeps hitting a warm
+    `prompt_cache`, unless that worker is busy and another one is idle. A worker accepts at most
+    `max_queue_size` requests (running one included); when all of them are full `submit` raises
+    `PoolSaturatedError` instead of queueing without bound.
+    """
+
+    def __init__(self, configs: Union[dict, str], num_workers: int = 1, max_queue_size: int = 4):
+        self.max_queue_size = max(1, int(max_queue_size))
+        self._lock = threading.Lock()
+        # called (on the thread releasing it) each time a slot is given back, see `add_release_callback`
+        self.release_callbacks: List[Callable[[], None]] = []
+        self.workers: List[TTSWorker] = []
+        num_workers = max(1, int(num_workers))
+        for index in range(num_workers):
+            logger.info("Loading TTS worker %s/%s...", index + 1, num_workers)
+            self.workers.append(TTSWorker(index, configs))
+
+    @property
+    def configs(self) -> TTS_Config:
+        return self.workers[0].tts.configs
+
+    def _pick(self, key: str) -> TTSWorker:
+        free = [worker for worker in self.workers if worker.pending < self.max_queue_size]
+        if len(free) == 0:
+            raise PoolSaturatedError("all TTS workers are busy")
+        preferred = self.workers[zlib.crc32(key.encode("utf-8")) % len(self.workers)]
+        least_loaded = min(free, key=lambda worker: worker.pending)
+        if preferred in free and (preferred.pending == 0 or least_loaded.pending > 0):
+            return preferred
+        return least_loaded
+
+    def submit(self, inputs: dict, max_queued_chunks: int = 16) -> TTSStream:
+        """
+        Route `inputs` to a worker and return the `TTSStream` of its `TTS.run_async`.
+
+        The slot is taken here, so saturation is reported before any response is started, and is
+        released when the stream ends or is closed, see `TTSStream`.
+        """
+        with self._lock:
+            worker = self._pick(voice_key(inputs))
+            worker.pending += 1
+        return TTSStream(self, worker, worker.tts.run_async(inputs, max_queued_chunks=max_queued_chunks))
+
+    def add_release_callback(self, callback: Callable[[], None]):
+        """
+        Call `callback()` whenever a request gives back its worker slot, so that a caller that got
+        `PoolSaturatedError` can wait for a free slot instead of polling `submit`.
+        """
+        self.release_callbacks.append(callback)
+
+    def broadcast(self, fn: Callable[[TTS], object]) -> List[Future]:
+        """
+        Run `fn(tts)` on every replica's executor, after the requests already queued there (weights and
+        reference changes must not race a running inference). Not subject to `max_queue_size`.
+        """
+        return [worker.tts.executor.submit(fn, worker.tts) for worker in self.workers]
@@ -1,5 +1,9 @@
+import logging
+
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
 def find_zero_zone(chunk, start_index, search_length, search_window_size=11):
     zone = chunk[start_index:start_index + search_length]
 
@@ -20,7 +24,7 @@ def find_zero_crossing(chunk, start_index, search_length):
     sign_changes = np.where(np.diff(np.sign(zone)) != 0)[0]
     
     if len(sign_changes) == 0:
-        print("No zero-crossings found in this zone. This should not be happening!")
+        logger.warning("No zero-crossings found in this zone. This should not be happening!")
     else:
         zc_index = start_index + sign_changes[0] + 1
         prev_value = chunk[zc_index - 1]
@@ -958,8 +958,13 @@ class SynthesizerTrn(nn.Module):
         return o, y_mask, (z, z_p, m_p, logs_p)
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None):
-        def get_ge(refer, sv_emb):
+    def get_ge(self, refer, sv_emb=None):
+        """
+        Global conditioning of the reference audio. A list of reference spectrograms (with one
+        sv_emb per item for v2Pro) is fused into their mean embedding.
+        """
+
+        def _get_ge(refer, sv_emb):
             ge = None
             if refer is not None:
                 refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
@@ -977,11 +982,21 @@ class SynthesizerTrn(nn.Module):
         if type(refer) == list:
             ges = []
             for idx, _refer in enumerate(refer):
-                ge = get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
+                ge = _get_ge(_refer, sv_emb[idx] if self.is_v2pro else None)
                 ges.append(ge)
-            ge = torch.stack(ges, 0).mean(0)
-        else:
-            ge = get_ge(refer, sv_emb)
+            return torch.stack(ges, 0).mean(0)
+        return _get_ge(refer, sv_emb)
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5, speed=1, sv_emb=None, ge=None, context_length=0):
+        """
+        ge: precomputed output of get_ge(refer, sv_emb). When given, refer and sv_emb are ignored.
+        context_length: number of leading tokens in `codes` that only serve as left context
+            (already decoded by a previous call). They are run through enc_p, flow and dec so the
+            receptive fields see real history, but their audio is cut from the returned waveform.
+        """
+        if ge is None:
+            ge = self.get_ge(refer, sv_emb)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1002,6 +1017,9 @@ class SynthesizerTrn(nn.Module):
         z = self.flow(z_p, y_mask, g=ge, reverse=True)
 
         o = self.dec((z * y_mask)[:, :, :], g=ge)
+        if context_length > 0:
+            # speed != 1 stretches the frame axis, so cut proportionally instead of by a fixed hop
+            o = o[:, :, int(o.shape[-1] * context_length / codes.size(2)) :]
         return o
 
     def extract_latent(self, x):
@@ -1241,14 +1259,18 @@ class SynthesizerTrnV3(nn.Module):
         cfm_loss = self.cfm(mel, mel_lengths, prompt_len, fea, use_grad_ckpt)
         return cfm_loss
 
+    @torch.no_grad()
+    def get_ge(self, refer):
+        refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
+        refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
+        return self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
+
     @torch.no_grad()
     def decode_encp(self, codes, text, refer, ge=None, speed=1):
         # print(2333333,refer.shape)
         # ge=None
         if ge == None:
-            refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
-            refer_mask = torch.unsqueeze(commons.sequence_mask(refer_lengths, refer.size(2)), 1).to(refer.dtype)
-            ge = self.ref_enc(refer[:, :704] * refer_mask, refer_mask)
+            ge = self.get_ge(refer)
         y_lengths = torch.LongTensor([int(codes.size(2) * 2)]).to(codes.device)
         if speed == 1:
             sizee = int(codes.size(2) * (3.875 if self.version == "v3" else 4))
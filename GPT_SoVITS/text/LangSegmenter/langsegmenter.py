@@ -1,5 +1,6 @@
 import logging
 import re
+import threading
 
 # jieba静音
 import jieba
@@ -14,35 +15,72 @@ fast_langdetect.infer._default_detector = fast_langdetect.infer.LangDetector(fas
 from split_lang import LangSplitter
 
 
+FULL_EN = re.compile(r'^(?=.*[A-Za-z])[A-Za-z0-9\s\u0020-\u007E\u2000-\u206F\u3000-\u303F\uFF00-\uFFEF]+$')
+
+# 来自wiki
+CJK_RANGES = (
+    r'\u4E00-\u9FFF'            # CJK Unified Ideographs
+    r'\u3400-\u4DB5'            # CJK Extension A
+    r'\U00020000-\U0002A6DD'    # CJK Extension B
+    r'\U0002A700-\U0002B73F'    # CJK Extension C
+    r'\U0002B740-\U0002B81F'    # CJK Extension D
+    r'\U0002B820-\U0002CEAF'    # CJK Extension E
+    r'\U0002CEB0-\U0002EBEF'    # CJK Extension F
+    r'\U00030000-\U0003134A'    # CJK Extension G
+    r'\U00031350-\U000323AF'    # CJK Extension H
+    r'\U0002EBF0-\U0002EE5D'    # CJK Extension H
+)
+CJK_CHARS = re.compile(f'[{CJK_RANGES}0-9、-〜。！？.!?… /]+')
+
+# 单一文字的文本不做语种检测: 标点/数字/空白 + 假名, 或 + 谚文
+NEUTRAL_CHARS = r'0-9\s!-/:-@\[-`{-~\u2000-\u206F\u3000-\u303F\uFF01-\uFF0F\uFF1A-\uFF20\uFF3B-\uFF40\uFF5B-\uFF65'
+KANA_CHARS = r'\u3041-\u3096\u3099-\u30FF'
+HANGUL_CHARS = r'\u1100-\u11FF\u3130-\u318F\uAC00-\uD7AF'
+FULL_KANA = re.compile(f'[{NEUTRAL_CHARS}]*[{KANA_CHARS}][{KANA_CHARS}{NEUTRAL_CHARS}]*')
+FULL_HANGUL = re.compile(f'[{NEUTRAL_CHARS}]*[{HANGUL_CHARS}][{HANGUL_CHARS}{NEUTRAL_CHARS}]*')
+ASCII_LETTER = re.compile(r'[A-Za-z]')
+
+
 def full_en(text):
-    pattern = r'^(?=.*[A-Za-z])[A-Za-z0-9\s\u0020-\u007E\u2000-\u206F\u3000-\u303F\uFF00-\uFFEF]+$'
-    return bool(re.match(pattern, text))
+    return bool(FULL_EN.match(text))
 
 
 def full_cjk(text):
-    # 来自wiki
-    cjk_ranges = [
-        (0x4E00, 0x9FFF),        # CJK Unified Ideographs
-        (0x3400, 0x4DB5),        # CJK Extension A
-        (0x20000, 0x2A6DD),      # CJK Extension B
-        (0x2A700, 0x2B73F),      # CJK Extension C
-        (0x2B740, 0x2B81F),      # CJK Extension D
-        (0x2B820, 0x2CEAF),      # CJK Extension E
-        (0x2CEB0, 0x2EBEF),      # CJK Extension F
-        (0x30000, 0x3134A),      # CJK Extension G
-        (0x31350, 0x323AF),      # CJK Extension H
-        (0x2EBF0, 0x2EE5D),      # CJK Extension H
-    ]
-
-    pattern = r'[0-9、-〜。！？.!?… /]+$'
-
-    cjk_text = ""
-    for char in text:
-        code_point = ord(char)
-        in_cjk = any(start <= code_point <= end for start, end in cjk_ranges)
-        if in_cjk or re.match(pattern, char):
-            cjk_text += char
-    return cjk_text
+    return "".join(CJK_CHARS.findall(text))
+
+
+def single_script_lang(text, default_lang=""):
+    """
+    The language of the whole `text` when it can be told without language detection, else None.
+    For such texts the full segmentation below yields one segment of that language holding all of
+    `text`; leading and trailing whitespace does not change the language, callers may pass it stripped.
+    """
+    if default_lang != "":
+        # 指定语种时只有英文会被切出来
+        return None if ASCII_LETTER.search(text) else default_lang
+    if "\n" in text:
+        # 换行前的纯标点会被单独切成一段
+        return None
+    if text.isascii():
+        return "en" if ASCII_LETTER.search(text) else None
+    if FULL_KANA.fullmatch(text):
+        return "ja"
+    if FULL_HANGUL.fullmatch(text):
+        return "ko"
+    return None
+
+
+_local = threading.local()
+
+
+def get_lang_splitter():
+    # LangSplitter 构造开销较大, 每个线程复用一个
+    lang_splitter = getattr(_local, "lang_splitter", None)
+    if lang_splitter is None:
+        lang_splitter = LangSplitter(lang_map=LangSegmenter.DEFAULT_LANG_MAP)
+        lang_splitter.merge_across_digit = False
+        _local.lang_splitter = lang_splitter
+    return lang_splitter
 
 
 def split_jako(tag_lang,item):
@@ -88,9 +126,14 @@ class LangSegmenter():
     }
 
     def getTexts(text,default_lang = ""):
-        lang_splitter = LangSplitter(lang_map=LangSegmenter.DEFAULT_LANG_MAP)
-        lang_splitter.merge_across_digit = False
-        substr = lang_splitter.split_by_lang(text=text)
+        # 仅用去掉首尾空白的文本判断语种, 返回原文本, 与完整切分保持一致
+        stripped = text.strip()
+        if stripped:
+            lang = single_script_lang(stripped, default_lang)
+            if lang is not None:
+                return [{'lang':lang,'text':text}]
+
+        substr = get_lang_splitter().split_by_lang(text=text)
 
         lang_list: list[dict] = []
 
@@ -1,5 +1,7 @@
 import os
 import re
+import threading
+from contextlib import contextmanager
 
 import cn2an
 from pypinyin import lazy_pinyin, Style
@@ -70,13 +72,41 @@ def replace_punctuation(text):
     return replaced_text
 
 
-def g2p(text):
+def _split_sentences(text):
     pattern = r"(?<=[{0}])\s*".format("".join(punctuation))
-    sentences = [i for i in re.split(pattern, text) if i.strip() != ""]
+    return [i for i in re.split(pattern, text) if i.strip() != ""]
+
+
+def g2p(text):
+    sentences = _split_sentences(text)
     phones, word2ph = _g2p(sentences)
     return phones, word2ph
 
 
+# text_normalize results of the enclosing g2pw_batch block, per thread
+_batch = threading.local()
+
+
+@contextmanager
+def g2pw_batch(texts):
+    """
+    Within the block, the polyphonic characters of all `texts` (the raw Chinese text runs of a request,
+    as passed to clean_text) are disambiguated by one g2pw ONNX run, and text_normalize reuses the
+    normalization done here.
+    """
+    if not is_g2pw:
+        yield
+        return
+    normalized = {text: _text_normalize(text) for text in texts}
+    sentences = [re.sub("[a-zA-Z]+", "", seg) for norm_text in normalized.values() for seg in _split_sentences(norm_text)]
+    with g2pw.batch(sentences):
+        _batch.normalized = normalized
+        try:
+            yield
+        finally:
+            _batch.normalized = {}
+
+
 def _get_initials_finals(word):
     initials = []
     finals = []
@@ -180,10 +210,13 @@ def _merge_erhua(initials: list[str], finals: list[str], word: str, pos: str) ->
 def _g2p(segments):
     phones_list = []
     word2ph = []
-    for seg in segments:
+    # Replace all English words in the sentence
+    segments = [re.sub("[a-zA-Z]+", "", seg) for seg in segments]
+    if is_g2pw:
+        # 所有分句的多音字合并为一次 g2pw 推理
+        segments_pinyins = g2pw.lazy_pinyin_batch(segments, neutral_tone_with_five=True, style=Style.TONE3)
+    for seg_idx, seg in enumerate(segments):
         pinyins = []
-        # Replace all English words in the sentence
-        seg = re.sub("[a-zA-Z]+", "", seg)
         seg_cut = psg.lcut(seg)
         seg_cut = tone_modifier.pre_merge_for_modify(seg_cut)
         initials = []
@@ -205,7 +238,7 @@ def _g2p(segments):
             print("pypinyin结果", initials, finals)
         else:
             # g2pw采用整句推理
-            pinyins = g2pw.lazy_pinyin(seg, neutral_tone_with_five=True, style=Style.TONE3)
+            pinyins = segments_pinyins[seg_idx]
 
             pre_word_length = 0
             for word, pos in seg_cut:
@@ -314,6 +347,13 @@ def replace_consecutive_punctuation(text):
 
 
 def text_normalize(text):
+    normalized = getattr(_batch, "normalized", {})
+    if text in normalized:
+        return normalized[text]
+    return _text_normalize(text)
+
+
+def _text_normalize(text):
     # https://github.com/PaddlePaddle/PaddleSpeech/tree/develop/paddlespeech/t2s/frontend/zh_normalization
     tx = TextNormalizer()
     sentences = tx.normalize(text)
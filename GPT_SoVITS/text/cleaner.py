@@ -9,6 +9,7 @@ import os
 
 from GPT_SoVITS.text import symbols as symbols_v1
 from GPT_SoVITS.text import symbols2 as symbols_v2
+from GPT_SoVITS.text.g2p_cache import G2P_CACHE
 
 special = [
     # ("%", "zh", "SP"),
@@ -18,15 +19,28 @@ special = [
 ]
 
 
+def get_language_module_map(version):
+    if version == "v1":
+        return {"zh": "chinese", "ja": "japanese", "en": "english"}
+    return {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+
+
 def clean_text(text, language, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    # repeated phrases skip normalization and g2p (g2pw / pyopenjtalk / g2p_en) entirely
+    cached = G2P_CACHE.get(language, version, text)
+    if cached is not None:
+        phones, word2ph, norm_text = cached
+        return list(phones), list(word2ph) if word2ph is not None else None, norm_text
+    phones, word2ph, norm_text = _clean_text(text, language, version)
+    G2P_CACHE.put(language, version, text, [phones, word2ph, norm_text])
+    return phones, word2ph, norm_text
+
+
+def _clean_text(text, language, version):
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
+    language_module_map = get_language_module_map(version)
 
     if language not in language_module_map:
         language = "en"
@@ -58,12 +72,8 @@ def clean_text(text, language, version=None):
 def clean_special(text, language, special_s, target_symbol, version=None):
     if version is None:
         version = os.environ.get("version", "v2")
-    if version == "v1":
-        symbols = symbols_v1.symbols
-        language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
-    else:
-        symbols = symbols_v2.symbols
-        language_module_map = {"zh": "chinese2", "ja": "japanese", "en": "english", "ko": "korean", "yue": "cantonese"}
+    symbols = symbols_v1.symbols if version == "v1" else symbols_v2.symbols
+    language_module_map = get_language_module_map(version)
 
     """
     特殊静音段sp符号处理
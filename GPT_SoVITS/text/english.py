@@ -1,9 +1,12 @@
+import logging
 import pickle
 import os
 import re
 import wordsegment
 from g2p_en import G2p
 
+from GPT_SoVITS.text.g2p_cache import G2P_CACHE
+from GPT_SoVITS.text.packed_dict import PackedDict, compile_dict
 from GPT_SoVITS.text.symbols import punctuation
 
 from GPT_SoVITS.text.symbols2 import symbols
@@ -12,6 +15,7 @@ from builtins import str as unicode
 from GPT_SoVITS.text.en_normalization.expend import normalize
 from nltk.tokenize import TweetTokenizer
 
+logger = logging.getLogger(__name__)
 word_tokenize = TweetTokenizer().tokenize
 from nltk import pos_tag
 
@@ -21,6 +25,9 @@ CMU_DICT_FAST_PATH = os.path.join(current_file_path, "cmudict-fast.rep")
 CMU_DICT_HOT_PATH = os.path.join(current_file_path, "engdict-hot.rep")
 CACHE_PATH = os.path.join(current_file_path, "engdict_cache.pickle")
 NAMECACHE_PATH = os.path.join(current_file_path, "namedict_cache.pickle")
+# 编译后的只读字典, 按需从 .rep / pickle 重新生成, 以 mmap 方式加载 (多进程共享内存页)
+PACKED_CACHE_PATH = os.path.join(current_file_path, "engdict_cache.bin")
+PACKED_NAMECACHE_PATH = os.path.join(current_file_path, "namedict_cache.bin")
 
 
 # 适配中文及 g2p_en 标点
@@ -207,27 +214,49 @@ def cache_dict(g2p_dict, file_path):
         pickle.dump(g2p_dict, pickle_file)
 
 
+def _is_stale(path, sources):
+    if not os.path.exists(path):
+        return True
+    mtime = os.path.getmtime(path)
+    return any(os.path.exists(source) and os.path.getmtime(source) > mtime for source in sources)
+
+
+def _try_compile_dict(g2p_dict, path):
+    # 安装目录只读时无法生成编译后的字典, 退回到内存中的字典
+    try:
+        compile_dict(g2p_dict, path)
+        return True
+    except OSError as e:
+        logger.warning("Cannot write %s, the dictionary is kept in memory: %s", path, e)
+        return False
+
+
 def get_dict():
-    if os.path.exists(CACHE_PATH):
-        with open(CACHE_PATH, "rb") as pickle_file:
-            g2p_dict = pickle.load(pickle_file)
-    else:
-        g2p_dict = read_dict_new()
-        cache_dict(g2p_dict, CACHE_PATH)
+    if _is_stale(PACKED_CACHE_PATH, [CMU_DICT_PATH, CMU_DICT_FAST_PATH, CACHE_PATH]):
+        if os.path.exists(CACHE_PATH):
+            with open(CACHE_PATH, "rb") as pickle_file:
+                g2p_dict = pickle.load(pickle_file)
+        else:
+            g2p_dict = read_dict_new()
+        if not _try_compile_dict(g2p_dict, PACKED_CACHE_PATH):
+            return hot_reload_hot(g2p_dict)
 
-    g2p_dict = hot_reload_hot(g2p_dict)
+    # 自定义发音词作为覆盖层, 不写入编译后的字典
+    g2p_dict = hot_reload_hot(PackedDict(PACKED_CACHE_PATH))
 
     return g2p_dict
 
 
 def get_namedict():
-    if os.path.exists(NAMECACHE_PATH):
+    if _is_stale(PACKED_NAMECACHE_PATH, [NAMECACHE_PATH]):
+        if not os.path.exists(NAMECACHE_PATH):
+            return {}
         with open(NAMECACHE_PATH, "rb") as pickle_file:
             name_dict = pickle.load(pickle_file)
-    else:
-        name_dict = {}
+        if not _try_compile_dict(name_dict, PACKED_NAMECACHE_PATH):
+            return name_dict
 
-    return name_dict
+    return PackedDict(PACKED_NAMECACHE_PATH)
 
 
 def text_normalize(text):
@@ -356,6 +385,14 @@ class en_G2p(G2p):
         # 可以分词的递归处理
         return [phone for comp in comps for phone in self.qryword(comp)]
 
+    def predict(self, word):
+        # 神经网络预测 oov 读音, 结果缓存
+        phones = G2P_CACHE.get("en_oov", "", word)
+        if phones is None:
+            phones = super().predict(word)
+            G2P_CACHE.put("en_oov", "", word, phones)
+        return list(phones)
+
 
 _g2p = en_G2p()
 
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# G2P_CACHE_SIZE: entries kept in memory per process (0 disables the cache)
+# G2P_CACHE_PATH: sqlite file shared by the worker processes, memory-mapped, unset means in-process only
+# The cache is not invalidated when the dictionaries (e.g. engdict-hot.rep) change, delete the file then.
+G2P_CACHE_SIZE = int(os.environ.get("G2P_CACHE_SIZE", "20000"))
+G2P_CACHE_PATH = os.environ.get("G2P_CACHE_PATH", None)
+G2P_STORE_SIZE = int(os.environ.get("G2P_STORE_SIZE", "1000000"))
+
+
+def _freeze(value):
+    # cached values are shared, keep them immutable
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class _SqliteStore:
+    """
+    Key/value table in a sqlite file with memory-mapped reads (WAL mode, so readers in other processes
+    are not blocked by a writer). Bounded to about `max_entries` rows, the oldest writes are dropped.
+    """
+
+    def __init__(self, path: str, max_entries: int, mmap_size: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._puts = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread and per process (not shared with forked children)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute("CREATE TABLE IF NOT EXISTS g2p (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        row = self._connection().execute("SELECT value FROM g2p WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key: str, value):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO g2p (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)))
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            conn.execute("DELETE FROM g2p WHERE rowid <= (SELECT MAX(rowid) FROM g2p) - ?", (self.max_entries,))
+
+
+class G2PCache:
+    """
+    Memoized G2P results keyed by (language, version, text), `text` being a word or a phrase.
+
+    An LRU of `max_entries` entries in memory, in front of an optional `_SqliteStore` shared by the
+    worker processes, so that a phrase converted by one worker is a lookup for the others. Values must
+    be JSON serializable (lists, strings, numbers, None); they are returned as nested tuples, callers
+    copy them into lists when they need to modify them.
+    """
+
+    def __init__(self, max_entries: int = G2P_CACHE_SIZE, path: str = G2P_CACHE_PATH, store_size: int = G2P_STORE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.store = _SqliteStore(path, store_size) if path else None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def _key(language: str, version: str, text: str) -> str:
+        return f"{language}\x1f{version}\x1f{text}"
+
+    def get(self, language: str, version: str, text: str):
+        if not self.enabled:
+            return None
+        key = self._key(language, version, text)
+        with self._lock:
+            value = self._entries.get(key, None)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except sqlite3.Error as e:
+                logger.warning("G2P cache store disabled: %s", e)
+                self.store = None
+            if value is not None:
+                value = _freeze(value)
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def contains(self, language: str, version: str, text: str) -> bool:
+        """
+        Whether `text` is cached, without counting a hit or a miss.
+        """
+        if not self.enabled:
+            return False
+        key = self._key(language, version, text)
+        with self._lock:
+            if key in self._entries:
+                return True
+        if self.store is not None:
+            try:
+                return self.store.get(key) is not None
+            except sqlite3.Error:
+                return False
+        return False
+
+    def put(self, language: str, version: str, text: str, value):
+        if not self.enabled:
+            return
+        key = self._key(language, version, text)
+        self._remember(key, _freeze(value))
+        if self.store is not None:
+            try:
+                self.store.put(key, value)
+            except sqlite3.Error as e:
+                logger.warning("G2P cache store disabled: %s", e)
+                self.store = None
+
+    def _remember(self, key: str, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+G2P_CACHE = G2PCache()
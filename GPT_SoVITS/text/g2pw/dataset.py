@@ -48,16 +48,20 @@ def prepare_onnx_input(
     phoneme_masks = []
     char_ids = []
     position_ids = []
+    # 同一句中的每个多音字都是一条输入, 句子只分词一次
+    tokenized = {}
 
     for idx in range(len(texts)):
         text = (truncated_texts if window_size else texts)[idx].lower()
         query_id = (truncated_query_ids if window_size else query_ids)[idx]
 
-        try:
-            tokens, text2token, token2text = tokenize_and_map(tokenizer=tokenizer, text=text)
-        except Exception:
-            print(f'warning: text "{text}" is invalid')
-            return {}
+        if text not in tokenized:
+            try:
+                tokenized[text] = tokenize_and_map(tokenizer=tokenizer, text=text)
+            except Exception:
+                print(f'warning: text "{text}" is invalid')
+                return {}
+        tokens, text2token, token2text = tokenized[text]
 
         text, query_id, tokens, text2token, token2text = _truncate(
             max_len=max_len, text=text, query_id=query_id, tokens=tokens, text2token=text2token, token2text=token2text
@@ -83,10 +87,12 @@ def prepare_onnx_input(
         char_ids.append(char_id)
         position_ids.append(position_id)
 
+    # 不同句子的输入长度不同, 补齐到最长的一条 (attention_mask 为 0)
+    seq_len = max(len(input_id) for input_id in input_ids) if input_ids else 0
     outputs = {
-        "input_ids": np.array(input_ids).astype(np.int64),
-        "token_type_ids": np.array(token_type_ids).astype(np.int64),
-        "attention_masks": np.array(attention_masks).astype(np.int64),
+        "input_ids": _pad(input_ids, seq_len, tokenizer.pad_token_id or 0),
+        "token_type_ids": _pad(token_type_ids, seq_len, 0),
+        "attention_masks": _pad(attention_masks, seq_len, 0),
         "phoneme_masks": np.array(phoneme_masks).astype(np.float32),
         "char_ids": np.array(char_ids).astype(np.int64),
         "position_ids": np.array(position_ids).astype(np.int64),
@@ -94,6 +100,13 @@ def prepare_onnx_input(
     return outputs
 
 
+def _pad(rows: List[List[int]], seq_len: int, value: int) -> np.array:
+    padded = np.full((len(rows), seq_len), value, dtype=np.int64)
+    for i, row in enumerate(rows):
+        padded[i, : len(row)] = row
+    return padded
+
+
 def _truncate_texts(window_size: int, texts: List[str], query_ids: List[int]) -> Tuple[List[str], List[int]]:
     truncated_texts = []
     truncated_query_ids = []
@@ -2,6 +2,8 @@
 
 import pickle
 import os
+import threading
+from contextlib import contextmanager
 
 from pypinyin.constants import RE_HANS
 from pypinyin.core import Pinyin, Style
@@ -25,6 +27,9 @@ class G2PWPinyin(Pinyin):
         v_to_u=False,
         neutral_tone_with_five=False,
         tone_sandhi=False,
+        intra_op_num_threads=None,
+        providers=None,
+        use_io_binding=None,
         **kwargs,
     ):
         self._g2pw = G2PWOnnxConverter(
@@ -32,6 +37,9 @@ class G2PWPinyin(Pinyin):
             style="pinyin",
             model_source=model_source,
             enable_non_tradional_chinese=enable_non_tradional_chinese,
+            intra_op_num_threads=intra_op_num_threads,
+            providers=providers,
+            use_io_binding=use_io_binding,
         )
         self._converter = Converter(
             self._g2pw,
@@ -39,10 +47,39 @@ class G2PWPinyin(Pinyin):
             neutral_tone_with_five=neutral_tone_with_five,
             tone_sandhi=tone_sandhi,
         )
+        # nesting depth of `batch` blocks per thread
+        self._local = threading.local()
 
     def get_seg(self, **kwargs):
         return simple_seg
 
+    @contextmanager
+    def batch(self, sentences):
+        """
+        Within the block, `lazy_pinyin` (in this thread) takes the g2pw results of the hanzi of `sentences`
+        from a single padded ONNX run instead of one run per run of hanzi. Blocks may be nested, e.g. one
+        for all the Chinese text of a request around the per-sentence ones, the results are kept until the
+        outermost block exits.
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._converter.prefetch(
+            [words for sentence in sentences for words in simple_seg(sentence) if RE_HANS.match(words)]
+        )
+        self._local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._converter.clear_prefetched()
+
+    def lazy_pinyin_batch(self, sentences, **kwargs):
+        """
+        `lazy_pinyin` of each sentence, with the polyphonic characters of all of them disambiguated together.
+        """
+        with self.batch(sentences):
+            return [self.lazy_pinyin(sentence, **kwargs) for sentence in sentences]
+
 
 class Converter(UltimateConverter):
     def __init__(self, g2pw_instance, v_to_u=False, neutral_tone_with_five=False, tone_sandhi=False, **kwargs):
@@ -51,6 +88,23 @@ class Converter(UltimateConverter):
         )
 
         self._g2pw = g2pw_instance
+        # g2pw results computed ahead by `prefetch`, per thread (the frontend may run in several TTS workers)
+        self._prefetched = threading.local()
+
+    def prefetch(self, hans):
+        """
+        Run g2pw once on those of `hans` not prefetched yet and keep the results for the next `_to_pinyin`
+        calls of this thread, until `clear_prefetched`.
+        """
+        results = getattr(self._prefetched, "results", None)
+        if results is None:
+            results = self._prefetched.results = {}
+        hans = [han for han in dict.fromkeys(hans) if han not in results]
+        if hans:
+            results.update(zip(hans, self._g2pw(hans)))
+
+    def clear_prefetched(self):
+        self._prefetched.results = {}
 
     def convert(self, words, style, heteronym, errors, strict, **kwargs):
         pys = []
@@ -72,7 +126,8 @@ class Converter(UltimateConverter):
     def _to_pinyin(self, han, style, heteronym, errors, strict, **kwargs):
         pinyins = []
 
-        g2pw_pinyin = self._g2pw(han)
+        prefetched = getattr(self._prefetched, "results", {})
+        g2pw_pinyin = [prefetched[han]] if han in prefetched else self._g2pw(han)
 
         if not g2pw_pinyin:  # g2pw 不支持的汉字改为使用 pypinyin 原有逻辑
             return super(Converter, self).convert(han, Style.TONE, heteronym, errors, strict, **kwargs)
@@ -29,21 +29,37 @@ warnings.filterwarnings("ignore")
 
 model_version = "1.1"
 
-
-def predict(session, onnx_input: Dict[str, Any], labels: List[str]) -> Tuple[List[str], List[float]]:
+# ONNX Runtime 会话参数, 未设置时沿用原来的默认值
+# G2PW_INTRA_OP_THREADS: 算子内线程数 (0 由 ONNX Runtime 决定)
+# G2PW_PROVIDERS: 以逗号分隔的 execution providers, 例如 "CUDAExecutionProvider,CPUExecutionProvider"
+# G2PW_IO_BINDING: 为 1 时使用 IOBinding, 输出留在 provider 分配的内存中, 推理后一次性拷回
+G2PW_INTRA_OP_THREADS = os.environ.get("G2PW_INTRA_OP_THREADS", None)
+G2PW_PROVIDERS = os.environ.get("G2PW_PROVIDERS", None)
+G2PW_IO_BINDING = os.environ.get("G2PW_IO_BINDING", "0").lower() in ["1", "true"]
+
+
+def predict(
+    session, onnx_input: Dict[str, Any], labels: List[str], use_io_binding: bool = False
+) -> Tuple[List[str], List[float]]:
     all_preds = []
     all_confidences = []
-    probs = session.run(
-        [],
-        {
-            "input_ids": onnx_input["input_ids"],
-            "token_type_ids": onnx_input["token_type_ids"],
-            "attention_mask": onnx_input["attention_masks"],
-            "phoneme_mask": onnx_input["phoneme_masks"],
-            "char_ids": onnx_input["char_ids"],
-            "position_ids": onnx_input["position_ids"],
-        },
-    )[0]
+    feeds = {
+        "input_ids": onnx_input["input_ids"],
+        "token_type_ids": onnx_input["token_type_ids"],
+        "attention_mask": onnx_input["attention_masks"],
+        "phoneme_mask": onnx_input["phoneme_masks"],
+        "char_ids": onnx_input["char_ids"],
+        "position_ids": onnx_input["position_ids"],
+    }
+    if use_io_binding:
+        binding = session.io_binding()
+        for name, value in feeds.items():
+            binding.bind_cpu_input(name, value)
+        binding.bind_output(session.get_outputs()[0].name)
+        session.run_with_iobinding(binding)
+        probs = binding.copy_outputs_to_cpu()[0]
+    else:
+        probs = session.run([], feeds)[0]
 
     preds = np.argmax(probs, axis=1).tolist()
     max_probs = []
@@ -86,25 +102,34 @@ class G2PWOnnxConverter:
         style: str = "bopomofo",
         model_source: str = None,
         enable_non_tradional_chinese: bool = False,
+        intra_op_num_threads: int = None,
+        providers: List[str] = None,
+        use_io_binding: bool = None,
     ):
         uncompress_path = download_and_decompress(model_dir)
 
+        if intra_op_num_threads is None:
+            intra_op_num_threads = (
+                int(G2PW_INTRA_OP_THREADS) if G2PW_INTRA_OP_THREADS else (2 if torch.cuda.is_available() else 0)
+            )
+        if providers is None:
+            if G2PW_PROVIDERS:
+                providers = [provider.strip() for provider in G2PW_PROVIDERS.split(",") if provider.strip()]
+            elif "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+                providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+            else:
+                providers = ["CPUExecutionProvider"]
+        self.use_io_binding = G2PW_IO_BINDING if use_io_binding is None else use_io_binding
+
         sess_options = onnxruntime.SessionOptions()
         sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
         sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
-        sess_options.intra_op_num_threads = 2 if torch.cuda.is_available() else 0
-        if "CUDAExecutionProvider" in onnxruntime.get_available_providers():
-            self.session_g2pW = onnxruntime.InferenceSession(
-                os.path.join(uncompress_path, "g2pW.onnx"),
-                sess_options=sess_options,
-                providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
-            )
-        else:
-            self.session_g2pW = onnxruntime.InferenceSession(
-                os.path.join(uncompress_path, "g2pW.onnx"),
-                sess_options=sess_options,
-                providers=["CPUExecutionProvider"],
-            )
+        sess_options.intra_op_num_threads = intra_op_num_threads
+        self.session_g2pW = onnxruntime.InferenceSession(
+            os.path.join(uncompress_path, "g2pW.onnx"),
+            sess_options=sess_options,
+            providers=providers,
+        )
         self.config = load_config(config_path=os.path.join(uncompress_path, "config.py"), use_default=True)
 
         self.model_source = model_source if model_source else self.config.model_source
@@ -213,7 +238,9 @@ class G2PWOnnxConverter:
             window_size=None,
         )
 
-        preds, confidences = predict(session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels)
+        preds, confidences = predict(
+            session=self.session_g2pW, onnx_input=onnx_input, labels=self.labels, use_io_binding=self.use_io_binding
+        )
         if self.config.use_char_phoneme:
             preds = [pred.split(" ")[1] for pred in preds]
 
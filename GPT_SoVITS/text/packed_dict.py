@@ -0,0 +1,162 @@
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from typing import Dict, List
+
+# 文件布局 (小端):
+#   header: magic, 词数, 音素表字节数, 词表字节数, 音素 ID 数
+#   音素表: "\n" 分隔的音素符号
+#   词偏移: uint32 * (词数 + 1), 词按 utf-8 字节序排列
+#   词表: utf-8 拼接
+#   读音偏移: uint32 * (词数 + 1)
+#   音素 ID: uint16, 同一个词的多个读音以 _SEP 分隔
+_MAGIC = b"GSVDICT1"
+_HEADER = struct.Struct("<8sIIII")
+_SEP = 0xFFFF
+
+
+def _align(offset: int) -> int:
+    return (offset + 3) & ~3
+
+
+def compile_dict(g2p_dict: Dict[str, List[List[str]]], path: str):
+    """
+    Write `g2p_dict` (word -> list of pronunciations, each a list of phonemes) to `path` in the packed format
+    read by `PackedDict`. The file is written next to `path` and renamed, concurrent workers never read a
+    partial file.
+    """
+    words = sorted(g2p_dict.keys(), key=lambda word: word.encode("utf-8"))
+    symbols: Dict[str, int] = {}
+    key_offsets, pron_offsets = [0], [0]
+    keys_blob = bytearray()
+    phone_ids: List[int] = []
+    for word in words:
+        keys_blob += word.encode("utf-8")
+        key_offsets.append(len(keys_blob))
+        for i, pron in enumerate(g2p_dict[word]):
+            if i > 0:
+                phone_ids.append(_SEP)
+            for phone in pron:
+                phone_ids.append(symbols.setdefault(phone, len(symbols)))
+        pron_offsets.append(len(phone_ids))
+    assert len(symbols) < _SEP, "too many phoneme symbols"
+    symbols_blob = "\n".join(symbols.keys()).encode("utf-8")
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(words), len(symbols_blob), len(keys_blob), len(phone_ids)))
+            for blob in [
+                symbols_blob,
+                struct.pack(f"<{len(key_offsets)}I", *key_offsets),
+                bytes(keys_blob),
+                struct.pack(f"<{len(pron_offsets)}I", *pron_offsets),
+                struct.pack(f"<{len(phone_ids)}H", *phone_ids),
+            ]:
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+                f.write(blob)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _Keys:
+    # 词表的只读序列视图, 供 bisect 使用
+    def __init__(self, offsets: memoryview, blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        return bytes(self.blob[self.offsets[index] : self.offsets[index + 1]])
+
+
+class PackedDict(MutableMapping):
+    """
+    Read-only pronunciation dictionary memory-mapped from a file written by `compile_dict`.
+
+    Lookups bisect the sorted key index and decode the word's phoneme IDs, nothing is unpickled or copied
+    into the Python heap at load time, so processes forked after loading (or loading the same file) share
+    the pages. Assignments and deletions go to a small in-memory overlay (hot words, removed entries) that
+    is consulted first. Values are new lists of pronunciations, as in the dict it was compiled from.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        magic, n_words, symbols_len, keys_len, n_phones = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a packed dictionary")
+        offset = _HEADER.size
+
+        def take(size: int) -> memoryview:
+            nonlocal offset
+            offset = _align(offset)
+            view = buf[offset : offset + size]
+            offset += size
+            return view
+
+        symbols_blob = take(symbols_len)
+        self._symbols: List[str] = bytes(symbols_blob).decode("utf-8").split("\n") if symbols_len else []
+        self._keys = _Keys(take(4 * (n_words + 1)).cast("I"), take(keys_len))
+        self._pron_offsets = take(4 * (n_words + 1)).cast("I")
+        self._phones = take(2 * n_phones).cast("H")
+        self._overlay: Dict[str, List[List[str]]] = {}
+        self._deleted = set()
+
+    def _index(self, word: str) -> int:
+        key = word.encode("utf-8")
+        index = bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return -1
+
+    def _decode(self, index: int) -> List[List[str]]:
+        prons = [[]]
+        for phone_id in self._phones[self._pron_offsets[index] : self._pron_offsets[index + 1]]:
+            if phone_id == _SEP:
+                prons.append([])
+            else:
+                prons[-1].append(self._symbols[phone_id])
+        return prons
+
+    def __getitem__(self, word: str) -> List[List[str]]:
+        if word in self._overlay:
+            return self._overlay[word]
+        if word not in self._deleted:
+            index = self._index(word)
+            if index >= 0:
+                return self._decode(index)
+        raise KeyError(word)
+
+    def __contains__(self, word) -> bool:
+        if word in self._overlay:
+            return True
+        return isinstance(word, str) and word not in self._deleted and self._index(word) >= 0
+
+    def __setitem__(self, word: str, prons: List[List[str]]):
+        self._overlay[word] = prons
+
+    def __delitem__(self, word: str):
+        if word not in self:
+            raise KeyError(word)
+        self._overlay.pop(word, None)
+        self._deleted.add(word)
+
+    def __iter__(self):
+        for index in range(len(self._keys)):
+            word = self._keys[index].decode("utf-8")
+            if word not in self._overlay and word not in self._deleted:
+                yield word
+        yield from self._overlay
+
+    def __len__(self):
+        return sum(1 for _ in self)
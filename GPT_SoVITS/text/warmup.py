@@ -0,0 +1,79 @@
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from GPT_SoVITS.text.cleaner import _clean_text, get_language_module_map
+
+logger = logging.getLogger(__name__)
+
+# 每个前端一句短文本, 足以加载其词典与模型 (jieba, g2pw, pyopenjtalk, g2p_en, g2pk2...)
+WARMUP_TEXTS = {
+    "zh": "你好，世界。",
+    "yue": "你好，世界。",
+    "ja": "こんにちは、世界。",
+    "en": "Hello, world.",
+    "ko": "안녕하세요, 세계.",
+}
+
+
+def frontends_of(languages: List[str], version: str) -> List[str]:
+    """
+    The G2P frontends used by the TTS text languages `languages` ("all_zh", "ja", "auto"...).
+    """
+    available = get_language_module_map(version)
+    frontends = []
+    for language in languages:
+        if language in ["auto", "auto_yue"]:
+            # 多语种切分, 所有前端都可能用到
+            needed = list(available.keys())
+            if language == "auto":
+                needed = [lang for lang in needed if lang != "yue"]
+        elif language.startswith("all_"):
+            needed = [language[len("all_") :]]
+        else:
+            # 按 X 英混合识别
+            needed = [language, "en"]
+        for frontend in needed:
+            if frontend in available and frontend not in frontends:
+                frontends.append(frontend)
+    return frontends
+
+
+def _load_frontend(language: str, version: str) -> float:
+    start = time.perf_counter()
+    if language == "lang_segmenter":
+        from GPT_SoVITS.text.LangSegmenter import LangSegmenter
+
+        LangSegmenter.getTexts("Hello, 你好。")
+    else:
+        _clean_text(WARMUP_TEXTS[language], language, version)
+    return time.perf_counter() - start
+
+
+def warmup_frontends(languages: List[str], version: str) -> Dict[str, Future]:
+    """
+    Start loading the frontends of `languages` (and the language segmenter), one thread each, so that the
+    first request in a language does not pay for importing its module and loading its dictionaries.
+
+    Returns the future of each component ("frontend_zh", "lang_segmenter"...), whose result is the load
+    time in seconds; a failed warm-up is logged and reported as None, the frontend then loads on first use.
+    """
+    components = (["lang_segmenter"] + frontends_of(languages, version)) if languages else []
+    if len(components) == 0:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=len(components), thread_name_prefix="FrontendWarmup")
+
+    def load(component: str):
+        try:
+            return _load_frontend(component, version)
+        except Exception as e:
+            logger.warning("Warm-up of %s failed, it will be loaded on first use: %s", component, e)
+            return None
+
+    futures = {
+        component if component == "lang_segmenter" else f"frontend_{component}": executor.submit(load, component)
+        for component in components
+    }
+    executor.shutdown(wait=False)
+    return futures
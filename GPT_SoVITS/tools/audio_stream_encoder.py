@@ -0,0 +1,146 @@
+import queue
+import subprocess
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+# media_type: (ffmpeg output arguments, output sample rate or None to keep the input rate)
+ENCODER_FORMATS = {
+    "ogg": (["-c:a", "libopus", "-b:a", "64k", "-application", "audio", "-page_duration", "20000", "-f", "ogg"], 48000),
+    "aac": (["-c:a", "aac", "-b:a", "192k", "-f", "adts"], None),
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "192k", "-f", "mp3"], None),
+}
+
+
+def to_int16(data: np.ndarray) -> np.ndarray:
+    if data.dtype == np.int16:
+        return data
+    return (np.clip(data, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+class StreamingAudioEncoder:
+    """
+    One long-lived ffmpeg encoder for one audio stream.
+
+    PCM is written to ffmpeg's stdin as it is produced, and the encoded pages/frames are collected
+    from stdout by a reader thread, so every response has one container header and continuous
+    (gapless) frames instead of one complete file per chunk. An encoder serves a single stream;
+    `close` flushes and returns the trailing data.
+    """
+
+    def __init__(self, media_type: str, rate: int, read_size: int = 4096):
+        if media_type not in ENCODER_FORMATS:
+            raise ValueError(f"media_type: {media_type} is not supported by the streaming encoder")
+        output_args, output_rate = ENCODER_FORMATS[media_type]
+        self.media_type = media_type
+        self.rate = rate
+        self.read_size = read_size
+        command = ["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0"]
+        if output_rate is not None and output_rate != rate:
+            command += ["-ar", str(output_rate)]
+        command += ["-vn", "-flush_packets", "1"] + output_args + ["pipe:1"]
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._output = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        while True:
+            data = self.process.stdout.read1(self.read_size)
+            if not data:
+                break
+            self._output.put(data)
+        self._output.put(None)
+
+    def _drain(self) -> bytes:
+        data = []
+        while True:
+            try:
+                chunk = self._output.get_nowait()
+            except queue.Empty:
+                break
+            if chunk is None:
+                self._output.put(None)
+                break
+            data.append(chunk)
+        return b"".join(data)
+
+    def encode(self, data: np.ndarray) -> bytes:
+        """
+        Feed PCM (float in [-1, 1] or int16) and return the encoded bytes available so far.
+        """
+        self.process.stdin.write(to_int16(data).tobytes())
+        self.process.stdin.flush()
+        return self._drain()
+
+    def close(self) -> bytes:
+        """
+        Finish the stream and return the remaining encoded bytes.
+        """
+        if self.process.stdin is not None and not self.process.stdin.closed:
+            self.process.stdin.close()
+        data = []
+        while True:
+            chunk = self._output.get()
+            if chunk is None:
+                break
+            data.append(chunk)
+        self.process.wait()
+        return b"".join(data)
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class StreamingAudioEncoderPool:
+    """
+    Keeps up to `max_idle` started encoders per (media_type, rate), so a request does not wait for
+    ffmpeg to start. An encoder is used by one stream only; when one is taken a replacement is
+    started in the background.
+    """
+
+    def __init__(self, max_idle: int = 2):
+        self.max_idle = max_idle
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, media_type: str, rate: int) -> StreamingAudioEncoder:
+        key = (media_type, rate)
+        encoder = None
+        with self._lock:
+            while len(self._idle[key]) > 0:
+                candidate = self._idle[key].pop()
+                if candidate.process.poll() is None:
+                    encoder = candidate
+                    break
+        if encoder is None:
+            encoder = StreamingAudioEncoder(media_type, rate)
+        threading.Thread(target=self._refill, args=(media_type, rate), daemon=True).start()
+        return encoder
+
+    def _refill(self, media_type: str, rate: int):
+        key = (media_type, rate)
+        with self._lock:
+            if len(self._idle[key]) >= self.max_idle:
+                return
+        encoder = StreamingAudioEncoder(media_type, rate)
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle:
+                self._idle[key].append(encoder)
+                return
+        encoder.kill()
+
+    def close(self):
+        with self._lock:
+            encoders = [encoder for encoders in self._idle.values() for encoder in encoders]
+            self._idle.clear()
+        for encoder in encoders:
+            encoder.kill()
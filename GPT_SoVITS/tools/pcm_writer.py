@@ -0,0 +1,96 @@
+import struct
+
+import numpy as np
+
+# sample_format: (numpy dtype, bytes per sample, wav format tag)
+SAMPLE_FORMATS = {
+    "int16": (np.int16, 2, 1),  # WAVE_FORMAT_PCM
+    "float32": (np.float32, 4, 3),  # WAVE_FORMAT_IEEE_FLOAT
+    "mulaw": (np.uint8, 1, 7),  # WAVE_FORMAT_MULAW, G.711
+}
+
+
+def _mulaw_table() -> np.ndarray:
+    # G.711 μ-law code of every int16 value, indexed by the value viewed as uint16
+    x = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+    sign = np.where(x < 0, 0x80, 0x00)
+    magnitude = np.minimum(np.abs(x), 32635) + 0x84
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+MULAW_TABLE = _mulaw_table()
+
+
+def wav_header(sample_rate: int, sample_format: str = "int16", channels: int = 1, data_size: int = 0) -> bytes:
+    """
+    RIFF/WAVE header for `sample_format`. With the default `data_size` of 0 the header is meant to be the
+    first chunk of a stream whose length is not known yet.
+    """
+    _, sample_width, format_tag = SAMPLE_FORMATS[sample_format]
+    block_align = channels * sample_width
+    fmt = struct.pack(
+        "<HHIIHH", format_tag, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8
+    )
+    if format_tag != 1:
+        # non-PCM formats carry the (empty) extension size
+        fmt += struct.pack("<H", 0)
+    return (
+        b"RIFF"
+        + struct.pack("<I", 4 + 8 + len(fmt) + 8 + data_size)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack("<I", len(fmt))
+        + fmt
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+
+
+class PCMWriter:
+    """
+    Converts float audio in [-1, 1] to `sample_format` for one output stream.
+
+    The conversion is done in place into buffers owned by the writer, which grow to the largest chunk
+    seen and are then reused, and `write` returns a memoryview on them instead of a bytes copy. The
+    view is only valid until the next `write`, which is fine for a response that sends a chunk before
+    asking for the next one; use `bytes(view)` to keep it longer.
+    """
+
+    def __init__(self, sample_format: str = "int16"):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f"sample_format: {sample_format} is not supported")
+        self.sample_format = sample_format
+        self.dtype, self.sample_width, _ = SAMPLE_FORMATS[sample_format]
+        self._scratch = np.empty(0, dtype=np.float32)
+        self._int16 = np.empty(0, dtype=np.int16)
+        self._output = np.empty(0, dtype=self.dtype)
+
+    @staticmethod
+    def _reserve(buffer: np.ndarray, size: int) -> np.ndarray:
+        if buffer.shape[0] < size:
+            buffer = np.empty(size, dtype=buffer.dtype)
+        return buffer
+
+    def write(self, data: np.ndarray) -> memoryview:
+        data = np.asarray(data).reshape(-1)
+        size = data.shape[0]
+        self._scratch = self._reserve(self._scratch, size)
+        scratch = self._scratch[:size]
+
+        np.clip(data, -1.0, 1.0, out=scratch)
+        if self.sample_format == "float32":
+            return memoryview(scratch).cast("B")
+
+        self._output = self._reserve(self._output, size)
+        output = self._output[:size]
+        np.multiply(scratch, 32767, out=scratch)
+        if self.sample_format == "int16":
+            np.copyto(output, scratch, casting="unsafe")
+        else:
+            self._int16 = self._reserve(self._int16, size)
+            int16 = self._int16[:size]
+            np.copyto(int16, scratch, casting="unsafe")
+            np.take(MULAW_TABLE, int16.view(np.uint16), out=output)
+        return memoryview(output).cast("B")
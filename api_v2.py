@@ -7,6 +7,10 @@
     `-a` - `绑定地址, 默认"127.0.0.1"`
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
+    `-w` - `TTS推理进程内的模型副本(worker)数量, 每个副本单独占用一份模型显存/内存, 默认1`
+    `-q` - `每个worker最多排队(含正在推理)的请求数, 全部排满时返回 http code 429, 默认4`
+    `-t` - `/tts请求的默认超时秒数(含排队时间), 超时后中止推理并返回 http code 504, 默认不限`
+    `-l` - `日志级别 DEBUG/INFO/WARNING, WARNING 即安静模式, 默认使用TTS配置文件中的log_level`
 
 ## 调用:
 
@@ -35,18 +39,52 @@ POST:
     "batch_threshold": 0.75,      # float. threshold for batch splitting.
     "split_bucket": True,         # bool. whether to split the batch into multiple buckets.
     "speed_factor":1.0,           # float. control the speed of the synthesized audio.
+    "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg"(opus), "aac", "mp3". ogg/aac/mp3 need ffmpeg.
+    "sample_format": "int16",     # str. sample format of "wav"/"raw" output, support "int16", "float32", "mulaw".
     "streaming_mode": False,      # bool. whether to return a streaming response.
     "seed": -1,                   # int. random seed for reproducibility.
     "parallel_infer": True,       # bool. whether to use parallel inference.
     "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
     "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
-    "super_sampling": False       # bool. whether to use super-sampling for audio when using VITS model V3.
+    "super_sampling": False,      # bool. whether to use super-sampling for audio when using VITS model V3.
+    "timeout": None,              # float.(optional) deadline in seconds, queue wait included. defaults to `-t`.
+    "gpt_model": None,            # str.(optional) name of a resident GPT model (see /models), the active one by default.
+    "sovits_model": None          # str.(optional) name of a resident SoVITS model, the active one by default.
 }
 ```
 
 RESP:
 成功: 直接返回 wav 音频流， http code 200
 失败: 返回包含错误信息的 json, http code 400
+繁忙: 所有worker的队列已满, 返回包含错误信息的 json, http code 429
+超时: 超过 `timeout` 仍未完成, 返回包含错误信息的 json, http code 504 (流式响应直接结束)
+
+### 流式文本输入 (WebSocket)
+
+endpoint: `/tts/ws`
+
+用于LLM逐token输出文本的场景: 文本可以分多次发送, 按 `text_split_method` 切出完整的句子后立即开始合成, 音频以二进制帧(`sample_format` 格式的raw PCM, 单声道)在同一连接上返回.
+每个连接同时最多合成 2 个句子(正在播放的一句与下一句), 其余句子排队等待; worker 全忙时等待空闲 worker 而不是返回 429.
+
+客户端消息(json):
+```json
+{"type": "config", ...}     # 第一条消息, 参数同 /tts (text 可省略, media_type 固定为 raw)
+{"type": "text", "text": ""} # 追加文本
+{"type": "flush"}           # 合成缓冲区里剩余的文本
+{"type": "cancel"}          # 丢弃缓冲区与未播放的音频, 停止当前合成
+{"type": "close"}           # flush 后结束连接
+```
+服务端消息: 二进制音频帧, 以及 json 事件
+`{"type": "segment_start", "text": "", "sample_rate": 32000}`, `{"type": "segment_end"}`, `{"type": "flushed"}`, `{"type": "cancelled"}`, `{"type": "error", "message": ""}`
+
+### 监控指标
+
+endpoint: `/metrics`
+
+Prometheus 文本格式: 各阶段耗时直方图(排队, 参考音频, 文本前端, BERT, T2S prefill/逐token, 声码器, 编码, 首包延迟, 总耗时), RTF, 以及每个worker的队列长度与参考音频缓存命中情况.
+`tts_startup_seconds` 为每个worker启动时各组件(t2s, vits, sv, vocoder, bert, hubert, 各语种文本前端 frontend_*, lang_segmenter)的加载耗时, 用于调优冷启动.
+文本前端在模型加载的同时并行预热, 由TTS配置文件中的 `warmup_languages` 指定 (默认全部语种, `[]` 关闭预热).
+非流式 `/tts` 的响应头 `X-TTS-Timings` 附带该请求的耗时明细(json, 单位秒).
 
 ### 命令控制
 
@@ -74,6 +112,9 @@ RESP: 无
 
 endpoint: `/set_gpt_weights`
 
+模型在后台加载, 加载期间请求照常使用当前模型; 加载完成后在请求之间切换, 正在推理的请求使用旧模型完成.
+可选参数 `name`(默认为 weights_path) 让多个模型同时常驻, 请求通过 `gpt_model`/`sovits_model` 按名称选择; `activate=false` 只加载不切换默认模型.
+
 GET:
 ```
 http://127.0.0.1:9880/set_gpt_weights?weights_path=GPT_SoVITS/pretrained_models/s1bert25hz-2kh-longer-epoch=68e-step=50232.ckpt
@@ -96,30 +137,55 @@ RESP:
 成功: 返回"success", http code 200
 失败: 返回包含错误信息的 json, http code 400
 
+
+### 常驻模型
+
+endpoint: `/models` 列出常驻的GPT/Sovits模型(name, weights_path, revision, active)
+
+TTS配置文件中的 `keep_cpu_weights: true` 为每个常驻模型在内存中保留一份(锁页)权重副本, 推理出错后直接从内存恢复权重而不重新读取模型文件; 代价是每个worker的每个常驻模型都多占用一份与权重同样大小的内存, 默认关闭.
+
+endpoint: `/unload_weights` 卸载一个非默认的常驻模型
+
+GET:
+```
+http://127.0.0.1:9880/unload_weights?kind=sovits&name=GPT_SoVITS/pretrained_models/s2G488k.pth
+```
+
+RESP:
+成功: 返回"success", http code 200
+失败: 返回包含错误信息的 json, http code 400
+
 """
 
 import os
 import sys
 import traceback
-from typing import Generator
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
 sys.path.append("%s/GPT_SoVITS" % (now_dir))
 
 import argparse
-import subprocess
-import wave
+import asyncio
+import json
 import signal
+import time
 import numpy as np
-import soundfile as sf
-from fastapi import FastAPI, Response
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 import uvicorn
 from io import BytesIO
 from tools.i18n.i18n import I18nAuto
-from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
-from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import get_method_names as get_cut_method_names
+from GPT_SoVITS.TTS_infer_pack.worker_pool import PoolSaturatedError, TTSStream, TTSWorkerPool
+from GPT_SoVITS.TTS_infer_pack.metrics import REGISTRY, add_timing, observe_timings
+from GPT_SoVITS.TTS_infer_pack.log import set_log_level
+from GPT_SoVITS.TTS_infer_pack.cancellation import DeadlineExceededError
+from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import IncrementalSegmenter, get_method_names as get_cut_method_names
+from GPT_SoVITS.tools.audio_stream_encoder import ENCODER_FORMATS, StreamingAudioEncoderPool
+from GPT_SoVITS.text.g2p_cache import G2P_CACHE
+from GPT_SoVITS.tools.pcm_writer import SAMPLE_FORMATS, PCMWriter, wav_header
 from pydantic import BaseModel
 
 # print(sys.path)
@@ -130,6 +196,14 @@ parser = argparse.ArgumentParser(description="GPT-SoVITS api")
 parser.add_argument("-c", "--tts_config", type=str, default="GPT_SoVITS/configs/tts_infer.yaml", help="tts_infer路径")
 parser.add_argument("-a", "--bind_addr", type=str, default="127.0.0.1", help="default: 127.0.0.1")
 parser.add_argument("-p", "--port", type=int, default="9880", help="default: 9880")
+parser.add_argument("-w", "--workers", type=int, default=1, help="number of TTS model replicas, default: 1")
+parser.add_argument("-q", "--max_queue", type=int, default=4, help="max queued requests per replica, default: 4")
+parser.add_argument(
+    "-t", "--timeout", type=float, default=None, help="default deadline of a /tts request in seconds, default: none"
+)
+parser.add_argument(
+    "-l", "--log_level", type=str, default=None, help="DEBUG/INFO/WARNING, default: log_level of the tts_infer config"
+)
 args = parser.parse_args()
 config_path = args.tts_config
 # device = args.device
@@ -140,9 +214,14 @@ argv = sys.argv
 if config_path in [None, ""]:
     config_path = "GPT-SoVITS/configs/tts_infer.yaml"
 
-tts_config = TTS_Config(config_path)
+tts_pool = TTSWorkerPool(config_path, num_workers=args.workers, max_queue_size=args.max_queue)
+tts_config = tts_pool.configs
+if args.log_level is not None:
+    tts_config.log_level = args.log_level
+    set_log_level(args.log_level)
 print(tts_config)
-tts_pipeline = TTS(tts_config)
+# started ffmpeg encoders for ogg(opus)/aac/mp3, one is taken per response
+encoder_pool = StreamingAudioEncoderPool()
 
 APP = FastAPI()
 
@@ -165,88 +244,59 @@ class TTS_Request(BaseModel):
     fragment_interval: float = 0.3
     seed: int = -1
     media_type: str = "wav"
+    sample_format: str = "int16"
     streaming_mode: bool = False
     parallel_infer: bool = True
     repetition_penalty: float = 1.35
     sample_steps: int = 32
     super_sampling: bool = False
+    timeout: float = None
+    gpt_model: str = None
+    sovits_model: str = None
 
 
 ### modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files
-def pack_ogg(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    with sf.SoundFile(io_buffer, mode="w", samplerate=rate, channels=1, format="ogg") as audio_file:
-        audio_file.write(data)
+def pack_raw(io_buffer: BytesIO, data: np.ndarray, rate: int, sample_format: str = "int16"):
+    io_buffer.write(PCMWriter(sample_format).write(data))
     return io_buffer
 
 
-def pack_raw(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer.write(data.tobytes())
+def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int, sample_format: str = "int16"):
+    pcm = PCMWriter(sample_format).write(data)
+    io_buffer.write(wav_header(rate, sample_format, data_size=pcm.nbytes))
+    io_buffer.write(pcm)
     return io_buffer
 
 
-def pack_wav(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    io_buffer = BytesIO()
-    sf.write(io_buffer, data, rate, format="wav")
-    return io_buffer
-
-
-def pack_aac(io_buffer: BytesIO, data: np.ndarray, rate: int):
-    process = subprocess.Popen(
-        [
-            "ffmpeg",
-            "-f",
-            "s16le",  # 输入16位有符号小端整数PCM
-            "-ar",
-            str(rate),  # 设置采样率
-            "-ac",
-            "1",  # 单声道
-            "-i",
-            "pipe:0",  # 从管道读取输入
-            "-c:a",
-            "aac",  # 音频编码器为AAC
-            "-b:a",
-            "192k",  # 比特率
-            "-vn",  # 不包含视频
-            "-f",
-            "adts",  # 输出AAC数据流格式
-            "pipe:1",  # 将输出写入管道
-        ],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    out, _ = process.communicate(input=data.tobytes())
-    io_buffer.write(out)
+def pack_encoded(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
+    encoder = encoder_pool.acquire(media_type, rate)
+    try:
+        io_buffer.write(encoder.encode(data))
+        io_buffer.write(encoder.close())
+    finally:
+        encoder.kill()
     return io_buffer
 
 
-def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str):
-    if media_type == "ogg":
-        io_buffer = pack_ogg(io_buffer, data, rate)
-    elif media_type == "aac":
-        io_buffer = pack_aac(io_buffer, data, rate)
+def pack_audio(io_buffer: BytesIO, data: np.ndarray, rate: int, media_type: str, sample_format: str = "int16"):
+    if media_type in ENCODER_FORMATS:
+        io_buffer = pack_encoded(io_buffer, data, rate, media_type)
     elif media_type == "wav":
-        io_buffer = pack_wav(io_buffer, data, rate)
+        io_buffer = pack_wav(io_buffer, data, rate, sample_format)
     else:
-        io_buffer = pack_raw(io_buffer, data, rate)
+        io_buffer = pack_raw(io_buffer, data, rate, sample_format)
     io_buffer.seek(0)
     return io_buffer
 
 
-# from https://huggingface.co/spaces/coqui/voice-chat-with-mistral/blob/main/app.py
-def wave_header_chunk(frame_input=b"", channels=1, sample_width=2, sample_rate=32000):
-    # This will create a wave header then append the frame input
-    # It should be first on a streaming wav file
-    # Other frames better should not have it (else you will hear some artifacts each chunk start)
-    wav_buf = BytesIO()
-    with wave.open(wav_buf, "wb") as vfout:
-        vfout.setnchannels(channels)
-        vfout.setsampwidth(sample_width)
-        vfout.setframerate(sample_rate)
-        vfout.writeframes(frame_input)
+async def broadcast(fn):
+    # run fn(tts) on every replica and wait for all of them
+    await asyncio.gather(*[asyncio.wrap_future(future) for future in tts_pool.broadcast(fn)])
+
 
-    wav_buf.seek(0)
-    return wav_buf.read()
+async def for_each_worker(fn):
+    # fn(tts) returns a Future (e.g. tts.load_weights), wait for those of every replica
+    await asyncio.gather(*[asyncio.wrap_future(fn(worker.tts)) for worker in tts_pool.workers])
 
 
 def handle_control(command: str):
@@ -261,8 +311,8 @@ def check_params(req: dict):
     text: str = req.get("text", "")
     text_lang: str = req.get("text_lang", "")
     ref_audio_path: str = req.get("ref_audio_path", "")
-    streaming_mode: bool = req.get("streaming_mode", False)
     media_type: str = req.get("media_type", "wav")
+    sample_format: str = req.get("sample_format", "int16")
     prompt_lang: str = req.get("prompt_lang", "")
     text_split_method: str = req.get("text_split_method", "cut5")
 
@@ -284,10 +334,10 @@ def check_params(req: dict):
             status_code=400,
             content={"message": f"prompt_lang: {prompt_lang} is not supported in version {tts_config.version}"},
         )
-    if media_type not in ["wav", "raw", "ogg", "aac"]:
+    if media_type not in ["wav", "raw", "ogg", "aac", "mp3"]:
         return JSONResponse(status_code=400, content={"message": f"media_type: {media_type} is not supported"})
-    elif media_type == "ogg" and not streaming_mode:
-        return JSONResponse(status_code=400, content={"message": "ogg format is not supported in non-streaming mode"})
+    if sample_format not in SAMPLE_FORMATS:
+        return JSONResponse(status_code=400, content={"message": f"sample_format: {sample_format} is not supported"})
 
     if text_split_method not in cut_method_names:
         return JSONResponse(
@@ -320,12 +370,16 @@ async def tts_handle(req: dict):
                 "speed_factor":1.0,           # float. control the speed of the synthesized audio.
                 "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                 "seed": -1,                   # int. random seed for reproducibility.
-                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac".
+                "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg"(opus), "aac", "mp3".
+                "sample_format": "int16",     # str. sample format of "wav"/"raw" output, support "int16", "float32", "mulaw".
                 "streaming_mode": False,      # bool. whether to return a streaming response.
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
                 "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.
                 "sample_steps": 32,           # int. number of sampling steps for VITS model V3.
                 "super_sampling": False,       # bool. whether to use super-sampling for audio when using VITS model V3.
+                "timeout": None,              # float.(optional) deadline in seconds, queue wait included. the request is aborted once it has passed.
+                "gpt_model": None,            # str.(optional) name of a resident GPT model (see /models), the active one by default.
+                "sovits_model": None,         # str.(optional) name of a resident SoVITS model, the active one by default.
             }
     returns:
         StreamingResponse: audio stream response.
@@ -334,6 +388,7 @@ async def tts_handle(req: dict):
     streaming_mode = req.get("streaming_mode", False)
     return_fragment = req.get("return_fragment", False)
     media_type = req.get("media_type", "wav")
+    sample_format = req.get("sample_format", "int16")
 
     check_res = check_params(req)
     if check_res is not None:
@@ -342,37 +397,292 @@ async def tts_handle(req: dict):
     if streaming_mode or return_fragment:
         req["return_fragment"] = True
 
+    if req.get("timeout", None) is None:
+        req["timeout"] = args.timeout
+
+    timings = req["timings"] = {}
     try:
-        tts_generator = tts_pipeline.run(req)
+        tts_stream = tts_pool.submit(req)
+    except PoolSaturatedError as e:
+        REGISTRY.inc("tts_rejected_total", "Requests rejected with 429")
+        return JSONResponse(status_code=429, content={"message": "tts server is busy", "Exception": str(e)})
 
+    try:
         if streaming_mode:
 
-            def streaming_generator(tts_generator: Generator, media_type: str):
-                if_frist_chunk = True
-                for sr, chunk in tts_generator:
-                    if if_frist_chunk and media_type == "wav":
-                        yield wave_header_chunk(sample_rate=sr)
-                        media_type = "raw"
-                        if_frist_chunk = False
-                    yield pack_audio(BytesIO(), chunk, sr, media_type).getvalue()
+            async def streaming_generator(tts_stream: TTSStream, media_type: str):
+                # a client disconnect cancels this generator, which stops the worker at its next token/chunk
+                encode_timings = {}
+                try:
+                    if media_type in ENCODER_FORMATS:
+                        # one encoder for the whole response, fed chunk by chunk
+                        encoder = None
+                        try:
+                            async for sr, chunk in tts_stream:
+                                t = time.perf_counter()
+                                if encoder is None:
+                                    encoder = await run_in_threadpool(encoder_pool.acquire, media_type, sr)
+                                data = await run_in_threadpool(encoder.encode, chunk)
+                                add_timing(encode_timings, "encode", time.perf_counter() - t)
+                                if data:
+                                    yield data
+                            if encoder is not None:
+                                yield await run_in_threadpool(encoder.close)
+                        finally:
+                            if encoder is not None:
+                                encoder.kill()
+                        return
+
+                    # the memoryview is sent before the next chunk is converted into the same buffer
+                    writer = PCMWriter(sample_format)
+                    if_frist_chunk = True
+                    async for sr, chunk in tts_stream:
+                        if if_frist_chunk and media_type == "wav":
+                            yield wav_header(sr, sample_format)
+                            if_frist_chunk = False
+                        t = time.perf_counter()
+                        data = writer.write(chunk)
+                        add_timing(encode_timings, "encode", time.perf_counter() - t)
+                        yield data
+                finally:
+                    await tts_stream.aclose()
+                    observe_timings(encode_timings)
 
             # _media_type = f"audio/{media_type}" if not (streaming_mode and media_type in ["wav", "raw"]) else f"audio/x-{media_type}"
             return StreamingResponse(
                 streaming_generator(
-                    tts_generator,
+                    tts_stream,
                     media_type,
                 ),
                 media_type=f"audio/{media_type}",
+                # runs even if the client left before the body was started (streaming_generator never ran)
+                background=BackgroundTask(tts_stream.aclose),
             )
 
         else:
-            sr, audio_data = next(tts_generator)
-            audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
-            return Response(audio_data, media_type=f"audio/{media_type}")
+            async for sr, audio_data in tts_stream:
+                pass
+            t = time.perf_counter()
+            audio_data = await run_in_threadpool(pack_audio, BytesIO(), audio_data, sr, media_type, sample_format)
+            timings["encode"] = time.perf_counter() - t
+            observe_timings({"encode": timings["encode"]})
+            return Response(
+                audio_data.getvalue(),
+                media_type=f"audio/{media_type}",
+                headers={"X-TTS-Timings": json.dumps({k: round(v, 4) for k, v in timings.items()})},
+            )
+    except DeadlineExceededError as e:
+        await tts_stream.aclose()
+        return JSONResponse(status_code=504, content={"message": "tts timed out", "Exception": str(e)})
     except Exception as e:
+        await tts_stream.aclose()
         return JSONResponse(status_code=400, content={"message": "tts failed", "Exception": str(e)})
 
 
+# segments of a websocket session being synthesized at once (one playing, one ahead), and the audio
+# chunks buffered per segment: a fast text producer cannot take all the workers or pile up audio
+WS_MAX_INFLIGHT_SEGMENTS = 2
+WS_AUDIO_QUEUE_SIZE = 8
+
+# set each time a worker slot is given back, then replaced, wakes the sessions waiting in submit_waiting.
+# The streams are consumed on the event loop, so the slots are released (and this is called) there too.
+slot_released: asyncio.Event = None
+
+
+def notify_slot_released():
+    global slot_released
+    if slot_released is not None:
+        slot_released.set()
+        slot_released = None
+
+
+tts_pool.add_release_callback(notify_slot_released)
+
+
+async def submit_waiting(req: dict):
+    # a websocket session keeps its text, so wait for a free worker instead of answering 429
+    global slot_released
+    while True:
+        if slot_released is None:
+            slot_released = asyncio.Event()
+        released = slot_released
+        try:
+            return tts_pool.submit(req)
+        except PoolSaturatedError:
+            await released.wait()
+
+
+@APP.websocket("/tts/ws")
+async def tts_websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        config = await websocket.receive_json()
+    except WebSocketDisconnect:
+        return
+    config.pop("type", None)
+    config["media_type"] = "raw"
+    config.setdefault("text_split_method", "cut5")
+    config.setdefault("sample_format", "int16")
+    check_res = check_params({**config, "text": config.get("text") or "."})
+    if check_res is not None:
+        await websocket.send_json({"type": "error", "message": json.loads(check_res.body)["message"]})
+        await websocket.close()
+        return
+    for key in ["text_lang", "prompt_lang"]:
+        config[key] = config[key].lower()
+
+    segmenter = IncrementalSegmenter(config["text_split_method"])
+    # (text, audio queue) per segment in order, or ("flushed"/"closed", None) markers
+    pending: asyncio.Queue = asyncio.Queue()
+    synth_tasks = set()
+    inflight = asyncio.Semaphore(WS_MAX_INFLIGHT_SEGMENTS)
+
+    async def synthesize(text: str, audio: asyncio.Queue):
+        try:
+            async with inflight:
+                tts_stream = await submit_waiting({**config, "text": text, "return_fragment": True})
+                try:
+                    async for item in tts_stream:
+                        await audio.put(item)
+                finally:
+                    await tts_stream.aclose()
+        except Exception as e:
+            await audio.put(e)
+        # not on cancellation: nobody reads the queue anymore, and it may be full
+        await audio.put(None)
+
+    def start_segments(segments: list):
+        # T2S of a segment is started as soon as it is complete and one of the session's
+        # WS_MAX_INFLIGHT_SEGMENTS slots is free, playback order is kept by `pending`
+        for text in segments:
+            audio = asyncio.Queue(maxsize=WS_AUDIO_QUEUE_SIZE)
+            task = asyncio.create_task(synthesize(text, audio))
+            synth_tasks.add(task)
+            task.add_done_callback(synth_tasks.discard)
+            pending.put_nowait((text, audio))
+
+    async def send_audio():
+        writer = PCMWriter(config["sample_format"])
+        while True:
+            text, audio = await pending.get()
+            if audio is None:
+                if text == "closed":
+                    return
+                await websocket.send_json({"type": text})
+                continue
+            started = False
+            while True:
+                item = await audio.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    await websocket.send_json({"type": "error", "message": str(item)})
+                    continue
+                sr, chunk = item
+                if not started:
+                    await websocket.send_json({"type": "segment_start", "text": text, "sample_rate": sr})
+                    started = True
+                await websocket.send_bytes(writer.write(chunk))
+            if started:
+                await websocket.send_json({"type": "segment_end"})
+
+    async def cancel():
+        segmenter.reset()
+        while not pending.empty():
+            pending.get_nowait()
+        for task in list(synth_tasks):
+            task.cancel()
+        await asyncio.gather(*synth_tasks, return_exceptions=True)
+
+    sender = asyncio.create_task(send_audio())
+    start_segments(segmenter.feed(config.pop("text", None) or ""))
+    try:
+        while True:
+            message = await websocket.receive_json()
+            kind = message.get("type", "text")
+            if kind == "text":
+                start_segments(segmenter.feed(message.get("text", "")))
+            elif kind == "flush":
+                start_segments(segmenter.flush())
+                pending.put_nowait(("flushed", None))
+            elif kind == "cancel":
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+                await cancel()
+                await websocket.send_json({"type": "cancelled"})
+                sender = asyncio.create_task(send_audio())
+            elif kind == "close":
+                start_segments(segmenter.flush())
+                pending.put_nowait(("closed", None))
+                await sender
+                await websocket.close()
+                return
+            else:
+                await websocket.send_json({"type": "error", "message": f"unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        await cancel()
+
+
+def collect_worker_metrics() -> list:
+    lines = []
+    for name, type, help, read in [
+        ("tts_worker_pending", "gauge", "Queued and running requests per TTS replica", lambda worker: worker.pending),
+        (
+            "tts_voice_cache_entries",
+            "gauge",
+            "Voices held in the replica's voice cache",
+            lambda worker: len(worker.tts.voice_cache),
+        ),
+        ("tts_voice_cache_hits_total", "counter", "Voice cache hits", lambda worker: worker.tts.voice_cache.hits),
+        ("tts_voice_cache_misses_total", "counter", "Voice cache misses", lambda worker: worker.tts.voice_cache.misses),
+        (
+            "tts_voice_cache_evictions_total",
+            "counter",
+            "Voice cache evictions",
+            lambda worker: worker.tts.voice_cache.evictions,
+        ),
+    ]:
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {type}"])
+        for worker in tts_pool.workers:
+            lines.append(f'{name}{{worker="{worker.index}"}} {read(worker)}')
+    return lines
+
+
+def collect_g2p_cache_metrics() -> list:
+    # the G2P cache is shared by the replicas of the process
+    lines = []
+    for name, type, help, value in [
+        ("tts_g2p_cache_entries", "gauge", "Entries held in the in-memory G2P cache", len(G2P_CACHE)),
+        ("tts_g2p_cache_hits_total", "counter", "G2P cache hits", G2P_CACHE.hits),
+        ("tts_g2p_cache_misses_total", "counter", "G2P cache misses", G2P_CACHE.misses),
+    ]:
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {type}", f"{name} {value}"])
+    return lines
+
+
+def collect_startup_metrics() -> list:
+    name = "tts_startup_seconds"
+    lines = [f"# HELP {name} Seconds spent loading each component when the TTS replica started", f"# TYPE {name} gauge"]
+    for worker in tts_pool.workers:
+        for component, seconds in worker.tts.startup_report.items():
+            lines.append(f'{name}{{worker="{worker.index}",component="{component}"}} {seconds}')
+    return lines
+
+
+REGISTRY.add_collector(collect_worker_metrics)
+REGISTRY.add_collector(collect_g2p_cache_metrics)
+REGISTRY.add_collector(collect_startup_metrics)
+
+
+@APP.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @APP.get("/control")
 async def control(command: str = None):
     if command is None:
@@ -399,11 +709,15 @@ async def tts_get_endpoint(
     fragment_interval: float = 0.3,
     seed: int = -1,
     media_type: str = "wav",
+    sample_format: str = "int16",
     streaming_mode: bool = False,
     parallel_infer: bool = True,
     repetition_penalty: float = 1.35,
     sample_steps: int = 32,
     super_sampling: bool = False,
+    timeout: float = None,
+    gpt_model: str = None,
+    sovits_model: str = None,
 ):
     req = {
         "text": text,
@@ -423,11 +737,15 @@ async def tts_get_endpoint(
         "fragment_interval": fragment_interval,
         "seed": seed,
         "media_type": media_type,
+        "sample_format": sample_format,
         "streaming_mode": streaming_mode,
         "parallel_infer": parallel_infer,
         "repetition_penalty": float(repetition_penalty),
         "sample_steps": int(sample_steps),
         "super_sampling": super_sampling,
+        "timeout": timeout,
+        "gpt_model": gpt_model,
+        "sovits_model": sovits_model,
     }
     return await tts_handle(req)
 
@@ -441,7 +759,7 @@ async def tts_post_endpoint(request: TTS_Request):
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
     try:
-        tts_pipeline.set_ref_audio(refer_audio_path)
+        await broadcast(lambda tts: tts.set_ref_audio(refer_audio_path))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "set refer audio failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
@@ -467,11 +785,12 @@ async def set_refer_aduio(refer_audio_path: str = None):
 
 
 @APP.get("/set_gpt_weights")
-async def set_gpt_weights(weights_path: str = None):
+async def set_gpt_weights(weights_path: str = None, name: str = None, activate: bool = True):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "gpt weight path is required"})
-        tts_pipeline.init_t2s_weights(weights_path)
+        # loaded in the background, requests keep being served by the current weights meanwhile
+        await for_each_worker(lambda tts: tts.load_weights("t2s", weights_path, name, activate))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change gpt weight failed", "Exception": str(e)})
 
@@ -479,16 +798,37 @@ async def set_gpt_weights(weights_path: str = None):
 
 
 @APP.get("/set_sovits_weights")
-async def set_sovits_weights(weights_path: str = None):
+async def set_sovits_weights(weights_path: str = None, name: str = None, activate: bool = True):
     try:
         if weights_path in ["", None]:
             return JSONResponse(status_code=400, content={"message": "sovits weight path is required"})
-        tts_pipeline.init_vits_weights(weights_path)
+        await for_each_worker(lambda tts: tts.load_weights("vits", weights_path, name, activate))
     except Exception as e:
         return JSONResponse(status_code=400, content={"message": "change sovits weight failed", "Exception": str(e)})
     return JSONResponse(status_code=200, content={"message": "success"})
 
 
+MODEL_KIND_NAMES = {"gpt": "t2s", "sovits": "vits"}
+
+
+@APP.get("/models")
+async def list_models():
+    # every replica loads the same models, the first one is representative
+    models = tts_pool.workers[0].tts.models.describe()
+    return JSONResponse(status_code=200, content={kind: models[MODEL_KIND_NAMES[kind]] for kind in MODEL_KIND_NAMES})
+
+
+@APP.get("/unload_weights")
+async def unload_weights(kind: str = None, name: str = None):
+    try:
+        if kind not in MODEL_KIND_NAMES or name in ["", None]:
+            return JSONResponse(status_code=400, content={"message": "kind (gpt/sovits) and name are required"})
+        await for_each_worker(lambda tts: tts.unload_weights(MODEL_KIND_NAMES[kind], name))
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"message": "unload weight failed", "Exception": str(e)})
+    return JSONResponse(status_code=200, content={"message": "success"})
+
+
 if __name__ == "__main__":
     try:
         if host == "None":  # 在调用时使用 -a None 参数，可以让api监听双栈
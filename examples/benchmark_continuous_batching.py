@@ -0,0 +1,77 @@
+import os, sys, time
+import asyncio
+import numpy as np
+
+cwd = os.getcwd()
+sys.path.append(cwd)
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+# Measures the throughput of concurrent streaming requests on one replica with and without continuous batching
+
+config = {
+    "custom": {
+        "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+        "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+        "device": "cuda",
+        "is_half": False,
+        "t2s_weights_path": "GPT_SoVITS/pretrained_models/s1v3.ckpt",
+        "version": "v2ProPlus",
+        "vits_weights_path": "GPT_SoVITS/pretrained_models/v2Pro/s2Gv2ProPlus.pth",
+        "continuous_batching_size": 8,
+    }
+}
+
+tts_config = TTS_Config(config) # or you can use and edit "GPT_SoVITS/configs/tts_infer.yaml"
+tts_pipeline = TTS(tts_config)
+
+inputs = {
+    "text": "", # your text to be synthesized
+    "text_lang": "", # your text's language
+    "ref_audio_path": "", # your audio file path
+    "prompt_text": "", # your audio file's transcription
+    "prompt_lang": "", # your audio file's language
+    "return_fragment": True, # streaming enabled
+    "parallel_infer": False,
+    "initial_chunk_size": 10,
+    "chunk_increase_rate": 5,
+    "max_chunk_size": 20,
+    "seed": 42,
+}
+
+concurrency_levels = [1, 2, 4, 8]
+
+
+async def request() -> tuple:
+    start_time = time.perf_counter()
+    first_chunk = None
+    audio_seconds = 0.0
+    async for sr, chunk in tts_pipeline.run_async(inputs):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start_time
+        audio_seconds += len(chunk) / sr
+    return first_chunk, audio_seconds
+
+
+async def benchmark(concurrency: int) -> tuple:
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*[request() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+    first_chunks = np.array([first_chunk for first_chunk, _ in results])
+    audio_seconds = sum(seconds for _, seconds in results)
+    return elapsed, audio_seconds, first_chunks
+
+
+for continuous_batching in [False, True]:
+    tts_pipeline.configs.continuous_batching = continuous_batching
+
+    # Warmup, this also loads the voice
+    asyncio.run(benchmark(1))
+
+    for concurrency in concurrency_levels:
+        elapsed, audio_seconds, first_chunks = asyncio.run(benchmark(concurrency))
+        print(
+            f"continuous_batching={continuous_batching} concurrency={concurrency}: "
+            f"{audio_seconds / elapsed:.2f}s of audio per second, wall {elapsed:.2f}s, "
+            f"time to first chunk mean {first_chunks.mean() * 1000:.1f}ms, max {first_chunks.max() * 1000:.1f}ms"
+        )
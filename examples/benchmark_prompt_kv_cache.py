@@ -0,0 +1,113 @@
+import os, sys, time
+import numpy as np
+import torch
+
+cwd = os.getcwd()
+sys.path.append(cwd)
+
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+
+# Measures the time to first audio chunk with and without reusing the T2S K/V of the reference prompt
+# (experimental_prompt_kv_cache), and how far the cached prompt moves the output away from the exact prefill
+
+config = {
+    "custom": {
+        "bert_base_path": "GPT_SoVITS/pretrained_models/chinese-roberta-wwm-ext-large",
+        "cnhuhbert_base_path": "GPT_SoVITS/pretrained_models/chinese-hubert-base",
+        "device": "cuda",
+        "is_half": False,
+        "t2s_weights_path": "GPT_SoVITS/pretrained_models/s1v3.ckpt",
+        "version": "v2ProPlus",
+        "vits_weights_path": "GPT_SoVITS/pretrained_models/v2Pro/s2Gv2ProPlus.pth",
+    }
+}
+
+tts_config = TTS_Config(config) # or you can use and edit "GPT_SoVITS/configs/tts_infer.yaml"
+tts_pipeline = TTS(tts_config)
+
+inputs = {
+    "text": "", # your text to be synthesized
+    "text_lang": "", # your text's language
+    "ref_audio_path": "", # your audio file path
+    "prompt_text": "", # your audio file's transcription
+    "prompt_lang": "", # your audio file's language
+    "return_fragment": True, # streaming enabled
+    "parallel_infer": False,
+    "initial_chunk_size": 10,
+    "chunk_increase_rate": 5,
+    "max_chunk_size": 20,
+    "seed": 42,
+}
+
+runs = 10
+
+
+def time_to_first_chunk(inputs: dict) -> float:
+    start_time = time.perf_counter()
+    generator = tts_pipeline.run(inputs)
+    next(generator)
+    elapsed = time.perf_counter() - start_time
+    generator.close()
+    return elapsed
+
+
+for prompt_kv_cache in [False, True]:
+    bench_inputs = inputs.copy()
+    bench_inputs["experimental_prompt_kv_cache"] = prompt_kv_cache
+
+    # Warmup, this also builds the prompt K/V cache of the voice
+    time_to_first_chunk(bench_inputs)
+
+    timings = np.array([time_to_first_chunk(bench_inputs) for _ in range(runs)])
+    print(
+        f"prompt_kv_cache={prompt_kv_cache}: time to first chunk "
+        f"mean {timings.mean() * 1000:.1f}ms, median {np.median(timings) * 1000:.1f}ms, min {timings.min() * 1000:.1f}ms"
+    )
+
+
+# Quality: greedy decoding (top_k=1) of every segment, with the exact prefill and with the cached prompt.
+# Any difference comes from the attention layout of the cache, which the model was not trained on.
+@torch.no_grad()
+def semantic_tokens(prompt_kv_cache: bool) -> list:
+    device = tts_pipeline.configs.device
+    data = tts_pipeline.text_preprocessor.preprocess(
+        inputs["text"], inputs["text_lang"], "cut5", tts_pipeline.configs.version
+    )
+    batches, _ = tts_pipeline.to_batch(
+        data,
+        prompt_data=tts_pipeline.prompt_cache,
+        batch_size=1,
+        split_bucket=False,
+        device=device,
+        precision=tts_pipeline.precision,
+    )
+    prompt = tts_pipeline.prompt_cache["prompt_semantic"].unsqueeze(0).to(device)
+    kv_cache = tts_pipeline._get_prompt_kv_cache() if prompt_kv_cache else None
+    segments = []
+    for item in batches:
+        chunks = tts_pipeline.t2s_model.model.infer_panel_stream(
+            item["all_phones"][0].unsqueeze(0),
+            item["all_phones_len"][0],
+            prompt,
+            item["all_bert_features"][0].unsqueeze(0),
+            initial_chunk_size=inputs["initial_chunk_size"],
+            chunk_increase_rate=inputs["chunk_increase_rate"],
+            max_chunk_size=inputs["max_chunk_size"],
+            top_k=1,
+            early_stop_num=tts_pipeline.configs.hz * tts_pipeline.configs.max_sec,
+            prompt_kv_cache=kv_cache,
+        )
+        segments.append(torch.cat(list(chunks), dim=1)[0].cpu().numpy())
+    return segments
+
+
+exact, cached = semantic_tokens(False), semantic_tokens(True)
+for i, (a, b) in enumerate(zip(exact, cached)):
+    n = min(len(a), len(b))
+    diverged = np.nonzero(a[:n] != b[:n])[0]
+    print(
+        f"segment {i}: {len(a)} -> {len(b)} tokens, {np.mean(a[:n] == b[:n]) * 100:.1f}% identical, "
+        f"first difference at token {diverged[0] if len(diverged) > 0 else '-'}"
+    )
+identical = sum(int(np.sum(a[: min(len(a), len(b))] == b[: min(len(a), len(b))])) for a, b in zip(exact, cached))
+print(f"greedy tokens identical to the exact prefill: {identical / max(1, sum(len(a) for a in exact)) * 100:.1f}%")
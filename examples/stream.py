@@ -33,6 +33,8 @@ inputs = {
     "initial_chunk_size": 10, # the amount of tokens to begin yielding audio for
     "chunk_increase_rate": 5, # the amount of tokens to increase the chunk size by
     "max_chunk_size": 20, # the maximum amount of tokens to be yielded per chunk
+    "context_size": 25, # the amount of already decoded tokens used as left context when decoding a chunk
+    "lookahead_size": 3, # the amount of tokens held back per chunk until their right context is generated
 }
 
 # Warmup the model for faster inference